@@ -0,0 +1,374 @@
+# Benchmark für den Digitalen Bilderrahmen. Läuft ohne Bildschirm, Mikrofon und Internet:
+# Anzeige, Mikrofon und Spracherkennung werden ersetzt, die Bilder werden künstlich erzeugt.
+#
+#   python3 benchmark.py                             # Messen und ausgeben
+#   python3 benchmark.py --count 200 --size 4000x3000
+#   python3 benchmark.py --save baseline.json        # Ergebnis als Referenz speichern
+#   python3 benchmark.py --compare baseline.json     # Vergleichen, Exit-Code 1 bei Verschlechterung
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from threading import Thread, Lock
+
+import cv2
+import numpy as np
+
+import bilderrahmen as br
+
+# Erlaubte Verschlechterung gegenüber der Referenz, bevor --compare fehlschlägt
+DEFAULT_TOLERANCE = 0.25
+
+# Kennzahlen, bei denen ein grösserer Wert besser ist (alle anderen: kleiner ist besser)
+HIGHER_IS_BETTER = {"slideshow.fps", "slideshow.transition_fps"}
+
+# Erzeugt count JPEG-Bilder (Farbverlauf + Rechtecke, damit der Encoder etwas zu tun hat)
+def make_library(folder, count, width, height, seed=1):
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    paths = []
+    for i in range(count):
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[:, :, 0] = gradient
+        img[:, :, 1] = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        img[:, :, 2] = (i * 37) % 256
+        for _ in range(20):
+            x1, y1 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            x2, y2 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, -1)
+        path = os.path.join(folder, f"bild_{i:05d}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+# Leitet alle Dateien des Bilderrahmens in das Arbeitsverzeichnis um
+def configure(image_folder, workdir):
+    br.DECODE_LOG = False
+    br.image_folder = image_folder
+    br.library = br.LibraryIndexer(image_folder, os.path.join(workdir, "library_index.json"))
+    br.favorites.path = os.path.join(workdir, "favorites.json")
+    br.favorites.journal_path = os.path.join(workdir, "favorites.journal")
+    br.rendition_cache.folder = os.path.join(workdir, "cache")
+    br.icon_atlas = br.IconAtlas(atlas_path=os.path.join(workdir, "icon_atlas.npz"))
+    br.frame_cache.clear()
+    br.load_images()
+    br.load_favorites()
+
+def summarize(seconds):
+    if not seconds:
+        return {"count": 0}
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+# Dekodieren (mit verkleinertem Dekodieren) und Einpassen in Displaygrösse, ohne Caches
+def bench_decode(paths):
+    decode, resize = [], []
+    buffer = br.frame_pool.acquire()
+    for path in paths:
+        start = time.perf_counter()
+        img = br.load_display_image(path, br.SCREEN_WIDTH, br.SCREEN_HEIGHT)
+        decoded = time.perf_counter()
+        br.resize_and_center_image(img, br.SCREEN_WIDTH, br.SCREEN_HEIGHT, out=buffer)
+        decode.append(decoded - start)
+        resize.append(time.perf_counter() - decoded)
+    br.frame_pool.release(buffer)
+    return {"decode": summarize(decode), "resize": summarize(resize)}
+
+# Zusammensetzen eines Bildes wie in slideshow_thread: Überblendung, Menü, Info-Overlay, Rahmen
+def bench_compose(paths, frames=200):
+    transitions = br.TransitionEngine()
+    snap = br.SlideshowSnapshot(menu_visible=True, current_image=paths[0])
+    frame_list = [br.get_display_frame(path) for path in paths[:2]]
+    timings = []
+    for i in range(frames):
+        start = time.perf_counter()
+        now = i / br.TRANSITION_FPS
+        transitions.show(i // br.TRANSITION_FPS, frame_list[(i // br.TRANSITION_FPS) % 2], 1.0, now)
+        frame = transitions.compose(now)
+        br.draw_menu(frame, snap)
+        if i % 2:
+            br.draw_info_overlay(frame)
+        cv2.rectangle(frame, (0, 0), (br.SCREEN_WIDTH - 1, br.SCREEN_HEIGHT - 1), (0, 255, 0), 10)
+        timings.append(time.perf_counter() - start)
+    for cached in frame_list:
+        br.frame_pool.release(cached)
+    return summarize(timings)
+
+# Ken-Burns-Effekt: Vorlage pro Bild vorbereiten, danach Zeit pro bewegtem Bild (Ausschnitt + warpAffine)
+def bench_ken_burns(paths, frames=200):
+    prepare = []
+    for path in paths[:5]:
+        start = time.perf_counter()
+        br.load_ken_burns_source(path, br.SCREEN_WIDTH, br.SCREEN_HEIGHT)
+        prepare.append(time.perf_counter() - start)
+    engine = br.KenBurnsEngine()
+    engine.retarget(paths[:1])
+    while engine.frame(paths[0], 10.0, False, 0.0) is None:
+        time.sleep(0.01)
+    timings = []
+    for i in range(frames):
+        start = time.perf_counter()
+        engine.frame(paths[0], 10.0, False, i * 10.0 / frames)
+        timings.append(time.perf_counter() - start)
+    engine.shutdown()
+    return {"prepare": summarize(prepare), "frame": summarize(timings)}
+
+# Ausgabe in den Framebuffer (normale Datei statt /dev/fb0): Zeit pro Bild für Pixelformat und Drehung
+def bench_framebuffer(workdir, frames=100):
+    frame = np.random.default_rng(3).integers(0, 256, (br.SCREEN_HEIGHT, br.SCREEN_WIDTH, 3), dtype=np.uint8)
+    results = {}
+    for bits in (16, 32):
+        for rotation in (0, 90):
+            path = os.path.join(workdir, f"fb{bits}_{rotation}.raw")
+            open(path, "wb").close()
+            fb = br.FramebufferDisplay(device=path, rotation=rotation, touch_device=os.devnull, bits_per_pixel=bits)
+            fb.open(lambda *args: None)
+            timings = []
+            for _ in range(frames):
+                start = time.perf_counter()
+                fb.show(frame)
+                timings.append(time.perf_counter() - start)
+            fb.close()
+            results[f"rgb{bits}_rot{rotation}"] = summarize(timings)
+    return results
+
+# Ersatz für das Vollbildfenster: zählt angezeigte Bilder und spielt Berührungen ein
+class HeadlessDisplay:
+    def __init__(self):
+        self.on_click = None
+        self.show_times = []
+        self.shown_images = []
+        self.tap_latencies = []
+        self._taps = deque()
+        self._tap_pending = None
+        self._lock = Lock()
+
+    def open(self, on_click):
+        self.on_click = on_click
+
+    def show(self, frame):
+        now = time.perf_counter()
+        with self._lock:
+            self.show_times.append(now)
+            self.shown_images.append((now, br.state.snapshot().current_image))
+            if self._tap_pending is not None:
+                self.tap_latencies.append(now - self._tap_pending)
+                self._tap_pending = None
+
+    # Berührung an Bildschirmkoordinaten (wie vom Touch-Display, also gespiegelt)
+    def tap(self, x, y):
+        with self._lock:
+            self._taps.append((time.perf_counter(), x, y))
+
+    def wait(self, delay_ms):
+        end = time.perf_counter() + delay_ms / 1000.0
+        while True:
+            with self._lock:
+                tap = self._taps.popleft() if self._taps else None
+            if tap is not None:
+                # Wie bei cv2.waitKey: der Callback läuft innerhalb von wait()
+                with self._lock:
+                    self._tap_pending = tap[0]
+                self.on_click(cv2.EVENT_LBUTTONDOWN, tap[1], tap[2], 0, None)
+                return -1
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                return -1
+            time.sleep(min(remaining, 0.005))
+
+    def close(self):
+        pass
+
+    def first_show_after(self, since, image):
+        with self._lock:
+            for shown_at, shown_image in self.shown_images:
+                if shown_at >= since and shown_image == image:
+                    return shown_at
+        return None
+
+# Ersatz für das Mikrofon: liefert künstliche Äusserungen (Rauschen + Tonfolge), getrennt durch Stille
+class SyntheticMicrophone:
+    def __init__(self, utterances, rate=16000, chunk_ms=20, seed=2):
+        rng = np.random.default_rng(seed)
+        parts = []
+        for _ in range(utterances):
+            parts.append(rng.normal(0, 30, int(0.6 * rate)))
+            t = np.arange(int(0.8 * rate)) / rate
+            parts.append(6000 * np.sin(2 * np.pi * (200 + 300 * t) * t) + rng.normal(0, 300, len(t)))
+            parts.append(rng.normal(0, 30, int(0.8 * rate)))
+        self.samples = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+        self.rate = rate
+        self.chunk = int(rate * chunk_ms / 1000)
+        self.position = 0
+
+    def read(self):
+        if self.position >= len(self.samples):
+            return None
+        chunk = self.samples[self.position:self.position + self.chunk]
+        self.position += len(chunk)
+        return chunk
+
+# Diashow mit Ersatz-Anzeige: Bilder pro Sekunde, Berührung bis Anzeige, Sprachbefehl bis Anzeige
+def bench_slideshow(duration=6.0, taps=10, commands=5):
+    headless = HeadlessDisplay()
+    br.display = headless
+    br.prefetcher = br.Prefetcher()
+    br.state.update(running=True, paused=False, current_speed=2, transition_duration=1.0,
+                    current_index=0, current_image=None, last_image_update_time=0.0,
+                    favorites_mode=False, menu_visible=False, info_visible=False)
+    thread = Thread(target=br.slideshow_thread)
+    start = time.perf_counter()
+    thread.start()
+
+    # Berührungen neben die Buttons: Menü abwechselnd ein- und ausblenden
+    time.sleep(0.5)
+    for _ in range(taps):
+        headless.tap(br.SCREEN_WIDTH // 2, br.SCREEN_HEIGHT - 100)
+        time.sleep(0.2)
+
+    # Sprachbefehle: Erkennungswort und Befehl in einer Äusserung, Erkenner liefert festen Text.
+    # Wie im Sprachthread wird der Befehlsabgleich vorher vorbereitet.
+    br.command_matcher.prepare()
+    backend = br.ScriptedBackend(["hey berry vorwärts"] * commands)
+    listener = br.VoiceListener(SyntheticMicrophone(commands), br.TemplateHotwordSpotter(), backend)
+    command_latencies = []
+    matching = []
+    for _ in range(commands):
+        br.state.update(paused=True)
+        segment = listener.next_segment()
+        if segment is None:
+            break
+        issued = time.perf_counter()
+        heard, match = listener.hear(segment)
+        matching.append(time.perf_counter() - issued)
+        if not (heard and match):
+            continue
+        br.execute_command(match.command, match.text, match.number)
+        target = br.state.snapshot().current_image
+        deadline = issued + 5.0
+        shown = None
+        while shown is None and time.perf_counter() < deadline:
+            time.sleep(0.002)
+            shown = headless.first_show_after(issued, target)
+        if shown is not None:
+            command_latencies.append(shown - issued)
+        time.sleep(0.2)
+
+    remaining = duration - (time.perf_counter() - start)
+    br.state.update(paused=False)
+    if remaining > 0:
+        time.sleep(remaining)
+    br.state.update(running=False)
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Bildrate während Überblendungen: nur Bilder mit kurzem Abstand zum vorherigen
+    intervals = np.diff(headless.show_times)
+    fast = intervals[intervals < 2.0 / br.TRANSITION_FPS]
+    return {
+        "fps": round(len(headless.show_times) / elapsed, 2),
+        "transition_fps": round(float(len(fast) / fast.sum()), 2) if len(fast) else 0.0,
+        "tap_to_display": summarize(headless.tap_latencies),
+        "command_to_display": summarize(command_latencies),
+        "command_matching": summarize(matching),
+        "frame_allocations_max": br.frame_pool.stats()["max_per_frame"],
+    }
+
+def peak_rss_mb():
+    # ru_maxrss ist unter Linux in KiB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# Verschachtelte Ergebnisse zu {"slideshow.fps": ..., "decode.decode.p95_ms": ...}
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not key == "count":
+            flat[name] = value
+    return flat
+
+# Gibt die Liste der Verschlechterungen gegenüber der Referenz zurück
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    current = flatten(results)
+    regressions = []
+    for name, reference in flatten(baseline).items():
+        if name not in current or not reference:
+            continue
+        value = current[name]
+        if name in HIGHER_IS_BETTER:
+            worse = value < reference * (1.0 - tolerance)
+        else:
+            worse = value > reference * (1.0 + tolerance)
+        if worse:
+            regressions.append(f"{name}: {value} (Referenz {reference})")
+    return regressions
+
+def run(count, width, height, workdir):
+    image_folder = os.path.join(workdir, "images")
+    start = time.perf_counter()
+    paths = make_library(image_folder, count, width, height)
+    print(f"{count} Testbilder {width}x{height} in {time.perf_counter() - start:.1f} s erzeugt.")
+    configure(image_folder, workdir)
+
+    results = {"config": {"count": count, "width": width, "height": height}}
+    results["decode"] = bench_decode(paths)
+    results["compose"] = bench_compose(paths)
+    results["ken_burns"] = bench_ken_burns(paths)
+    results["framebuffer"] = bench_framebuffer(workdir)
+    results["slideshow"] = bench_slideshow()
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark für den Digitalen Bilderrahmen (ohne Hardware)")
+    parser.add_argument("--count", type=int, default=20, help="Anzahl Testbilder")
+    parser.add_argument("--size", default="3264x2448", help="Auflösung der Testbilder, z.B. 4000x3000")
+    parser.add_argument("--workdir", help="Arbeitsverzeichnis (Standard: temporär, wird gelöscht)")
+    parser.add_argument("--save", help="Ergebnis als Referenz in diese Datei schreiben")
+    parser.add_argument("--compare", help="Mit Referenz-Datei vergleichen")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bilderrahmen-bench-")
+    try:
+        results = run(args.count, width, height, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Referenz gespeichert: {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Verschlechterungen gegenüber der Referenz:")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print("Keine Verschlechterung gegenüber der Referenz.")
+
+if __name__ == "__main__":
+    main()
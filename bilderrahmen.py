@@ -1,13 +1,35 @@
 import os
+import abc
 import cv2
 import json
 import numpy as np
-import speech_recognition as sr
-from threading import Thread, Lock
-from rapidfuzz import fuzz, process
+from threading import Thread, Lock, Event, Condition, local
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dataclasses import dataclass, asdict
+from types import SimpleNamespace
+import bisect
 import ctypes
 import re
+import hashlib
+import hmac
+import struct
 import time
+import wave
+import functools
+import random
+import asyncio
+import multiprocessing
+import itertools
+import select
+import sqlite3
+import shutil
+import ipaddress
+import urllib.parse
+import weakref
 
 # Bekannte Befehle
 known_commands = [
@@ -25,47 +47,447 @@ known_commands = [
     "vorwärts",
     "zurück",
     "pause",
-    "play"
+    "play",
+    "zufällige reihenfolge",
+    "normale reihenfolge",
+    "zeige bilder von",
+    "bilder aus",
+    "bewegte bilder",
+    "ruhige bilder"
 ]
 
+# Befehle, auf die ein freier Text folgt ("bilder aus italien", "zeige bilder vom juli 2019")
+TEXT_ARGUMENT_COMMANDS = ["zeige bilder von", "bilder aus"]
+
+# Startzeit für die Messung der einzelnen Startphasen
+STARTUP_TIME = time.perf_counter()
+
 # Unterdrückt ALSA-Fehlerausgaben (Raspberry-spezifisch) - sehr viele Log-Meldungen, welche nicht relevant sind
-asound = ctypes.CDLL('libasound.so')
-asound.snd_lib_error_set_handler(None)
+# Wird erst beim Öffnen des Mikrofons geladen. Fehlt ALSA (z.B. beim Benchmark auf einem anderen Rechner), läuft das Skript trotzdem.
+@functools.lru_cache(maxsize=None)
+def silence_alsa_errors():
+    try:
+        asound = ctypes.CDLL('libasound.so')
+        asound.snd_lib_error_set_handler(None)
+        return asound
+    except OSError:
+        return None
 
 # Globale Variablen
 image_folder = "/home/joelh/DigiBilderrahmen/script/images/"
 favorites_file = "favorites.json"
+favorites_journal_file = "favorites.journal"
 icons_folder = "/home/joelh/DigiBilderrahmen/script/Icons/"
+icon_atlas_file = "icon_atlas.npz"   # Fertig aufbereitete Icons, wird bei geänderten Icons neu erstellt
+rendition_folder = "/home/joelh/DigiBilderrahmen/script/cache/"
+library_index_file = "library_index.json"
+catalog_file = "catalog.sqlite"   # Metadaten der Bilder (Aufnahmedatum, Ort, Grösse) für Abfragen per Sprache
+dedup_cache_file = "image_hashes.json"   # Ähnlichkeits-Hashes der Bilder (Pfad -> mtime, Hash)
+sync_state_file = "sync_state.json"      # Inhalts-Hashes und gemeinsame Favoriten für den Abgleich mehrerer Rahmen
+hotword_folder = "/home/joelh/DigiBilderrahmen/script/hotword/"   # WAV-Aufnahmen von "Hey Berry" als Vorlagen
+
+# Bildbibliothek: Unterordner werden mit eingelesen und regelmässig auf neue/gelöschte Bilder geprüft
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTENSIONS = ('.gif', '.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm')
+
+# Videos und GIFs: werden beim Anzeigen laufend dekodiert (nie ganz im Speicher)
+VIDEO_QUEUE_FRAMES = 4            # Vorausdekodierte Bilder (je ca. 1.1 MB bei 800x480)
+VIDEO_DEFAULT_FPS = 25.0          # Falls die Datei keine (sinnvolle) Bildrate angibt
+LIBRARY_RESCAN_INTERVAL = 300     # Sekunden zwischen zwei Durchläufen im Hintergrund
+
+# Orte für "bilder aus ...": grobe Rechtecke (Breite von, Breite bis, Länge von, Länge bis) für die GPS-Position.
+# Der erste passende Eintrag gilt, kleine Länder stehen deshalb vor grossen. Eigene Orte (z.B. "ferienhaus")
+# einfach oben einfügen. Zusätzlich werden Ordnernamen durchsucht ("bilder aus toskana" -> Ordner "Toskana 2019").
+PLACES = {
+    "liechtenstein": (47.04, 47.28, 9.47, 9.64),
+    "schweiz": (45.82, 47.81, 5.96, 10.49),
+    "österreich": (46.37, 49.02, 9.53, 17.16),
+    "niederlande": (50.75, 53.56, 3.36, 7.23),
+    "belgien": (49.50, 51.51, 2.54, 6.41),
+    "portugal": (36.96, 42.15, -9.53, -6.19),
+    "kroatien": (42.39, 46.56, 13.49, 19.45),
+    "deutschland": (47.27, 55.06, 5.87, 15.04),
+    "italien": (36.62, 47.09, 6.63, 18.52),
+    "frankreich": (41.33, 51.09, -5.14, 9.56),
+    "spanien": (35.95, 43.79, -9.30, 4.33),
+    "griechenland": (34.80, 41.75, 19.37, 28.24),
+}
+CATALOG_BATCH = 500               # So viele Bilder pro Schreibvorgang in den Katalog
+
+# Doppelte Bilder (Serienbilder, mehrfach synchronisierte Alben): von ähnlichen Bildern wird nur eines gezeigt
+DEDUP_ENABLED = True
+DEDUP_METHOD = "dhash"            # "dhash" oder "phash" (robuster bei Helligkeitsänderungen)
+DEDUP_THRESHOLD = 6               # Max. Anzahl unterschiedlicher Bits (von 64). Werte ab 8 machen die Suche deutlich langsamer.
+DEDUP_WORKERS = None              # Prozesse zum Berechnen der Hashes, None = alle Kerne
+DEDUP_BATCH = 500                 # Nach so vielen neuen Hashes wird der Cache gespeichert
+
+# Sprachsteuerung: Das Erkennungswort wird lokal erkannt, erst danach wird der Befehl an den Erkenner geschickt
+MIC_DEVICE_NAME = "USB"           # Teil des Mikrofon-Namens (siehe sr.Microphone.list_microphone_names())
+MIC_DEVICE_INDEX = None           # Fester Mikrofon-Index, falls kein Name passt (None = Standardgerät)
+AUDIO_BUFFER_SECONDS = 30         # Ringpuffer für die Aufnahme
+NOISE_FLOOR_WINDOW = 10.0         # Sekunden, über die das Grundrauschen geschätzt wird
+RECOGNIZER_BACKEND = "google"     # "google" (online) oder "vosk" (offline, benötigt vosk + Modell)
+VOSK_MODEL_PATH = "/home/joelh/DigiBilderrahmen/script/vosk-model-small-de/"
+HOTWORD_VARIANTS = ["hey berry", "hey baby", "hey barry"]
+RECOGNIZER_ALTERNATIVES = 5       # So viele Varianten (n-best) des Erkenners werden ausgewertet
+COMMAND_MATCH_CUTOFF = 70         # Mindest-Übereinstimmung (%) für einen Befehl
+HOTWORD_THRESHOLD = 0.25          # Max. DTW-Abstand zu einer Vorlage (kleiner = strenger)
+VAD_ENERGY_FACTOR = 3.0           # Sprache, wenn die Lautstärke das x-fache des Grundrauschens übersteigt
+VAD_MIN_RMS = 200                 # Untergrenze für die Sprachschwelle (16-Bit-Samples)
+VAD_PREROLL = 0.2                 # Sekunden vor Sprachbeginn, die mitgenommen werden
+VAD_SILENCE = 0.5                 # Sekunden Stille, nach denen eine Äusserung als beendet gilt
+VAD_MIN_SPEECH = 0.25             # Kürzere Geräusche werden ignoriert
+VAD_MAX_SEGMENT = 4.0             # Längere Äusserungen werden abgeschnitten
+VOICE_DEBUG = False               # Hotword-Abstand und erkannte Texte jeder Äusserung ausgeben
+
+# Steuerung übers Netzwerk (HTTP + WebSocket, benötigt: pip install aiohttp) und Hochladen von Fotos
+API_ENABLED = False
+API_HOST = "127.0.0.1"            # "0.0.0.0" = im ganzen Heimnetz erreichbar
+API_PORT = 8080
+API_TOKEN = None                  # Falls gesetzt, nur mit Header "Authorization: Bearer <token>". Hochladen nur mit Token.
+UPLOAD_FOLDER = "uploads"         # Unterordner von image_folder für hochgeladene Fotos
+UPLOAD_MAX_BYTES = 40 * 1024 * 1024
+UPLOAD_MAX_PIXELS = 100_000_000   # Grössere Bilder werden abgelehnt (Speicher auf dem Pi)
+UPLOAD_WORKERS = 1                # Prozesse zum Dekodieren/Skalieren der Uploads
+UPLOAD_QUEUE = 2                  # So viele Uploads gleichzeitig (je bis UPLOAD_MAX_BYTES im Speicher), weitere -> 503
+
+# Abgleich mehrerer Bilderrahmen im Heimnetz: Bilder, Favoriten und optional das aktuelle Bild (benötigt aiohttp).
+# Startet nur mit gesetztem API_TOKEN (auf allen Rahmen gleich).
+SYNC_ENABLED = False
+SYNC_HOST = "0.0.0.0"
+SYNC_PORT = 8081
+SYNC_PEERS = []                   # z.B. ["http://192.168.1.20:8081"]
+SYNC_ALLOWED_NETWORKS = []        # z.B. ["192.168.1.0/24"]: Rahmen aus diesen Netzen werden automatisch übernommen
+SYNC_DISCOVERY_PORT = 8082        # UDP-Port für die Suche nach anderen Rahmen (None = nur SYNC_PEERS)
+SYNC_INTERVAL = 60                # Sekunden zwischen zwei vollständigen Abgleichen, Änderungen werden sofort gemeldet
+SYNC_POSITION = False             # True = alle Rahmen zeigen dasselbe Bild
+SYNC_TRANSFERS = 2                # Gleichzeitige Downloads
+SYNC_MAX_FILE_BYTES = 2 * 1024**3 # Grössere Dateien werden nicht übernommen
+SYNC_MIN_FREE_BYTES = 1024**3     # So viel muss nach einem Download auf der SD-Karte frei bleiben
+SYNC_WRITE_BYTES = 1024 * 1024    # Heruntergeladenes wird in Blöcken dieser Grösse auf die SD-Karte geschrieben
+
+# Zufällige Reihenfolge: so viele zuletzt gezeigte Bilder kommen nicht gleich wieder
+SHUFFLE_NO_REPEAT = 50
+SHUFFLE_SEED = None               # Feste Zahl = immer gleiche Reihenfolge (z.B. für Tests)
+
+# Favoriten: Änderungen werden gesammelt und verzögert ins Journal geschrieben
+FAVORITES_FLUSH_DELAY = 2.0       # Sekunden, in denen Änderungen zusammengefasst werden
+FAVORITES_COMPACT_EVERY = 200     # Nach so vielen Journal-Einträgen wird favorites.json neu geschrieben
+
+# Zwischenspeicher für fertig skalierte Bilder (800x480 ~ 1.1 MB pro Bild)
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+FRAME_POOL_SIZE = 8               # So viele freie Bildpuffer werden zur Wiederverwendung aufbewahrt
+
+# Vorausladen: so viele Bilder vor bzw. hinter dem aktuellen werden im Hintergrund vorbereitet
+PREFETCH_AHEAD = 3
+PREFETCH_BEHIND = 1
+PREFETCH_WORKERS = 2
+
+# Pro Bild Dekodierfaktor und -zeit ausgeben (zur Fehlersuche, die Zeiten stehen auch in den Metriken)
+DECODE_LOG = False
 
-current_speed = 10
-images = []
-favorites = []
-running = True
-paused = False
-current_image = None
-current_index = 0
-last_image_update_time = time.time()
-favorites_mode = False  # Steuert Favoriten-Slideshow vs. normale Bilder
+# Vorberechnete Bilder in Displaygrösse auf der SD-Karte
+RENDITION_FORMAT = "jpg"          # "jpg" (ca. 100 KB pro Bild) oder "npy" (per mmap, schneller, ca. 1.1 MB pro Bild)
+RENDITION_JPEG_QUALITY = 80
+RENDITION_CACHE_MAX_BYTES = 512 * 1024 * 1024   # Darüber werden die am längsten nicht gebrauchten Dateien gelöscht
+RENDITION_AHEAD = 200             # So viele kommende Bilder der Abspielliste werden im Voraus berechnet
+RENDITION_IDLE_DELAY = 0.5        # Pause zwischen zwei Bildern beim Vorberechnen im Hintergrund
+RENDITION_RESCAN_INTERVAL = 600   # Sekunden bis zum nächsten Durchlauf (neue Bilder, Aufräumen)
+
+# Ken-Burns-Effekt ("bewegte bilder"): langsames Zoomen und Schwenken statt stehender Bilder
+KEN_BURNS_ENABLED = False
+KEN_BURNS_FPS = 20                # Ziel-Bildrate, wird bei zu langsamer Ausgabe automatisch gesenkt
+KEN_BURNS_MIN_FPS = 5
+KEN_BURNS_ZOOM = 1.2              # Stärkster Zoom während eines Bildes
+KEN_BURNS_SOURCE_SCALE = 1.5      # Auflösung der vorbereiteten Vorlage relativ zum Display (Schärfe beim Zoomen)
+
+# Anzeige: "opencv" (Vollbildfenster, benötigt X) oder "framebuffer" (schreibt direkt nach /dev/fb0, Touch über evdev)
+DISPLAY_BACKEND = "opencv"
+FRAMEBUFFER_DEVICE = "/dev/fb0"
+FRAMEBUFFER_ROTATION = 0          # Drehung des Bildes im Uhrzeigersinn: 0, 90, 180 oder 270 Grad
+TOUCH_DEVICE = None               # z.B. "/dev/input/event0" (None = erstes Touch-Gerät aus /proc/bus/input/devices)
 
 # Menü- und UI-Steuerung
-menu_visible = False
-menu_last_interaction = 0.0
-menu_highlight_end = 0.0
 MENU_HIDE_DELAY = 5.0     # Inaktivität -> Menü verschwindet
 BUTTON_HIDE_DELAY = 3.0   # Nach Button-Klick -> Menü verschwindet
-highlighted_button = None
+RENDER_POLL_INTERVAL = 0.05  # Touch-Events werden spätestens nach so vielen Sekunden verarbeitet
+
+# Messwerte (Zeitmessungen im Hauptpfad). Ausgeschaltet kosten die Messpunkte praktisch nichts.
+METRICS_ENABLED = True
+METRICS_FILE = None        # Prometheus-Textdatei, z.B. "metrics.prom" (None = keine, schont die SD-Karte)
+METRICS_PORT = None        # z.B. 9101 -> http://127.0.0.1:9101/metrics (None = kein HTTP)
+METRICS_INTERVAL = 15.0    # Sekunden zwischen zwei Exporten in METRICS_FILE
+METRICS_WINDOW = 300.0     # Zeitfenster (Sekunden) für die "recent"-Werte
+
+# Überblendung beim Bildwechsel
+TRANSITION_DURATION = 1.0  # Sekunden (0 = harter Schnitt), Startwert für transition_duration
+TRANSITION_FPS = 30        # Zwischenbilder pro Sekunde; ist die Diashow zu langsam, werden Schritte ausgelassen
+
+# Histogramm für Zeitmessungen (in Sekunden) mit festen Klassengrenzen
+class LatencyHistogram:
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    # Kurzfassung in Millisekunden: Anzahl, Mittelwert, Maximum und Verteilung
+    def summary(self):
+        mean_ms = self.total / self.count * 1000 if self.count else 0.0
+        buckets = {f"<={b * 1000:g}ms": c for b, c in zip(self.BUCKETS, self.counts)}
+        buckets["mehr"] = self.counts[-1]
+        return {"count": self.count, "mean_ms": round(mean_ms, 3), "max_ms": round(self.max * 1000, 3),
+                "buckets": buckets}
+
+# Lock, das Warte- und Haltezeiten misst. Die Histogramme werden nur mit gehaltenem Lock verändert.
+class InstrumentedLock:
+    def __init__(self, name):
+        self.name = name
+        self.wait_histogram = LatencyHistogram()
+        self.hold_histogram = LatencyHistogram()
+        self._lock = Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        self.wait_histogram.observe(self._acquired_at - start)
+        return True
+
+    def release(self):
+        self.hold_histogram.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def stats(self):
+        return {"wait": self.wait_histogram.summary(), "hold": self.hold_histogram.summary()}
+
+# Histogramm über die letzten window Sekunden: slots Teil-Histogramme, die älteste fällt jeweils weg
+class RollingHistogram:
+    def __init__(self, window=METRICS_WINDOW, slots=6):
+        self.slot_seconds = window / slots
+        self._slots = deque(maxlen=slots)   # (Nummer des Zeitabschnitts, LatencyHistogram)
 
-# Info-Overlay (Legende) beim Klick auf info-Button
-info_visible = False       # Ist das Info-Overlay an?
-info_hide_time = 0.0       # Bis wann soll es sichtbar sein? (time.time() + 10)
+    def observe(self, seconds, now):
+        slot = int(now // self.slot_seconds)
+        if not self._slots or self._slots[-1][0] != slot:
+            self._slots.append((slot, LatencyHistogram()))
+        self._slots[-1][1].observe(seconds)
 
-# Visuelles Feedback
-hotword_feedback_until = 0.0    # Blauer Rand
-command_success_until = 0.0     # Grüner Rand
-command_fail_until = 0.0        # Roter Rand
+    def merged(self, now):
+        oldest = int(now // self.slot_seconds) - self._slots.maxlen + 1
+        result = LatencyHistogram()
+        for slot, histogram in list(self._slots):
+            if slot >= oldest:
+                result.merge(histogram)
+        return result
 
-# Lock für Thread-Sicherheit
-lock = Lock()
+# Sammelt Zeitmessungen (Spans) pro Name: gesamt seit Start und über die letzten METRICS_WINDOW Sekunden.
+# Ausgeschaltet liefert span() einen leeren Kontext und observe() kehrt sofort zurück.
+class Metrics:
+    NO_SPAN = nullcontext()
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._spans = {}            # Name -> (LatencyHistogram, RollingHistogram)
+        self._locks = []            # InstrumentedLock-Objekte
+        self._gauges = {}           # Name -> Funktion, die den aktuellen Wert liefert
+        self._lock = Lock()
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histograms = self._spans.get(name)
+            if histograms is None:
+                histograms = self._spans[name] = (LatencyHistogram(), RollingHistogram())
+            histograms[0].observe(seconds)
+            histograms[1].observe(seconds, time.monotonic())
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def span(self, name):
+        if not self.enabled:
+            return self.NO_SPAN
+        return self._span(name)
+
+    def register_lock(self, lock):
+        self._locks.append(lock)
+
+    def register_gauge(self, name, read):
+        self._gauges[name] = read
+
+    # Kurzfassung aller Spans (letzte METRICS_WINDOW Sekunden) für die Ausgabe beim Beenden
+    def summary(self):
+        now = time.monotonic()
+        with self._lock:
+            return {name: rolling.merged(now).summary() for name, (_, rolling) in sorted(self._spans.items())}
+
+    # Prometheus-Textformat: Histogramme seit Start, dazu Mittelwert/Maximum der letzten Minuten als Gauges
+    def render_prometheus(self):
+        now = time.monotonic()
+        with self._lock:
+            spans = [(name, total.counts[:], total.count, total.total, rolling.merged(now))
+                     for name, (total, rolling) in sorted(self._spans.items())]
+        lines = []
+
+        def histogram(metric, label, values):
+            lines.append(f"# TYPE {metric} histogram")
+            for label_value, counts, count, total in values:
+                cumulative = 0
+                for bound, bucket_count in zip(LatencyHistogram.BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{{label}="{label_value}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{label_value}",le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label}="{label_value}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{{label}="{label_value}"}} {count}')
+
+        histogram("bilderrahmen_span_seconds", "span", [(n, c, k, t) for n, c, k, t, _ in spans])
+        lines.append("# TYPE bilderrahmen_span_recent_mean_seconds gauge")
+        lines.append("# TYPE bilderrahmen_span_recent_max_seconds gauge")
+        for name, _, _, _, recent in spans:
+            mean = recent.total / recent.count if recent.count else 0.0
+            lines.append(f'bilderrahmen_span_recent_mean_seconds{{span="{name}"}} {mean:.6f}')
+            lines.append(f'bilderrahmen_span_recent_max_seconds{{span="{name}"}} {recent.max:.6f}')
+        for kind in ("wait", "hold"):
+            histogram(f"bilderrahmen_lock_{kind}_seconds", "lock",
+                      [(lock.name, h.counts[:], h.count, h.total)
+                       for lock in self._locks for h in [getattr(lock, f"{kind}_histogram")]])
+        for name, read in sorted(self._gauges.items()):
+            try:
+                value = float(read())
+            except Exception:
+                continue
+            lines.append(f"# TYPE bilderrahmen_{name} gauge")
+            lines.append(f"bilderrahmen_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    # Atomar schreiben, damit der Prometheus-Textfile-Collector nie eine halbe Datei liest
+    def write_file(self, path):
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Konnte Messwerte nicht nach {path} schreiben: {e}")
+
+metrics = Metrics()
+
+# Unveränderlicher Zustand von Diashow und Bedienoberfläche. Wird nie verändert, sondern ersetzt.
+@dataclass(frozen=True)
+class SlideshowSnapshot:
+    running: bool = True
+    paused: bool = False
+    current_speed: int = 10
+    transition_duration: float = TRANSITION_DURATION
+    current_image: str = None
+    current_index: int = 0
+    last_image_update_time: float = 0.0
+    favorites_mode: bool = False        # Steuert Favoriten-Slideshow vs. normale Bilder
+    resume_image: str = None            # Bild im anderen Modus, dort geht es beim Zurückwechseln weiter
+    shuffle: bool = False               # Zufällige Reihenfolge
+    library_version: int = 0            # Wird bei jeder Änderung an images/favorites erhöht
+    query: str = None                   # Aktive Abfrage (z.B. "2019", "italien"), dann läuft query_results
+    ken_burns: bool = KEN_BURNS_ENABLED  # Zoomen und Schwenken statt stehender Bilder
+
+    # Menü- und UI-Steuerung
+    menu_visible: bool = False
+    menu_last_interaction: float = 0.0
+    menu_highlight_end: float = 0.0
+    highlighted_button: str = None
+
+    # Info-Overlay (Legende) beim Klick auf info-Button
+    info_visible: bool = False          # Ist das Info-Overlay an?
+    info_hide_time: float = 0.0         # Bis wann soll es sichtbar sein? (time.time() + 10)
+
+    # Visuelles Feedback
+    hotword_feedback_until: float = 0.0    # Blauer Rand
+    command_success_until: float = 0.0     # Grüner Rand
+    command_fail_until: float = 0.0        # Roter Rand
+
+# Gemeinsamer Zustand für alle Threads. Lesen: state.snapshot() (ohne Lock).
+# Schreiben: "with state.transaction() as s:" -> s ist eine veränderbare Kopie, die am Ende als
+# neuer Snapshot veröffentlicht wird. Auch images/favorites werden nur innerhalb einer Transaktion verändert.
+# Innerhalb einer Transaktion keine Datei- oder Bild-Operationen, damit der Lock nur kurz gehalten wird.
+class SharedState:
+    def __init__(self, initial):
+        self.lock = InstrumentedLock("state")
+        self._snapshot = initial
+        self._listeners = []
+
+    def snapshot(self):
+        return self._snapshot
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            draft = SimpleNamespace(**vars(self._snapshot))
+            yield draft
+            new_snapshot = SlideshowSnapshot(**vars(draft))
+            changed = new_snapshot != self._snapshot
+            self._snapshot = new_snapshot
+        if changed:
+            render_scheduler.mark_dirty()
+            for listener in list(self._listeners):
+                listener(new_snapshot)
+
+    # listener(snapshot) wird nach jeder Änderung aufgerufen (ausserhalb des Locks, im ändernden Thread)
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def update(self, **changes):
+        with self.transaction() as s:
+            for name, value in changes.items():
+                setattr(s, name, value)
+
+state = SharedState(SlideshowSnapshot(last_image_update_time=time.time()))
+metrics.register_lock(state.lock)
+
+# Misst eine Startphase und gibt die Dauer aus
+startup_timings = []
+first_frame_shown = Event()
+
+@contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        startup_timings.append((name, end - start))
+        print(f"Start: {name} {(end - start) * 1000:.0f} ms (seit Programmstart {(end - STARTUP_TIME) * 1000:.0f} ms)")
 
 # Anzeigegrößen (z. B. 800x480-Display)
 ICON_SIZE = 64
@@ -104,585 +526,4518 @@ def load_icon_with_white_bg(icon_path, size=(64, 64)):
         return None
 
     if len(icon_rgba.shape) == 3 and icon_rgba.shape[2] == 4:
-        b, g, r, a = cv2.split(icon_rgba)
-        alpha_float = a.astype(np.float32) / 255.0
-        white_bg = np.full((icon_rgba.shape[0], icon_rgba.shape[1], 3), 255, dtype=np.uint8)
-        for c, channel in enumerate([b, g, r]):
-            ch_f = channel.astype(np.float32)
-            white_bg[:, :, c] = (alpha_float * ch_f + (1.0 - alpha_float) * 255.0).astype(np.uint8)
-        icon_bgr = white_bg
+        # Alle Kanäle auf einmal auf weissen Hintergrund legen
+        alpha = icon_rgba[:, :, 3:4].astype(np.float32) / 255.0
+        icon_bgr = (icon_rgba[:, :, :3] * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
     else:
         icon_bgr = icon_rgba
 
     icon_scaled = cv2.resize(icon_bgr, size, interpolation=cv2.INTER_AREA)
     return icon_scaled
 
-# Icons
-icon_langsamer  = load_icon_with_white_bg(os.path.join(icons_folder, "langsamer.png"), (ICON_SIZE, ICON_SIZE))
-icon_schneller  = load_icon_with_white_bg(os.path.join(icons_folder, "schneller.png"), (ICON_SIZE, ICON_SIZE))
-icon_left       = load_icon_with_white_bg(os.path.join(icons_folder, "linker-pfeil.png"), (ICON_SIZE, ICON_SIZE))
-icon_right      = load_icon_with_white_bg(os.path.join(icons_folder, "rechter-pfeil.png"), (ICON_SIZE, ICON_SIZE))
-icon_pause      = load_icon_with_white_bg(os.path.join(icons_folder, "pause.png"), (ICON_SIZE, ICON_SIZE))
-icon_play       = load_icon_with_white_bg(os.path.join(icons_folder, "play-taste.png"), (ICON_SIZE, ICON_SIZE))
-icon_star       = load_icon_with_white_bg(os.path.join(icons_folder, "star.png"), (ICON_SIZE, ICON_SIZE))
-icon_star_true  = load_icon_with_white_bg(os.path.join(icons_folder, "star_true.png"), (ICON_SIZE, ICON_SIZE))
-icon_modus_all  = load_icon_with_white_bg(os.path.join(icons_folder, "all.png"), (ICON_SIZE, ICON_SIZE))
-icon_modus_fav  = load_icon_with_white_bg(os.path.join(icons_folder, "favorite_only.png"), (ICON_SIZE, ICON_SIZE))
-icon_info       = load_icon_with_white_bg(os.path.join(icons_folder, "info.png"), (ICON_SIZE, ICON_SIZE))
-
-# lädt alle Bilder aus dem Image-Pfad
-def load_images():
-    global images, current_image
-    if not os.path.exists(image_folder):
-        print(f"Fehler: Ordner {image_folder} existiert nicht!")
-        return
+# Icons (Schlüssel -> Dateiname im icons_folder)
+ICON_FILES = {
+    "langsamer": "langsamer.png",
+    "schneller": "schneller.png",
+    "left": "linker-pfeil.png",
+    "right": "rechter-pfeil.png",
+    "pause": "pause.png",
+    "play": "play-taste.png",
+    "star": "star.png",
+    "star_true": "star_true.png",
+    "modus_all": "all.png",
+    "modus_fav": "favorite_only.png",
+    "info": "info.png",
+}
 
-    with lock:
-        images = [
-            os.path.join(image_folder, f)
-            for f in os.listdir(image_folder)
-            if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-        ]
-        if images:
-            current_image = images[0]
-        else:
-            print(f"Keine Bilder im Ordner {image_folder} gefunden.")
+# Alle Icons fertig aufbereitet in einer Datei. Wird erst beim ersten Zeichnen des Menüs geladen
+# und nur neu erstellt, wenn sich ein Icon (mtime) oder die Icon-Grösse geändert hat.
+class IconAtlas:
+    def __init__(self, folder=icons_folder, atlas_path=icon_atlas_file, size=ICON_SIZE):
+        self.folder = folder
+        self.atlas_path = atlas_path
+        self.size = size
+        self._icons = None
+        self._lock = Lock()
 
-# Lädt alle Bilder, welche im JSON-File als Favorit abgespeichert sind
-def load_favorites():
-    global favorites
-    if os.path.exists(favorites_file):
-        with open(favorites_file, "r") as f:
+    def _signature(self):
+        files = {}
+        for key, name in ICON_FILES.items():
             try:
-                favorites = json.load(f)
-            except json.JSONDecodeError:
-                favorites = []
-    else:
-        favorites = []
+                files[key] = [name, os.stat(os.path.join(self.folder, name)).st_mtime_ns]
+            except OSError:
+                files[key] = [name, None]
+        return json.dumps({"size": self.size, "files": files}, sort_keys=True)
 
-# Speichert ein Bild als Favorit ab -> Eintrag in JSON-File
-def save_favorite(image):
-    with lock:
-        if image not in favorites:
-            favorites.append(image)
-            with open(favorites_file, "w") as f:
-                json.dump(favorites, f)
+    def _load_cached(self, signature):
+        try:
+            with np.load(self.atlas_path) as data:
+                if str(data["signature"]) != signature:
+                    return None
+                icons, present = data["icons"], data["present"]
+        except (OSError, KeyError, ValueError):
+            return None
+        return {key: icons[i] if present[i] else None for i, key in enumerate(ICON_FILES)}
 
-# Löscht ein Bild aus Favoriten -> Eintrag löschen in JSON-File
-def remove_favorite(image):
-    with lock:
-        if image in favorites:
-            favorites.remove(image)
-            with open(favorites_file, "w") as f:
-                json.dump(favorites, f)
+    def _build(self, signature):
+        icons = np.zeros((len(ICON_FILES), self.size, self.size, 3), dtype=np.uint8)
+        present = np.zeros(len(ICON_FILES), dtype=bool)
+        for i, (key, name) in enumerate(ICON_FILES.items()):
+            icon = load_icon_with_white_bg(os.path.join(self.folder, name), (self.size, self.size))
+            if icon is not None and icon.shape == icons[i].shape:
+                icons[i] = icon
+                present[i] = True
+        # Atomar schreiben wie beim Bild-Cache
+        tmp = self.atlas_path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, icons=icons, present=present, signature=np.array(signature))
+            os.replace(tmp, self.atlas_path)
+        except OSError as e:
+            print(f"Konnte Icon-Atlas {self.atlas_path} nicht schreiben: {e}")
+        return {key: icons[i] if present[i] else None for i, key in enumerate(ICON_FILES)}
 
-# Bild auf Display anpassen
-def resize_and_center_image(image, screen_width, screen_height):
-    background = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
-    image_height, image_width = image.shape[:2]
-    aspect_ratio = image_width / image_height
+    def load(self):
+        with self._lock:
+            if self._icons is None:
+                with startup_phase("Icons"):
+                    signature = self._signature()
+                    self._icons = self._load_cached(signature)
+                    if self._icons is None:
+                        self._icons = self._build(signature)
+            return self._icons
 
-    if aspect_ratio > screen_width / screen_height:
-        new_width = screen_width
-        new_height = int(screen_width / aspect_ratio)
-    else:
-        new_height = screen_height
-        new_width = int(screen_height * aspect_ratio)
+    def get(self, key):
+        return self.load().get(key)
 
-    resized_image = cv2.resize(image, (new_width, new_height))
-    x_offset = (screen_width - new_width) // 2
-    y_offset = (screen_height - new_height) // 2
-    background[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = resized_image
-    return background
+icon_atlas = IconAtlas()
 
-# Verbessert Erkennung mittels bekannter Befehle. Befehl erkannt bei > 70% übereinstimmung
-def find_best_match(command):
-    command = command.strip().lower()
-    result = process.extractOne(command, known_commands, scorer=fuzz.token_sort_ratio)
-    if result and result[1] > 70:
-        return result[0]
-    return None
+# Abspielliste mit festen Plätzen. Entfernen markiert den Platz nur als leer, die übrigen Bilder
+# behalten ihre Plätze. Ohne Lücken ist "n-tes Bild" ein direkter Zugriff (O(1)), mit Lücken zählt
+# ein Fenwick-Baum die belegten Plätze (O(log n)). Ist mehr als die Hälfte leer, wird zusammengeschoben.
+# "ist enthalten?" und "an welcher Stelle?" gehen über ein Dictionary Pfad -> Platz.
+class Playlist:
+    def __init__(self, items=()):
+        self._reset(list(dict.fromkeys(items)))
 
-# Vermeidung von Umlauten -> Können nicht dargestellt werden.
-def ascii_fallback(text):
-    text = text.replace("ä", "ae").replace("Ä", "Ae")
-    text = text.replace("ö", "oe").replace("Ö", "Oe")
-    text = text.replace("ü", "ue").replace("Ü", "Ue")
-    text = text.replace("ß", "ss")
-    return text
+    def _reset(self, slots):
+        self._slots = slots
+        self._slot_of = {path: i for i, path in enumerate(slots)}
+        self._holes = 0
+        self._tree = None
 
-# Listener Funktion: Wartet auf das Erkennungswort "Hey Berry"
-def listen_for_command():
-    recognizer = sr.Recognizer()
-    mic = sr.Microphone(device_index=2)  # Mikrofon-Index auf 2 fest kodiert
-    try:
-        with mic as source:
-            recognizer.adjust_for_ambient_noise(source)
-            print("Warte auf das Erkennungswort...")
-            audio = recognizer.listen(source, timeout=5, phrase_time_limit=3)
-        text = recognizer.recognize_google(audio, language="de-DE").lower()
-        print(f"Debug: Erkanntes Audio: {text}")
-        if any(variant in text for variant in ["hey berry", "hey baby", "hey barry"]):
-            print("Erkennungswort erkannt!")
-            global hotword_feedback_until
-            hotword_feedback_until = time.time() + 1.0  # 1 Sekunde blauer Rand
-            return True
-    except sr.UnknownValueError:
-        print("Ich konnte dich nicht verstehen.")
-    except sr.WaitTimeoutError:
-        print("Kein Erkennungswort erkannt.")
-    except Exception as e:
-        print(f"Fehler im Listener: {e}")
-    return False
+    def __len__(self):
+        return len(self._slots) - self._holes
 
-# Listener Funktion: Wartet auf einen Befehl, nachdem das Erkennungswort erkannt wurde
-def listen_for_following_command():
-    """
-    Gibt (best_match, original_text) zurück.
-    Falls kein passender Befehl => best_match=None
-    """
-    recognizer = sr.Recognizer()
-    mic = sr.Microphone(device_index=2)
-    try:
-        with mic as source:
-            recognizer.adjust_for_ambient_noise(source)
-            print("Sprich jetzt deinen Befehl...")
-            audio = recognizer.listen(source, timeout=5, phrase_time_limit=3)
-        command_text = recognizer.recognize_google(audio, language="de-DE").lower()
-        best_match = find_best_match(command_text)
-        if best_match:
-            print(f"Befehl erkannt: {best_match} (Original: '{command_text}')")
-            return best_match, command_text
-        else:
-            print(f"Unbekannter Befehl: '{command_text}'")
-            return None, command_text
-    except sr.UnknownValueError:
-        print("Ich konnte den Befehl nicht verstehen.")
-    except sr.WaitTimeoutError:
-        print("Kein Befehl erkannt (Timeout).")
-    except Exception as e:
-        print(f"Fehler beim Erfassen des Befehls: {e}")
-    return None, None
+    def __contains__(self, path):
+        return path in self._slot_of
 
-# Erkannter Befehl wird ausgeführt. Diashow kurz Pausieren, um Deadlocks zu vermeiden
-def execute_command(command, original_text=""):
-    global paused, current_image, current_index, running, favorites_mode, current_speed
-    print(f"DEBUG: execute_command aufgerufen mit command='{command}'")
+    def __iter__(self):
+        return (path for path in self._slots if path is not None)
 
-    with lock:
-        print("DEBUG: In with lock angekommen")
+    def __getitem__(self, n):
+        size = len(self)
+        if n < 0:
+            n += size
+        if not 0 <= n < size:
+            raise IndexError("Playlist index out of range")
+        if not self._holes:
+            return self._slots[n]
+        return self._slots[self._select(n)]
 
-        if command in ["stopp", "pause"]:
-            paused = True
-            print("Diashow gestoppt/pausiert.")
-        elif command in ["weiter", "play"]:
-            paused = False
-            print("Diashow fortgesetzt.")
-        elif command == "schneller":
-            if current_speed > 1:
-                current_speed -= 1
-            print("Geschwindigkeit erhöht (Intervall verkürzt).")
-        elif command == "langsamer":
-            current_speed += 1
-            print("Geschwindigkeit verringert (Intervall erhöht).")
-        elif command == "vorwärts":
-            clist = favorites if favorites_mode else images
-            if clist:
-                current_index = (current_index + 1) % len(clist)
-                current_image = clist[current_index]
-            print("Ein Bild vorwärts.")
-        elif command == "zurück":
-            clist = favorites if favorites_mode else images
-            if clist:
-                current_index = (current_index - 1) % len(clist)
-                current_image = clist[current_index]
-            print("Ein Bild zurück.")
-        elif command == "speichern als favorit":
-            if current_image:
-                save_favorite(current_image)
-                print(f"Bild {current_image} als Favorit gespeichert.")
-        elif command == "spiele favoriten ab":
-            if favorites:
-                favorites_mode = True
-                current_index = 0
-                print("Wechsle in Favoriten-Slideshow.")
-            else:
-                print("Keine Favoriten vorhanden!")
-        elif command == "alle bilder anzeigen":
-            favorites_mode = False
-            current_index = 0
-            print("Wechsle zur normalen Slideshow (alle Bilder).")
-        elif command == "bild löschen":
-            if current_image:
-                if favorites_mode:
-                    if current_image in favorites:
-                        favorites.remove(current_image)
-                        with open(favorites_file, "w") as f:
-                            json.dump(favorites, f)
-                        print(f"Bild {current_image} aus Favoriten gelöscht.")
-                    else:
-                        print("Bild nicht in Favoriten enthalten.")
-                else:
-                    if current_image in images:
-                        images.remove(current_image)
-                        print(f"Bild {current_image} gelöscht.")
+    # Position (0-basiert) eines Bildes. ValueError, wenn es nicht enthalten ist (wie list.index)
+    def index(self, path):
+        slot = self._slot_of.get(path)
+        if slot is None:
+            raise ValueError(f"{path} nicht in der Liste")
+        return slot if not self._holes else self._prefix(slot)
 
-                clist = favorites if favorites_mode else images
-                if clist:
-                    current_index %= len(clist)
-                    current_image = clist[current_index]
-                else:
-                    current_image = None
-        elif command == "von vorne":
-            current_index = 0
-            print("Diashow startet von vorne.")
-        elif command == "gehe zu bild":
-            match = re.search(r'\b(\d+)\b', original_text)
-            if match:
-                bild_nummer = int(match.group(1))
-                clist = favorites if favorites_mode else images
-                if clist:
-                    if 1 <= bild_nummer <= len(clist):
-                        current_index = bild_nummer - 1
-                        current_image = clist[current_index]
-                        print(f"Springe zu Bild {bild_nummer}.")
-                    else:
-                        print("Nummer außerhalb der Liste.")
-                else:
-                    print("Keine Bilder vorhanden.")
-            else:
-                print("Keine gültige Bildnummer erkannt.")
-        elif command == "ausschalten":
-            running = False
-            print("Gerät wird heruntergefahren.")
+    def append(self, path):
+        if path in self._slot_of:
+            return False
+        self._slot_of[path] = len(self._slots)
+        self._slots.append(path)
+        if self._tree is not None:
+            # Neuer Knoten i deckt die Plätze (i - lowbit(i), i] ab
+            i = len(self._slots)
+            self._tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+        return True
 
-# Overlay, bei klick auf Button "info" -> Alle Sprachbefehle werden aufgelistet
-def draw_info_overlay(frame):
-    overlay = frame.copy()
-    rect_x1, rect_y1 = 50, 50
-    rect_x2, rect_y2 = SCREEN_WIDTH - 50, SCREEN_HEIGHT - 50
-    cv2.rectangle(overlay, (rect_x1, rect_y1), (rect_x2, rect_y2), (0, 0, 0), -1)
-    alpha = 0.7
-    frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
-
-    text_lines = [
-        "Moegliche Sprachbefehle:",
-        "- stopp / pause",
-        "- weiter / play",
-        "- langsamer / schneller",
-        "- vorwaerts / zurueck",
-        "- speichern als favorit",
-        "- alle bilder anzeigen",
-        "- spiele favoriten ab",
-        "- bild loeschen",
-        "- gehe zu bild [nummer]",
-        "- ausschalten"
-    ]
+    def remove(self, path):
+        slot = self._slot_of.pop(path, None)
+        if slot is None:
+            return False
+        self._slots[slot] = None
+        self._holes += 1
+        if self._holes * 2 > len(self._slots):
+            self._reset([p for p in self._slots if p is not None])
+            return True
+        if self._tree is None:
+            self._build_tree()
+        else:
+            i = slot + 1
+            while i < len(self._tree):
+                self._tree[i] -= 1
+                i += i & -i
+        return True
 
-    x_text = rect_x1 + 30
-    y_text = rect_y1 + 50
-    for line in text_lines:
-        line_asc = ascii_fallback(line)
-        cv2.putText(frame, line_asc, (x_text, y_text),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
-        y_text += 40
-    return frame
+    def _build_tree(self):
+        tree = [0] * (len(self._slots) + 1)
+        for i, path in enumerate(self._slots, 1):
+            if path is not None:
+                tree[i] += 1
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
 
-# Zeichne Menu bei klick auf Bildschrim
-def draw_menu(frame):
-    cv2.rectangle(
-        frame,
-        (0, SCREEN_HEIGHT - MENU_HEIGHT),
-        (SCREEN_WIDTH, SCREEN_HEIGHT),
-        (50, 50, 50),
-        -1
-    )
+    # Anzahl belegter Plätze vor Platz slot
+    def _prefix(self, slot):
+        total = 0
+        i = slot
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
 
-    # langsamer
-    if icon_langsamer is not None:
-        x1,y1,x2,y2 = button_layout["langsamer"]
-        frame[y1:y2, x1:x2] = icon_langsamer
-
-    # zurück (linker-pfeil)
-    if icon_left is not None:
-        x1,y1,x2,y2 = button_layout["zurück"]
-        frame[y1:y2, x1:x2] = icon_left
-
-    # pause_play
-    icon_pp = icon_play if paused else icon_pause
-    if icon_pp is not None:
-        x1,y1,x2,y2 = button_layout["pause_play"]
-        frame[y1:y2, x1:x2] = icon_pp
-
-    # vorwärts (rechter-pfeil)
-    if icon_right is not None:
-        x1,y1,x2,y2 = button_layout["vorwärts"]
-        frame[y1:y2, x1:x2] = icon_right
-
-    # schneller
-    if icon_schneller is not None:
-        x1,y1,x2,y2 = button_layout["schneller"]
-        frame[y1:y2, x1:x2] = icon_schneller
-
-    # favorit
-    if current_image in favorites:
-        icon_fav = icon_star_true
-    else:
-        icon_fav = icon_star
-    if icon_fav is not None:
-        x1,y1,x2,y2 = button_layout["favorit"]
-        frame[y1:y2, x1:x2] = icon_fav
-
-    # modus
-    icon_modus = icon_modus_fav if favorites_mode else icon_modus_all
-    if icon_modus is not None:
-        x1,y1,x2,y2 = button_layout["modus"]
-        frame[y1:y2, x1:x2] = icon_modus
-
-    # info
-    if icon_info is not None:
-        x1,y1,x2,y2 = button_layout["info"]
-        frame[y1:y2, x1:x2] = icon_info
-
-    # Highlight-Rahmen
-    if highlighted_button in button_layout:
-        x1,y1,x2,y2 = button_layout[highlighted_button]
-        cv2.rectangle(frame, (x1,y1), (x2,y2), (0,255,255), 3)
+    # Platz des n-ten belegten Platzes
+    def _select(self, n):
+        position = 0
+        remaining = n + 1
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] < remaining:
+                position = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return position
 
-# Prüft, ob der Klick auf den Display im Bereich eines Buttons liegt. True = liegt im Bereich, False=Ausserhalb des Bereichs
-def point_in_rect(x, y, rect):
-    x1, y1, x2, y2 = rect
-    return (x1 <= x <= x2) and (y1 <= y <= y2)
+# Zufällige Reihenfolge ohne Wiederholung der letzten SHUFFLE_NO_REPEAT Bilder. Die nächsten Bilder
+# werden im Voraus gezogen (für das Vorausladen), "zurück" geht den Verlauf rückwärts.
+# Mit festem seed ist die Reihenfolge reproduzierbar. Nur mit gehaltenem state.lock verwenden.
+class ShuffleOrder:
+    def __init__(self, seed=SHUFFLE_SEED, window=SHUFFLE_NO_REPEAT, history=100):
+        self.random = random.Random(seed)
+        self.window = window
+        self._recent = deque()
+        self._upcoming = deque()
+        self._history = deque(maxlen=history)
 
-# Führt den Befehl des angeklickten Buttons aus
-def handle_button_click(btn_key):
-    global menu_highlight_end, highlighted_button, current_image, current_index
-    global favorites_mode, info_visible, info_hide_time
+    def _draw(self, playlist, exclude):
+        n = len(playlist)
+        if n <= len(exclude):
+            return playlist[self.random.randrange(n)]
+        while True:
+            candidate = playlist[self.random.randrange(n)]
+            if candidate not in exclude:
+                return candidate
 
-    print(btn_key + " wurde geklickt")
+    # Die nächsten count Bilder (ohne sie zu verbrauchen)
+    def upcoming(self, playlist, current, count):
+        self._upcoming = deque(p for p in self._upcoming if p in playlist and p != current)
+        if not playlist:
+            return []
+        # Höchstens die Hälfte der Liste sperren, damit immer genug Kandidaten bleiben
+        window = min(self.window, len(playlist) // 2)
+        recent = list(self._recent)[-window:] if window else []
+        while len(self._upcoming) < count:
+            exclude = set(recent) | set(self._upcoming)
+            if current is not None and len(playlist) > 1:
+                exclude.add(current)
+            self._upcoming.append(self._draw(playlist, exclude))
+        return list(self._upcoming)[:count]
 
-    if btn_key == "langsamer":
-        execute_command("langsamer")
-    elif btn_key == "schneller":
-        execute_command("schneller")
-    elif btn_key == "zurück":
-        execute_command("zurück")
-    elif btn_key == "vorwärts":
-        execute_command("vorwärts")
-    elif btn_key == "pause_play":
-        if paused:
-            execute_command("play")
-        else:
-            execute_command("pause")
-    elif btn_key == "favorit":
-        with lock:
-            if current_image:
-                if current_image in favorites:
-                    print("Bild aus Favoriten entfernen")
-                    favorites.remove(current_image)
-                    with open(favorites_file, "w") as f:
-                        json.dump(favorites, f)
-                    if favorites_mode:
-                        if favorites:
-                            current_index %= len(favorites)
-                            current_image = favorites[current_index]
-                        else:
-                            current_image = None
-                else:
-                    print("Bild zu Favoriten hinzufuegen")
-                    if current_image not in favorites:
-                        favorites.append(current_image)
-                        with open(favorites_file, "w") as f:
-                            json.dump(favorites, f)
-    elif btn_key == "modus":
-        with lock:
-            if favorites_mode:
-                favorites_mode = False
-                current_index = 0
-                print("Wechsle zur normalen Slideshow.")
-                if images:
-                    current_image = images[0]
-                else:
-                    current_image = None
-            else:
-                if favorites:
-                    favorites_mode = True
-                    current_index = 0
-                    print("Wechsle in Favoriten-Slideshow.")
-                    current_image = favorites[0]
-                else:
-                    print("Keine Favoriten vorhanden!")
-    elif btn_key == "info":
-        info_visible = True
-        info_hide_time = time.time() + 10
-        print("Zeige Info-Overlay (Legende)")
+    def next(self, playlist, current):
+        following = self.upcoming(playlist, current, 1)
+        if not following:
+            return None
+        self._upcoming.popleft()
+        if current is not None:
+            self._history.append(current)
+            self._recent.append(current)
+            while len(self._recent) > self.window:
+                self._recent.popleft()
+        return following[0]
 
-    highlighted_button = btn_key
-    menu_highlight_end = time.time() + BUTTON_HIDE_DELAY
-    print("End handle_button_click")
+    def back(self, playlist, current):
+        while self._history:
+            previous = self._history.pop()
+            if previous in playlist:
+                if current is not None:
+                    self._upcoming.appendleft(current)
+                return previous
+        return None
 
-# Funktion wird bei einer Berührung auf das Touch-Display aufgerufen
-def mouse_callback(event, x, y, flags, param):
-    global menu_visible, menu_last_interaction, menu_highlight_end, highlighted_button
-    global info_visible
+shuffle_order = ShuffleOrder()
 
-    if event == cv2.EVENT_LBUTTONDOWN:
-        x_corr = SCREEN_WIDTH - 1 - x
-        y_corr = SCREEN_HEIGHT - 1 - y
+images = Playlist()    # Alle Bilder, sortiert nach Pfad
+query_results = Playlist()   # Ergebnis von "zeige bilder von ..."/"bilder aus ..." (nach Aufnahmedatum)
 
-        now = time.time()
-        menu_last_interaction = now
+# Index der Bildbibliothek (Pfad, Grösse, mtime), gespeichert in library_index.json.
+# Beim Start wird nur der Index gelesen. Beim erneuten Durchlauf werden Ordner, deren mtime sich nicht
+# geändert hat, nicht neu gelesen (neue oder gelöschte Dateien ändern die mtime des Ordners).
+class LibraryIndexer:
+    def __init__(self, root, index_path):
+        self.root = root
+        self.index_path = index_path
+        self.dirs = {}       # Ordner -> [mtime_ns, [Unterordner], [Bilddateien]]
+        self.files = {}      # Pfad -> [Grösse, mtime_ns]
+        self.hidden = set()  # Mit "bild löschen" entfernte Bilder, bleiben auch nach dem Durchlauf weg
+        self._lock = Lock()
 
-        # Falls Info-Overlay an => bei Klick ausblenden
-        if info_visible:
-            info_visible = False
-            return
+    # Liest den gespeicherten Index. Gibt die sortierte Bildliste zurück (leer, falls kein Index existiert).
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return []
+        if data.get("root") != self.root:
+            return []
+        self.dirs = data.get("dirs", {})
+        self.files = data.get("files", {})
+        self.hidden = set(data.get("hidden", []))
+        return self.paths()
 
-        if not menu_visible:
-            menu_visible = True
-            highlighted_button = None
-            menu_highlight_end = 0
-            return
+    def save_index(self):
+        with self._lock:
+            data = {"root": self.root, "dirs": self.dirs, "files": self.files, "hidden": sorted(self.hidden)}
+        tmp = self.index_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            print(f"Bildindex konnte nicht gespeichert werden: {e}")
 
-        clicked_button = None
-        # Prüfen, ob ein Button geklickt wurde
-        for key, rect in button_layout.items():
-            if point_in_rect(x_corr, y_corr, rect):
-                clicked_button = key
-                break
+    def paths(self):
+        with self._lock:
+            return sorted(path for path in self.files if path not in self.hidden)
 
-        if clicked_button:
-            handle_button_click(clicked_button)
-        else:
-            # Außerhalb geklickt => Menü ausblenden
-            menu_visible = False
-            highlighted_button = None
-            menu_highlight_end = 0
+    def hide(self, path):
+        with self._lock:
+            self.hidden.add(path)
 
-# Thread für die Diashow
-def slideshow_thread():
-    global running, paused, images, favorites, current_speed
-    global current_image, current_index, last_image_update_time, favorites_mode
-    global menu_visible, menu_last_interaction, menu_highlight_end, highlighted_button
-    global info_visible, info_hide_time
-    global hotword_feedback_until, command_success_until, command_fail_until
+    def mtimes(self, paths):
+        with self._lock:
+            return {path: self.files[path][1] for path in paths if path in self.files}
 
-    os.system('unclutter -idle 0.1 -root &')
-    cv2.namedWindow("Digitaler Bilderrahmen", cv2.WND_PROP_FULLSCREEN)
-    cv2.setWindowProperty("Digitaler Bilderrahmen", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+    # Neue Datei direkt aufnehmen (z.B. nach einem Upload), ohne auf den nächsten Durchlauf zu warten
+    def add_file(self, path):
+        st = os.stat(path)
+        with self._lock:
+            self.files[path] = [st.st_size, st.st_mtime_ns]
+            self.hidden.discard(path)
 
-    cv2.setMouseCallback("Digitaler Bilderrahmen", mouse_callback)
+    # Durchläuft den Bildordner rekursiv. Gibt (Bildliste, Anzahl neu, Anzahl entfernt) zurück.
+    def scan(self):
+        new_dirs = {}
+        new_files = {}
+        cache_dir = os.path.normpath(rendition_folder)
+        pending = [os.path.normpath(self.root)]
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            cached = self.dirs.get(directory)
+            if cached and cached[0] == mtime_ns:
+                _, subdirs, names = cached
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if path in self.files:
+                        new_files[path] = self.files[path]
+            else:
+                subdirs, names = [], []
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.name.startswith("."):
+                                continue
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if os.path.normpath(entry.path) != cache_dir:
+                                        subdirs.append(entry.name)
+                                elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                                    st = entry.stat()
+                                    names.append(entry.name)
+                                    new_files[entry.path] = [st.st_size, st.st_mtime_ns]
+                            except OSError:
+                                continue
+                except OSError as e:
+                    print(f"Ordner {directory} konnte nicht gelesen werden: {e}")
+                    continue
+            new_dirs[directory] = [mtime_ns, subdirs, names]
+            pending.extend(os.path.join(directory, sub) for sub in subdirs)
 
-    try:
-        while True:
-            with lock:
-                if not running:
-                    break
+        added = len(new_files.keys() - self.files.keys())
+        removed = len(self.files.keys() - new_files.keys())
+        with self._lock:
+            self.dirs = new_dirs
+            self.files = new_files
+            self.hidden &= new_files.keys()
+        self.save_index()
+        return self.paths(), added, removed
 
-                current_list = favorites if favorites_mode else images
+library = LibraryIndexer(image_folder, library_index_file)
 
-                if not paused and (time.time() - last_image_update_time >= current_speed):
-                    if current_list:
-                        current_index = (current_index + 1) % len(current_list)
-                        current_image = current_list[current_index]
-                        last_image_update_time = time.time()
-                    else:
-                        current_image = None
+# 64-Bit-Ähnlichkeits-Hash aus einem Graustufenbild: ähnliche Bilder unterscheiden sich in wenigen Bits
+def perceptual_hash(gray, method=DEDUP_METHOD):
+    if method == "phash":
+        small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:8, :8].ravel()
+        bits = low > np.median(low[1:])   # Gleichanteil (low[0]) nicht für den Median verwenden
+    else:
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
 
-                # Bild laden/zentrieren
-                if current_image:
-                    img = cv2.imread(current_image)
-                    if img is not None:
-                        frame = resize_and_center_image(img, SCREEN_WIDTH, SCREEN_HEIGHT)
-                    else:
-                        print(f"Fehler: Bild {current_image} konnte nicht geladen werden.")
-                        frame = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
-                else:
-                    frame = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+# Läuft im Prozess-Pool. JPEGs werden direkt beim Dekodieren auf 1/8 verkleinert (viel schneller als volle Grösse).
+def compute_image_hash(path, method=DEDUP_METHOD):
+    gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None or gray.size == 0:
+        return None
+    return perceptual_hash(gray, method)
 
-                # Menü einzeichnen?
-                if menu_visible:
-                    draw_menu(frame)
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
 
-                # Info-Overlay?
-                now = time.time()
-                if info_visible:
-                    if now > info_hide_time:
-                        info_visible = False
-                    else:
-                        frame = draw_info_overlay(frame)
+# Index für die Suche nach ähnlichen Hashes (Multi-Index-Hashing): Der Hash wird in 4 Teile à 16 Bit zerlegt.
+# Unterscheiden sich zwei Hashes in höchstens radius Bits, stimmt mindestens ein Teil bis auf radius // 4 Bits
+# überein. Gesucht wird also nur in den passenden Fächern statt in allen Bildern.
+class HashIndex:
+    def __init__(self, radius):
+        self.radius = radius
+        self.tables = [{} for _ in range(4)]
+        self.flips = []   # Alle 16-Bit-Masken mit höchstens radius // 4 gesetzten Bits
+        for count in range(radius // 4 + 1):
+            for bits in itertools.combinations(range(16), count):
+                self.flips.append(sum(1 << bit for bit in bits))
 
-                # Rahmen-Logik
-                if now < command_fail_until:
-                    # Roter Rand = Befehl nicht erkannt
-                    cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (0,0,255), 10)
-                elif now < command_success_until:
-                    # Grüner Rand = Befehlt erkannt
-                    cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (0,255,0), 10)
-                elif now < hotword_feedback_until:
-                    # Blauer Rand = Erkennungswort erkannt -> Jetzt Befehl sprechen
-                    cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (255,0,0), 10)
+    def add(self, value, item):
+        for i, table in enumerate(self.tables):
+            table.setdefault((value >> (16 * i)) & 0xFFFF, []).append((value, item))
 
-                # Menü ausblenden nach Highlight/Timeout?
-                if menu_highlight_end > 0 and now > menu_highlight_end:
-                    menu_visible = False
-                    highlighted_button = None
-                    menu_highlight_end = 0
-                elif menu_highlight_end == 0 and menu_visible:
-                    if now - menu_last_interaction > MENU_HIDE_DELAY:
-                        menu_visible = False
-                        highlighted_button = None
-
-            cv2.imshow("Digitaler Bilderrahmen", frame)
-            key = cv2.waitKey(50)
-            if key == ord('q'):
-                with lock:
-                    running = False
+    # Ähnlichstes Element (Abstand <= radius) oder None
+    def find(self, value):
+        best, best_distance = None, self.radius + 1
+        for i, table in enumerate(self.tables):
+            part = (value >> (16 * i)) & 0xFFFF
+            for mask in self.flips:
+                for other, item in table.get(part ^ mask, ()):
+                    distance = hamming_distance(value, other)
+                    if distance < best_distance:
+                        best, best_distance = item, distance
+        return best
 
-    finally:
-        cv2.destroyAllWindows()
+# Blendet ähnliche Bilder aus: Die Hashes werden in einem Prozess-Pool (alle Kerne, niedrige Priorität)
+# berechnet und in image_hashes.json gespeichert. Neu berechnet wird nur, wenn sich die mtime ändert.
+class Deduplicator:
+    def __init__(self, cache_path, method=DEDUP_METHOD, threshold=DEDUP_THRESHOLD):
+        self.cache_path = cache_path
+        self.method = method
+        self.threshold = threshold
+        self.hashes = {}   # Pfad -> [mtime_ns, Hash oder None (nicht lesbar)]
+        self.groups = {}   # Gezeigtes Bild -> ausgeblendete ähnliche Bilder
+        self.duplicates = set()   # Ausgeblendete Bilder vom letzten Durchlauf (für einen schnellen Start)
+        self._lock = Lock()
 
-#Thread für die Spracherkennung/Sprachsteuerung
-def voice_control_thread():
-    global running, command_success_until, command_fail_until
-    while True:
-        # Nur kurz lock fuer 'running' checken, um deadlocks zu vermeiden
-        with lock:
-            if not running:
-                break
+    def load(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("method") == self.method and data.get("threshold") == self.threshold:
+            with self._lock:
+                self.hashes = data.get("hashes", {})
+                self.duplicates = set(data.get("duplicates", []))
 
+    def save(self):
+        with self._lock:
+            data = {"method": self.method, "threshold": self.threshold, "hashes": dict(self.hashes),
+                    "duplicates": sorted(self.duplicates)}
+        tmp = self.cache_path + ".tmp"
         try:
-            if listen_for_command():
-                print("Erkennungswort erkannt, warte auf Folgekommando...")
-                matched_command, original_text = listen_for_following_command()
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"Bild-Hashes konnten nicht gespeichert werden: {e}")
 
-                # => lock nur kurz fuer Zeitstempel
-                if matched_command:
-                    with lock:
-                        command_success_until = time.time() + 1.0
-                    # execute_command ausserhalb des lock
-                    execute_command(matched_command, original_text)
-                else:
-                    with lock:
-                        command_fail_until = time.time() + 1.0
+    # Berechnet fehlende oder veraltete Hashes. Gibt die Anzahl neu berechneter Hashes zurück.
+    def update(self, paths, mtimes):
+        with self._lock:
+            todo = [path for path in paths
+                    if path in mtimes and self.hashes.get(path, [None])[0] != mtimes[path]]
+            stale = self.hashes.keys() - set(paths)
+            for path in stale:
+                del self.hashes[path]
+        if not todo:
+            if stale:
+                self.save()
+            return 0
 
-        except Exception as e:
-            print(f"Fehler im Sprachsteuerungsthread: {e}")
+        start = time.perf_counter()
+        done = 0
+        hash_one = functools.partial(compute_image_hash, method=self.method)
+        with ProcessPoolExecutor(max_workers=DEDUP_WORKERS or os.cpu_count() or 1,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=os.nice, initargs=(10,)) as pool:
+            for offset in range(0, len(todo), DEDUP_BATCH):
+                batch = todo[offset:offset + DEDUP_BATCH]
+                values = list(pool.map(hash_one, batch, chunksize=16))
+                with self._lock:
+                    for path, value in zip(batch, values):
+                        self.hashes[path] = [mtimes[path], value]
+                done += len(batch)
+                self.save()
+                if not state.snapshot().running:
+                    break
+        print(f"Bild-Hashes: {done} berechnet ({time.perf_counter() - start:.1f} s).")
+        return done
+
+    # Gibt die (sortierte) Liste ohne ähnliche Bilder zurück. Gezeigt wird jeweils das erste Bild einer Gruppe,
+    # Bilder ohne Hash werden immer gezeigt.
+    def filter(self, paths):
+        with self._lock:
+            hashes = {path: self.hashes[path][1] for path in paths if path in self.hashes}
+        index = HashIndex(self.threshold)
+        keep, groups = [], {}
+        for path in paths:
+            value = hashes.get(path)
+            match = index.find(value) if value is not None else None
+            if match is None:
+                if value is not None:
+                    index.add(value, path)
+                keep.append(path)
+            else:
+                groups.setdefault(match, []).append(path)
+        with self._lock:
+            self.groups = groups
+            self.duplicates = {path for members in groups.values() for path in members}
+        return keep
+
+    # Beim Start: nur die beim letzten Durchlauf gefundenen Duplikate entfernen (ohne Suche)
+    def without_known_duplicates(self, paths):
+        with self._lock:
+            return [path for path in paths if path not in self.duplicates]
+
+dedup = Deduplicator(dedup_cache_file)
+
+# Ort (Schlüssel aus PLACES) zu einer GPS-Position oder None
+def place_for(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    for name, (lat_min, lat_max, lon_min, lon_max) in PLACES.items():
+        if lat_min <= latitude <= lat_max and lon_min <= longitude <= lon_max:
+            return name
+    return None
+
+# Metadaten eines Bildes als Zeile für den Katalog
+def catalog_row(path, mtime_ns, root):
+    exif = read_exif(path) if path.lower().endswith((".jpg", ".jpeg")) else {}
+    taken = None
+    match = re.match(r"(\d{4}):(\d{2}):(\d{2}) (\d{2}:\d{2}:\d{2})", exif.get("taken", ""))
+    if match and match.group(1) != "0000":
+        taken = f"{match.group(1)}-{match.group(2)}-{match.group(3)} {match.group(4)}"
+    else:
+        # Ohne EXIF-Datum zählt die Änderungszeit der Datei
+        taken = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime_ns / 1e9))
+    orientation = exif.get("orientation", 1)
+    size = None if is_video(path) else read_image_size(path)
+    width, height = size if size else (None, None)
+    if orientation in (5, 6, 7, 8) and size:
+        width, height = height, width   # Grösse wie angezeigt (cv2.imread dreht gemäss EXIF)
+    latitude, longitude = exif.get("latitude"), exif.get("longitude")
+    album = os.path.relpath(os.path.dirname(path), root).lower()
+    return (path, mtime_ns, taken, int(taken[:4]), int(taken[5:7]), orientation, latitude, longitude,
+            place_for(latitude, longitude), width, height, "" if album == "." else album)
+
+# SQLite-Katalog mit den Metadaten aller Bilder. Wird im Hintergrund (library_scanner_thread) nachgeführt:
+# gelesen werden nur neue oder geänderte Dateien (mtime), und nur der EXIF-Header, nicht das ganze Bild.
+# Die Indizes beantworten Abfragen nach Jahr/Monat und Ort in wenigen Millisekunden.
+class PhotoCatalog:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS photos (
+            path TEXT PRIMARY KEY, mtime_ns INTEGER, taken TEXT, year INTEGER, month INTEGER,
+            orientation INTEGER, latitude REAL, longitude REAL, place TEXT, width INTEGER, height INTEGER,
+            album TEXT);
+        CREATE INDEX IF NOT EXISTS photos_date ON photos (year, month, taken);
+        CREATE INDEX IF NOT EXISTS photos_place ON photos (place, taken);
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = None
+        self._lock = Lock()
+
+    # Verbindung erst beim ersten Zugriff öffnen (verschiedene Threads, deshalb mit eigenem Lock)
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(self.SCHEMA)
+            self._refresh_places()
+        return self._db
+
+    # Wurde PLACES geändert, die Orte aus den gespeicherten GPS-Positionen neu bestimmen (ohne Dateizugriff)
+    def _refresh_places(self):
+        signature = json.dumps(PLACES, sort_keys=True)
+        row = self._db.execute("SELECT value FROM settings WHERE key = 'places'").fetchone()
+        if row and row[0] == signature:
+            return
+        rows = self._db.execute("SELECT path, latitude, longitude FROM photos WHERE latitude IS NOT NULL").fetchall()
+        with self._db:
+            self._db.executemany("UPDATE photos SET place = ? WHERE path = ?",
+                                 [(place_for(lat, lon), path) for path, lat, lon in rows])
+            self._db.execute("INSERT OR REPLACE INTO settings VALUES ('places', ?)", (signature,))
+
+    # Gleicht den Katalog mit der Bildliste ab. Gibt die Anzahl neu gelesener Bilder zurück.
+    def update(self, paths, mtimes, root):
+        with self._lock:
+            db = self._connect()
+            known = dict(db.execute("SELECT path, mtime_ns FROM photos"))
+            stale = known.keys() - set(paths)
+            if stale:
+                with db:
+                    db.executemany("DELETE FROM photos WHERE path = ?", [(path,) for path in stale])
+        todo = [path for path in paths if path in mtimes and known.get(path) != mtimes[path]]
+        start = time.perf_counter()
+        for offset in range(0, len(todo), CATALOG_BATCH):
+            # Dateien ohne Lock lesen, dann in einem Schritt schreiben
+            rows = [catalog_row(path, mtimes[path], root) for path in todo[offset:offset + CATALOG_BATCH]]
+            with self._lock, self._db:
+                self._db.executemany("INSERT OR REPLACE INTO photos VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            if not state.snapshot().running:
+                break
+        if todo:
+            print(f"Bildkatalog: {len(todo)} Bilder gelesen ({time.perf_counter() - start:.1f} s).")
+        return len(todo)
+
+    # Bekannter Ort (Schlüssel aus PLACES), der zum gesprochenen Namen passt, sonst None
+    def match_place(self, name):
+        from rapidfuzz import fuzz, process
+        best = process.extractOne(name, list(PLACES), scorer=fuzz.ratio, score_cutoff=80)
+        return best[0] if best else None
+
+    # Pfade nach Aufnahmedatum sortiert. place sucht im Ort (GPS) und in den Ordnernamen.
+    def query(self, year=None, month=None, place=None):
+        clauses, params = [], []
+        if year is not None:
+            clauses.append("year = ?")
+            params.append(year)
+        if month is not None:
+            clauses.append("month = ?")
+            params.append(month)
+        if place:
+            like = "%" + place.lower().replace("%", "").replace("_", "") + "%"
+            name = self.match_place(place)
+            if name:
+                clauses.append("(place = ? OR album LIKE ?)")
+                params.extend([name, like])
+            else:
+                clauses.append("album LIKE ?")
+                params.append(like)
+        if not clauses:
+            return []
+        with metrics.span("catalog_query"), self._lock:
+            rows = self._connect().execute(
+                f"SELECT path FROM photos WHERE {' AND '.join(clauses)} ORDER BY taken, path", params)
+            return [row[0] for row in rows]
+
+
+catalog = PhotoCatalog(catalog_file)
+
+MONTHS = {
+    "januar": 1, "jänner": 1, "februar": 2, "märz": 3, "maerz": 3, "april": 4, "mai": 5, "juni": 6,
+    "juli": 7, "august": 8, "september": 9, "oktober": 10, "november": 11, "dezember": 12,
+}
+QUERY_FILLER_WORDS = {"von", "vom", "aus", "dem", "der", "den", "die", "das", "im", "in", "jahr", "monat",
+                      "bilder", "fotos", "zeige"}
+
+# Zerlegt "juli" + 2019 oder "italien" in (Jahr, Monat, Ort)
+def parse_photo_query(argument, number):
+    year = number if number is not None and 1900 <= number <= 2100 else None
+    month = None
+    place_words = []
+    for word in (argument or "").split():
+        if word in MONTHS:
+            month = MONTHS[word]
+        elif word not in QUERY_FILLER_WORDS:
+            place_words.append(word)
+    return year, month, " ".join(place_words) or None
+
+# Bildliste für die Diashow (ohne Duplikate, falls aktiviert). Die Suche dauert bei 50'000 Bildern
+# einige Sekunden und läuft deshalb im Hintergrund-Thread, nicht beim Start.
+def deduplicated(paths):
+    if not DEDUP_ENABLED:
+        return paths
+    keep = dedup.filter(paths)
+    dedup.save()
+    if len(keep) < len(paths):
+        print(f"Duplikate: {len(paths) - len(keep)} von {len(paths)} Bildern ausgeblendet.")
+    return keep
+
+# Übernimmt eine neue (sortierte) Bildliste in die laufende Diashow, ohne die aktuelle Position zu verlieren.
+# Die neuen Listen werden ohne Lock aufgebaut (O(n)), in der Transaktion werden nur die Referenzen getauscht.
+# Hat sich die Bibliothek inzwischen geändert (Upload, "bild löschen", neue Abfrage), wird neu aufgebaut -
+# nach zwei vergeblichen Versuchen im Lock, damit der Abgleich nicht endlos wiederholt wird.
+def apply_library(paths):
+    global images, query_results
+
+    def build(current, results):
+        playlist = Playlist(paths)
+        removed = set(current).difference(paths) if current else set()
+        return playlist, removed, Playlist(path for path in results if path in playlist)
+
+    for attempt in range(3):
+        version = state.snapshot().library_version
+        playlist, removed, results = build(images, query_results)
+        with state.transaction() as s:
+            if s.library_version != version:
+                if attempt < 2:
+                    continue
+                playlist, removed, results = build(images, query_results)
+            images = playlist
+            s.library_version += 1
+            if s.query is not None:
+                query_results = results
+            # Die Favoritenliste hängt nicht von der Bildliste ab, im Favoriten-Modus bleibt die Position
+            if not s.favorites_mode:
+                if s.query is not None:
+                    keep_position(s)
+                elif s.current_image is not None:
+                    position = bisect.bisect_left(paths, s.current_image)
+                    if s.current_image in images:
+                        s.current_index = images.index(s.current_image)
+                    elif images:
+                        s.current_index = min(position, len(images) - 1)
+                        s.current_image = images[s.current_index]
+                    else:
+                        s.current_index = 0
+                        s.current_image = None
+                elif images:
+                    s.current_index = 0
+                    s.current_image = images[0]
+            break
+    for path in removed:
+        frame_cache.invalidate(path)
+
+# lädt alle Bilder aus dem Image-Pfad (aus dem gespeicherten Index, beim ersten Start mit vollständigem Durchlauf)
+def load_images():
+    if not os.path.exists(image_folder):
+        print(f"Fehler: Ordner {image_folder} existiert nicht!")
+        return
+
+    found = library.load_index()
+    if not found:
+        found, _, _ = library.scan()
+    if DEDUP_ENABLED:
+        dedup.load()
+        found = dedup.without_known_duplicates(found)
+    apply_library(found)
+    if not found:
+        print(f"Keine Bilder im Ordner {image_folder} gefunden.")
+
+# Thread, der den Bildordner regelmässig nach neuen und gelöschten Bildern durchsucht
+def library_scanner_thread():
+    next_run = 0.0
+    first_run = DEDUP_ENABLED   # Duplikate beim ersten Durchlauf immer neu bestimmen
+    while state.snapshot().running:
+        if time.time() >= next_run:
+            if os.path.exists(image_folder):
+                start = time.perf_counter()
+                found, added, removed = library.scan()
+                catalog.update(found, library.mtimes(found), library.root)
+                if SYNC_ENABLED:
+                    sync.update(found, library.mtimes(found))
+                hashed = dedup.update(found, library.mtimes(found)) if DEDUP_ENABLED else 0
+                if added or removed or hashed or first_run:
+                    apply_library(deduplicated(found))
+                    first_run = False
+                    print(f"Bildordner: {added} neue, {removed} entfernte Bilder "
+                          f"({time.perf_counter() - start:.1f} s).")
+            next_run = time.time() + LIBRARY_RESCAN_INTERVAL
+        time.sleep(1.0)
+
+# Favoritenliste als Playlist (Reihenfolge, schnelles "ist Favorit?" und Entfernen).
+# Änderungen landen zuerst in einem Journal (eine Zeile pro Änderung, angehängt), das regelmässig
+# zu favorites.json zusammengefasst wird. favorites.json wird nur atomar ersetzt (temporäre Datei + os.replace).
+# Geschrieben wird in einem eigenen Thread, nie während der Lock gehalten wird.
+# add/discard nur mit gehaltenem lock (z. B. innerhalb von state.transaction()) aufrufen.
+class FavoritesStore:
+    def __init__(self, path, journal_path, lock):
+        self.path = path
+        self.journal_path = journal_path
+        self.items = Playlist()
+        self._lock = lock
+        self._pending = []            # Noch nicht geschriebene Journal-Einträge
+        self._journal_entries = 0     # Einträge im Journal seit dem letzten Zusammenfassen
+        self._io_lock = Lock()
+        self._wakeup = Event()
+        self._stopped = False
+        self._writer = None
+
+    def __contains__(self, image):
+        return image in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def index(self, image):
+        return self.items.index(image)
+
+    def add(self, image):
+        if not self.items.append(image):
+            return False
+        self._pending.append(["+", image])
+        self._wakeup.set()
+        return True
+
+    def discard(self, image):
+        if not self.items.remove(image):
+            return False
+        self._pending.append(["-", image])
+        self._wakeup.set()
+        return True
+
+    # Lädt favorites.json und spielt das Journal ab. Eine abgeschnittene letzte Zeile (Stromausfall) wird ignoriert.
+    def load(self):
+        items = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                try:
+                    items = json.load(f)
+                except json.JSONDecodeError:
+                    items = []
+
+        items = Playlist(items)
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        op, image = json.loads(line)
+                    except (json.JSONDecodeError, ValueError):
+                        break
+                    if op == "+":
+                        items.append(image)
+                    elif op == "-":
+                        items.remove(image)
+                    replayed += 1
+
+        with self._lock:
+            self.items = items
+            self._pending = []
+        if replayed:
+            self.compact()
+
+    # Schreibt gesammelte Änderungen ins Journal und fasst bei Bedarf zusammen
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                entries = self._pending
+                self._pending = []
+                compact = self._journal_entries + len(entries) >= FAVORITES_COMPACT_EVERY
+            if entries:
+                with open(self.journal_path, "a") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_entries += len(entries)
+            if compact:
+                self._compact_locked()
+
+    def compact(self):
+        with self._io_lock:
+            self._compact_locked()
+
+    # Neues favorites.json schreiben, danach Journal leeren (Aufruf mit gehaltenem _io_lock)
+    def _compact_locked(self):
+        with self._lock:
+            items = list(self.items)
+            # Alles, was noch aussteht, ist im neuen favorites.json enthalten
+            self._pending = []
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(items, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        with open(self.journal_path, "w"):
+            pass
+        self._journal_entries = 0
+
+    def start(self):
+        self._writer = Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            # Änderungen der nächsten Sekunden mitnehmen (z. B. mehrfaches Tippen auf den Stern)
+            time.sleep(FAVORITES_FLUSH_DELAY)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Favoriten konnten nicht gespeichert werden: {e}")
+
+    # Beim Beenden: alles schreiben und zusammenfassen
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        try:
+            self.flush()
+            self.compact()
+        except OSError as e:
+            print(f"Favoriten konnten nicht gespeichert werden: {e}")
+
+favorites = FavoritesStore(favorites_file, favorites_journal_file, state.lock)
+
+# Lädt alle Bilder, welche im JSON-File als Favorit abgespeichert sind
+def load_favorites():
+    favorites.load()
+    favorites.start()
+
+# Favoriten-Liste im Speicher ändern (nur innerhalb von state.transaction()). True = geändert
+def favorites_add(s, image):
+    if not favorites.add(image):
+        return False
+    s.library_version += 1
+    return True
+
+def favorites_discard(s, image):
+    if not favorites.discard(image):
+        return False
+    frame_cache.invalidate(image)
+    s.library_version += 1
+    return True
+
+# Aktuelle Abspielliste (Favoriten oder alle Bilder) für einen Snapshot bzw. eine Transaktion
+def active_playlist(s):
+    if s.favorites_mode:
+        return favorites
+    return query_results if s.query is not None else images
+
+# Setzt current_index/current_image auf Position index der aktuellen Liste (nur innerhalb von state.transaction())
+def jump_to(s, index):
+    clist = active_playlist(s)
+    if clist:
+        s.current_index = index % len(clist)
+        s.current_image = clist[s.current_index]
+    else:
+        s.current_index = 0
+        s.current_image = None
+
+# Ein Bild vor (delta=1) oder zurück (delta=-1), in zufälliger Reihenfolge über shuffle_order
+def step(s, delta):
+    clist = active_playlist(s)
+    if s.shuffle and clist:
+        if delta > 0:
+            image = shuffle_order.next(clist, s.current_image)
+        else:
+            image = shuffle_order.back(clist, s.current_image)
+        if image is not None:
+            s.current_image = image
+            s.current_index = clist.index(image)
+            return
+    jump_to(s, s.current_index + delta)
+
+# Nach dem Entfernen des aktuellen Bildes: gleiche Position behalten (= nächstes Bild)
+def keep_position(s):
+    clist = active_playlist(s)
+    if s.current_image in clist:
+        s.current_index = clist.index(s.current_image)
+    else:
+        jump_to(s, min(s.current_index, max(len(clist) - 1, 0)))
+
+# Wechselt zwischen allen Bildern und Favoriten. Im anderen Modus geht es beim letzten Bild weiter.
+def switch_mode(s, favorites_mode):
+    if s.favorites_mode == favorites_mode:
+        return
+    resume = s.resume_image
+    s.resume_image = s.current_image
+    s.favorites_mode = favorites_mode
+    clist = active_playlist(s)
+    if resume in clist:
+        jump_to(s, clist.index(resume))
+    else:
+        jump_to(s, 0)
+
+# Speichert ein Bild als Favorit ab -> Eintrag im Journal
+def save_favorite(image):
+    with state.transaction() as s:
+        favorites_add(s, image)
+
+# Löscht ein Bild aus Favoriten -> Eintrag im Journal
+def remove_favorite(image):
+    with state.transaction() as s:
+        favorites_discard(s, image)
+
+# Bild auf Display anpassen
+# Mit out wird in einen vorhandenen Puffer (screen_height x screen_width x 3) geschrieben.
+def resize_and_center_image(image, screen_width, screen_height, out=None):
+    if out is None:
+        background = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
+    else:
+        background = out
+        background.fill(0)
+    image_height, image_width = image.shape[:2]
+    aspect_ratio = image_width / image_height
+
+    if aspect_ratio > screen_width / screen_height:
+        new_width = screen_width
+        new_height = int(screen_width / aspect_ratio)
+    else:
+        new_height = screen_height
+        new_width = int(screen_height * aspect_ratio)
+
+    x_offset = (screen_width - new_width) // 2
+    y_offset = (screen_height - new_height) // 2
+    # Direkt in den Zielbereich skalieren, ohne Zwischenbild
+    cv2.resize(image, (new_width, new_height),
+               dst=background[y_offset:y_offset + new_height, x_offset:x_offset + new_width])
+    return background
+
+# Liest Breite und Höhe aus dem Datei-Header (JPEG/PNG), ohne das Bild zu dekodieren.
+# Gibt None zurück, wenn das Format nicht erkannt wird.
+def read_image_size(path):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(24)
+            if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+                width, height = struct.unpack(">II", head[16:24])
+                return width, height
+            if not head.startswith(b"\xff\xd8"):
+                return None
+            f.seek(2)
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    return None
+                if byte != b"\xff":
+                    continue
+                marker = f.read(1)
+                while marker == b"\xff":
+                    marker = f.read(1)
+                if not marker:
+                    return None
+                code = marker[0]
+                # Marker ohne Längenfeld
+                if code == 0x01 or 0xD0 <= code <= 0xD9:
+                    continue
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                length = struct.unpack(">H", length_bytes)[0]
+                # SOF-Marker enthalten die Bildgrösse (C4, C8 und CC sind keine SOF)
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    data = f.read(5)
+                    if len(data) < 5:
+                        return None
+                    height, width = struct.unpack(">HH", data[1:5])
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+# EXIF-Felder (TIFF-Tags), die der Katalog braucht
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_GPS_IFD = 0x8825
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+# Liest Drehung, Aufnahmedatum und GPS-Position aus dem EXIF-Block eines JPEGs (nur der Header wird gelesen).
+# Gibt ein Dictionary mit den gefundenen Werten zurück (leer, wenn es keine EXIF-Daten gibt).
+def read_exif(path):
+    try:
+        with open(path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return {}
+            while True:
+                header = f.read(4)
+                if len(header) < 4 or header[0] != 0xFF or header[1] in (0xD9, 0xDA):
+                    return {}
+                length = struct.unpack(">H", header[2:])[0]
+                if header[1] == 0xE1:
+                    data = f.read(length - 2)
+                    if data.startswith(b"Exif\x00\x00"):
+                        return parse_exif(data[6:])
+                else:
+                    f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return {}
+
+def parse_exif(tiff):
+    result = {}
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return result
+
+    # Einträge eines IFD: Tag -> (Typ, Anzahl, Daten)
+    def read_ifd(offset):
+        entries = {}
+        count = struct.unpack_from(order + "H", tiff, offset)[0]
+        for i in range(count):
+            tag, kind, n, value = struct.unpack_from(order + "HHI4s", tiff, offset + 2 + 12 * i)
+            size = EXIF_TYPE_SIZES.get(kind, 1) * n
+            if size > 4:
+                value = tiff[struct.unpack(order + "I", value)[0]:][:size]
+            entries[tag] = (kind, n, value)
+        return entries
+
+    def number(entry):
+        kind, _, value = entry
+        return struct.unpack_from(order + ("H" if kind == 3 else "I"), value)[0]
+
+    def text(entry):
+        return entry[2].split(b"\x00")[0].decode("ascii", "replace").strip()
+
+    def degrees(entry):
+        values = struct.unpack_from(order + "6I", entry[2])
+        d, m, sec = (values[i] / values[i + 1] if values[i + 1] else 0.0 for i in (0, 2, 4))
+        return d + m / 60 + sec / 3600
+
+    try:
+        ifd0 = read_ifd(struct.unpack_from(order + "I", tiff, 4)[0])
+        if EXIF_ORIENTATION in ifd0:
+            result["orientation"] = number(ifd0[EXIF_ORIENTATION])
+        if EXIF_DATETIME in ifd0:
+            result["taken"] = text(ifd0[EXIF_DATETIME])
+        if EXIF_IFD in ifd0:
+            exif = read_ifd(number(ifd0[EXIF_IFD]))
+            if EXIF_DATETIME_ORIGINAL in exif:
+                result["taken"] = text(exif[EXIF_DATETIME_ORIGINAL])
+        if EXIF_GPS_IFD in ifd0:
+            gps = read_ifd(number(ifd0[EXIF_GPS_IFD]))
+            if all(tag in gps for tag in (1, 2, 3, 4)):
+                latitude, longitude = degrees(gps[2]), degrees(gps[4])
+                result["latitude"] = -latitude if text(gps[1]) == "S" else latitude
+                result["longitude"] = -longitude if text(gps[3]) == "W" else longitude
+    except (struct.error, IndexError, ValueError):
+        pass   # Defekte EXIF-Daten: was bis hier gelesen wurde, gilt
+    return result
+
+# Wählt den grössten JPEG-Reduktionsfaktor (8, 4, 2), der das Display noch vollständig abdeckt.
+# Beide Ausrichtungen werden geprüft, da cv2.imread die EXIF-Drehung erst nach dem Header anwendet.
+def choose_decode_factor(image_width, image_height, screen_width, screen_height):
+    scale = max(
+        min(screen_width / image_width, screen_height / image_height),
+        min(screen_width / image_height, screen_height / image_width),
+    )
+    for factor in (8, 4, 2):
+        if factor * scale <= 1.0:
+            return factor
+    return 1
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def is_video(path):
+    return path is not None and path.lower().endswith(VIDEO_EXTENSIONS)
+
+# Erstes Bild eines Videos/GIFs (Vorschaubild für Überblendung, Vorausladen und Bild-Cache)
+def read_video_poster(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        ok, img = capture.read()
+    finally:
+        capture.release()
+    return img if ok else None
+
+# Lädt ein Bild nur so gross wie für das Display nötig. Reduziertes Dekodieren lohnt sich nur bei JPEG,
+# alle anderen Formate (und unlesbare Header) werden vollständig dekodiert. Bei Videos: erstes Bild.
+def load_display_image(path, screen_width, screen_height):
+    start = time.perf_counter()
+    factor = 1
+    if is_video(path):
+        img = read_video_poster(path)
+        if img is not None:
+            metrics.observe("decode", time.perf_counter() - start)
+        return img
+    if path.lower().endswith((".jpg", ".jpeg")):
+        size = read_image_size(path)
+        if size and size[0] > 0 and size[1] > 0:
+            factor = choose_decode_factor(size[0], size[1], screen_width, screen_height)
+    img = cv2.imread(path, REDUCED_DECODE_FLAGS[factor])
+    if img is None and factor != 1:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        factor = 1
+    if img is not None:
+        metrics.observe("decode", time.perf_counter() - start)
+    if DECODE_LOG and img is not None:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"Dekodiert: {os.path.basename(path)} Faktor 1/{factor}, "
+              f"{img.shape[1]}x{img.shape[0]}, {elapsed_ms:.0f} ms")
+    return img
+
+# Vorrat an wiederverwendbaren Bildpuffern in Displaygrösse. Neue Arrays werden nur angelegt, wenn
+# kein freier Puffer da ist. Jeder ausgegebene Puffer hat einen Referenzzähler: acquire() gibt die erste
+# Referenz, retain() eine weitere (z.B. für den FrameCache), release() gibt eine zurück. Erst wenn keine
+# Referenz mehr besteht, kommt der Puffer in den Vorrat. Fremde Arrays werden bei retain()/release() ignoriert.
+# begin_frame()/end_frame() zählen die Neuanlagen des aufrufenden Threads pro gezeichnetem Bild.
+class FrameBufferPool:
+    def __init__(self, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT, max_free=FRAME_POOL_SIZE):
+        self.shape = (screen_height, screen_width, 3)
+        self.max_free = max_free
+        self.allocations = 0
+        self.reuses = 0
+        self.frames = 0
+        self.last_frame_allocations = 0
+        self.max_frame_allocations = 0
+        self._free = []
+        self._refs = {}   # id(Puffer) -> [schwache Referenz auf den Puffer, Anzahl Referenzen]
+        self._lock = Lock()
+        self._thread = local()
+
+    # Neuer Eintrag mit einer Referenz (Lock muss gehalten werden). Die schwache Referenz prüft bei retain()/release(),
+    # ob wirklich dieser Puffer gemeint ist und nicht ein anderes Array mit wiederverwendeter id(); wird ein Puffer ohne
+    # release() aufgegeben, entfernt der Rückruf seinen Eintrag (ohne Lock, das Aufräumen kann in jedem Thread passieren).
+    def _track(self, buffer):
+        key = id(buffer)
+        self._refs[key] = [weakref.ref(buffer, lambda ref: self._refs.pop(key, None)), 1]
+
+    def _entry(self, buffer):
+        entry = self._refs.get(id(buffer))
+        return entry if entry is not None and entry[0]() is buffer else None
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                self.reuses += 1
+                buffer = self._free.pop()
+                buffer.setflags(write=True)
+                self._track(buffer)
+                return buffer
+            self.allocations += 1
+        self._thread.allocations = getattr(self._thread, "allocations", 0) + 1
+        buffer = np.empty(self.shape, dtype=np.uint8)
+        with self._lock:
+            self._track(buffer)
+        return buffer
+
+    # Weitere Referenz auf einen Puffer aus dem Vorrat. Gibt den Puffer zurück.
+    def retain(self, buffer):
+        with self._lock:
+            entry = self._entry(buffer)
+            if entry is not None:
+                entry[1] += 1
+        return buffer
+
+    # Gibt eine Referenz zurück. Der Aufrufer darf den Puffer danach nicht mehr verwenden.
+    def release(self, buffer):
+        with self._lock:
+            entry = self._entry(buffer)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._refs[id(buffer)]
+            if len(self._free) < self.max_free:
+                self._free.append(buffer)
+
+    def begin_frame(self):
+        self._thread.frame_start = getattr(self._thread, "allocations", 0)
+
+    def end_frame(self):
+        count = getattr(self._thread, "allocations", 0) - getattr(self._thread, "frame_start", 0)
+        with self._lock:
+            self.frames += 1
+            self.last_frame_allocations = count
+            self.max_frame_allocations = max(self.max_frame_allocations, count)
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "free": len(self._free),
+                "in_use": len(self._refs),
+                "frames": self.frames,
+                "max_per_frame": self.max_frame_allocations,
+            }
+
+frame_pool = FrameBufferPool()
+
+# LRU-Zwischenspeicher für fertig skalierte Bilder. Schlüssel: (Pfad, mtime, Breite, Höhe)
+# Der Cache hält eine eigene Referenz auf Puffer aus dem Vorrat und gibt sie beim Verdrängen zurück.
+# get() gibt dem Aufrufer ebenfalls eine eigene Referenz, die er mit pool.release() zurückgibt - so wird ein
+# Bild, das gerade noch kopiert wird, nicht wiederverwendet, auch wenn es inzwischen verdrängt wurde.
+class FrameCache:
+    def __init__(self, max_bytes, pool=None):
+        self.max_bytes = max_bytes
+        self.pool = pool
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self._entries.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self.pool is not None:
+                self.pool.retain(frame)
+            return frame
+
+    def put(self, key, frame):
+        # Zu grosse Bilder werden gar nicht erst aufgenommen
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if self.pool is not None:
+                self.pool.retain(frame)   # Vor dem Zurückgeben des alten Eintrags (kann derselbe Puffer sein)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+                self._recycle(old)
+            self._entries[key] = frame
+            self.current_bytes += frame.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+                self._recycle(evicted)
+
+    def _recycle(self, frame):
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    # Entfernt alle Einträge eines Bildpfads (z. B. nach "bild löschen")
+    def invalidate(self, path):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == path]:
+                frame = self._entries.pop(key)
+                self.current_bytes -= frame.nbytes
+                self._recycle(frame)
+
+    def clear(self):
+        with self._lock:
+            for frame in self._entries.values():
+                self._recycle(frame)
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+            }
+
+frame_cache = FrameCache(FRAME_CACHE_BYTES, frame_pool)
+metrics.register_gauge("frame_cache_hits", lambda: frame_cache.hits)
+metrics.register_gauge("frame_cache_misses", lambda: frame_cache.misses)
+metrics.register_gauge("frame_pool_allocations", lambda: frame_pool.allocations)
+
+# Cache auf der SD-Karte mit fertig skalierten Bildern. Der Dateiname ist ein Hash aus
+# Pfad, Dateigrösse, mtime und Displaygrösse -> ändert sich das Original, wird neu gerechnet.
+# Belegt höchstens max_bytes: Die mtime einer Datei ist ihre letzte Verwendung, bei Überschreitung werden
+# die ältesten Dateien gelöscht.
+class RenditionCache:
+    TOUCH_INTERVAL = 60   # Sekunden, so oft wird die mtime einer gelesenen Datei höchstens erneuert
+    ORPHAN_AGE = 600      # Sekunden, so alt muss eine Datei ohne Originalbild sein, bevor cleanup() sie löscht
+
+    def __init__(self, folder, fmt=RENDITION_FORMAT, max_bytes=RENDITION_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.ext = ".npy" if fmt == "npy" else ".jpg"
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = None   # Belegung des Ordners, None = noch nicht gezählt
+        self._lock = Lock()
+
+    def _filename(self, path, screen_width, screen_height):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = f"{path}|{st.st_size}|{st.st_mtime_ns}|{screen_width}x{screen_height}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, digest + self.ext)
+
+    def contains(self, path, screen_width, screen_height):
+        filename = self._filename(path, screen_width, screen_height)
+        return filename is not None and os.path.exists(filename)
+
+    def load(self, path, screen_width, screen_height):
+        filename = self._filename(path, screen_width, screen_height)
+        frame = None
+        if filename is not None and os.path.exists(filename):
+            try:
+                if self.ext == ".npy":
+                    frame = np.load(filename, mmap_mode="r")
+                else:
+                    frame = cv2.imread(filename, cv2.IMREAD_COLOR)
+            except (OSError, ValueError) as e:
+                print(f"Cache-Datei {filename} defekt: {e}")
+            if frame is not None and frame.shape != (screen_height, screen_width, 3):
+                frame = None
+        if frame is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._touch(filename)
+        return frame
+
+    # Als zuletzt verwendet markieren (nicht bei jedem Lesen, um die SD-Karte zu schonen)
+    def _touch(self, filename):
+        try:
+            if time.time() - os.path.getmtime(filename) > self.TOUCH_INTERVAL:
+                os.utime(filename)
+        except OSError:
+            pass
+
+    # Dateien im Cache als [(mtime, Grösse, Pfad)], ohne halb geschriebene .tmp-Dateien
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(self.ext):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    # Löscht die am längsten nicht verwendeten Dateien, bis höchstens 90 % von max_bytes belegt sind
+    def enforce_budget(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                for _, size, filename in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        continue
+                    total -= size
+                    self.evictions += 1
+            self._bytes = total
+        return total
+
+    # Schreibt atomar (temporäre Datei + os.replace), damit ein Stromausfall keine halben Dateien hinterlässt
+    def store(self, path, screen_width, screen_height, frame):
+        filename = self._filename(path, screen_width, screen_height)
+        if filename is None:
+            return
+        tmp = filename + ".tmp"
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            if self.ext == ".npy":
+                with open(tmp, "wb") as f:
+                    np.save(f, np.ascontiguousarray(frame))
+            else:
+                ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, RENDITION_JPEG_QUALITY])
+                if not ok:
+                    return
+                with open(tmp, "wb") as f:
+                    f.write(data.tobytes())
+            os.replace(tmp, filename)
+            size = os.path.getsize(filename)
+        except OSError as e:
+            print(f"Konnte Cache-Datei {filename} nicht schreiben: {e}")
+            return
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            full = self._bytes is None or self._bytes > self.max_bytes
+        if full:
+            self.enforce_budget()
+
+    # Löscht alle Dateien, zu denen es kein (unverändertes) Originalbild mehr gibt. Junge Dateien bleiben:
+    # .tmp-Dateien, die gerade geschrieben werden, und Bilder, die ingest_upload abgelegt hat, bevor das
+    # hochgeladene Foto in der Bildliste steht. Liegengebliebene .tmp-Dateien werden später mit gelöscht.
+    def cleanup(self, paths, screen_width, screen_height):
+        if not os.path.isdir(self.folder):
+            return 0
+        cutoff = time.time() - self.ORPHAN_AGE
+        valid = set()
+        for path in paths:
+            filename = self._filename(path, screen_width, screen_height)
+            if filename is not None:
+                valid.add(os.path.basename(filename))
+        removed = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name not in valid:
+                    try:
+                        if entry.stat().st_mtime > cutoff:
+                            continue
+                        os.remove(entry.path)
+                        removed += 1
+                    except OSError:
+                        pass
+        self.enforce_budget()
+        return removed
+
+rendition_cache = RenditionCache(rendition_folder)
+
+# Liefert das fertig skalierte Bild für einen Pfad, aus dem Cache oder neu dekodiert.
+# Das Ergebnis darf nicht verändert werden (wird im Cache geteilt). Der Aufrufer gibt es mit
+# frame_pool.release() zurück, sobald er es nicht mehr braucht.
+def get_display_frame(path, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    key = (path, mtime, screen_width, screen_height)
+    frame = frame_cache.get(key)
+    if frame is None:
+        frame = rendition_cache.load(path, screen_width, screen_height)
+        if frame is None:
+            img = load_display_image(path, screen_width, screen_height)
+            if img is None:
+                return None
+            with metrics.span("resize"):
+                if (screen_height, screen_width, 3) == frame_pool.shape:
+                    frame = resize_and_center_image(img, screen_width, screen_height, out=frame_pool.acquire())
+                else:
+                    frame = resize_and_center_image(img, screen_width, screen_height)
+            rendition_cache.store(path, screen_width, screen_height, frame)
+        frame.setflags(write=False)
+        frame_cache.put(key, frame)
+    return frame
+
+# Liefert die Pfade, die vorausgeladen werden sollen. Reihenfolge = Priorität (aktuelles Bild zuerst)
+def neighbour_paths(clist, index, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND):
+    if not clist:
+        return []
+    n = len(clist)
+    index %= n
+    offsets = [0]
+    for i in range(1, max(ahead, behind) + 1):
+        if i <= ahead:
+            offsets.append(i)
+        if i <= behind:
+            offsets.append(-i)
+    paths = []
+    for offset in offsets:
+        path = clist[(index + offset) % n]
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+# Dekodiert die kommenden (und vorherigen) Bilder im Hintergrund in den frame_cache.
+# Bei einem Sprung (gehe zu bild, von vorne, Moduswechsel) wird nicht mehr benötigte Arbeit verworfen.
+class Prefetcher:
+    def __init__(self, workers=PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._pending = {}      # Pfad -> Future
+        self._wanted = set()
+        self._target = ()
+        self._lock = Lock()
+
+    # Neue Zielpfade setzen (Liste aus neighbour_paths)
+    def retarget(self, paths):
+        target = tuple(paths)
+        with self._lock:
+            if target == self._target:
+                return
+            self._target = target
+            self._wanted = set(target)
+            for path, future in list(self._pending.items()):
+                if future.done():
+                    del self._pending[path]
+                elif path not in self._wanted and future.cancel():
+                    del self._pending[path]
+            for path in target:
+                if path not in self._pending:
+                    self._pending[path] = self._executor.submit(self._decode, path)
+
+    def _decode(self, path):
+        with self._lock:
+            if path not in self._wanted:
+                return False
+        frame = get_display_frame(path)
+        if frame is None:
+            return False
+        frame_pool.release(frame)   # Bleibt im FrameCache
+        return True
+
+    # Wie get_display_frame (Ergebnis mit frame_pool.release() zurückgeben), wartet aber auf eine bereits
+    # laufende Dekodierung statt doppelt zu arbeiten
+    def get(self, path):
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None and not future.cancelled():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Fehler beim Vorausladen von {path}: {e}")
+        return get_display_frame(path)
+
+    # True, solange noch vorausgeladen wird
+    def busy(self):
+        with self._lock:
+            return any(not future.done() for future in self._pending.values())
+
+    def shutdown(self):
+        with self._lock:
+            self._wanted = set()
+            self._target = ()
+            self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+prefetcher = Prefetcher()
+
+# Deutsche Zahlwörter ("zwölf", "einundzwanzig", "hundertdrei") als Zahl, sonst None.
+# "ein"/"eine" alleine zählen nicht als Zahl ("ein bild zurück"), nur in Zusammensetzungen.
+NUMBER_UNITS = {"eins": 1, "zwei": 2, "zwo": 2, "drei": 3, "vier": 4, "fünf": 5,
+                "sechs": 6, "sieben": 7, "acht": 8, "neun": 9}
+NUMBER_TEENS = {"null": 0, "zehn": 10, "elf": 11, "zwölf": 12, "dreizehn": 13, "vierzehn": 14,
+                "fünfzehn": 15, "sechzehn": 16, "siebzehn": 17, "achtzehn": 18, "neunzehn": 19}
+NUMBER_TENS = {"zwanzig": 20, "dreissig": 30, "dreißig": 30, "vierzig": 40, "fünfzig": 50,
+               "sechzig": 60, "siebzig": 70, "achtzig": 80, "neunzig": 90}
+
+def parse_german_number(word, standalone=True):
+    word = word.lower()
+    if not word:
+        return None
+    if word.isdigit():
+        return int(word)
+    for unit_word, factor in (("tausend", 1000), ("hundert", 100)):
+        if unit_word in word:
+            left, right = word.split(unit_word, 1)
+            left_value = parse_german_number(left, standalone=False) if left else 1
+            right = right[3:] if right.startswith("und") else right
+            right_value = parse_german_number(right, standalone=False) if right else 0
+            if left_value is None or right_value is None:
+                return None
+            return left_value * factor + right_value
+    if word in NUMBER_UNITS:
+        return NUMBER_UNITS[word]
+    if word in ("ein", "eine"):
+        return None if standalone else 1
+    if word in NUMBER_TEENS:
+        return NUMBER_TEENS[word]
+    if word in NUMBER_TENS:
+        return NUMBER_TENS[word]
+    if "und" in word:
+        unit, tens = word.split("und", 1)
+        unit_value = 1 if unit == "ein" else NUMBER_UNITS.get(unit)
+        if unit_value is not None and tens in NUMBER_TENS:
+            return NUMBER_TENS[tens] + unit_value
+    return None
+
+# Sucht die erste Zahl im Text (auch über mehrere Wörter, z.B. "zwei hundert") und entfernt sie.
+# Gibt (Text ohne Zahl, Zahl oder None) zurück.
+def extract_number(text):
+    words = re.findall(r"\w+", text.lower())
+    for i in range(len(words)):
+        for j in range(len(words), i, -1):
+            number = parse_german_number("".join(words[i:j]))
+            if number is not None:
+                return " ".join(words[:i] + words[j:]), number
+    return " ".join(words), None
+
+# Ergebnis der Befehlserkennung: erkannter Befehl (oder None), Zahl als Parameter, Originaltext,
+# Übereinstimmung in Prozent und ob das Erkennungswort im Text vorkam
+@dataclass(frozen=True)
+class CommandMatch:
+    command: str
+    number: int
+    text: str
+    score: float
+    hotword: bool
+    argument: str = None   # Freier Text nach Befehlen aus TEXT_ARGUMENT_COMMANDS
+
+# Erkennt Erkennungswort, Befehl und Zahl in einem Durchgang. Die Befehlsliste wird einmal vorbereitet,
+# alle Varianten des Erkenners werden gemeinsam mit process.cdist gegen alle Befehle bewertet.
+class CommandMatcher:
+    def __init__(self, commands=known_commands, hotwords=HOTWORD_VARIANTS, cutoff=COMMAND_MATCH_CUTOFF,
+                 text_commands=TEXT_ARGUMENT_COMMANDS):
+        self.commands = list(commands)
+        self.text_commands = list(text_commands)
+        self.cutoff = cutoff
+        self._hotwords = list(hotwords)
+        self.hotwords = None
+        self._choices = None
+
+    # rapidfuzz wird erst hier geladen (beim Start der Spracherkennung oder beim ersten Befehl)
+    def prepare(self):
+        if self._choices is None:
+            from rapidfuzz import fuzz, process
+            from rapidfuzz.utils import default_process
+            self._fuzz, self._process, self._default_process = fuzz, process, default_process
+            self.hotwords = [default_process(h) for h in self._hotwords]
+            self._choices = [default_process(c) for c in self.commands]
+
+    # Gibt (Erkennungswort gefunden, Text nach dem Erkennungswort) zurück
+    def split_hotword(self, text):
+        positions = [(text.find(h), h) for h in self.hotwords if h in text]
+        if not positions:
+            return False, text
+        index, hotword = min(positions)
+        return True, text[index + len(hotword):].strip()
+
+    # alternatives: Texte des Erkenners, beste zuerst. Mit require_hotword zählen nur Varianten mit Erkennungswort.
+    def match(self, alternatives, require_hotword=False):
+        with metrics.span("matching"):
+            return self._match(alternatives, require_hotword)
+
+    def _match(self, alternatives, require_hotword):
+        self.prepare()
+        candidates = []
+        any_hotword = False
+        for text in alternatives:
+            if not text:
+                continue
+            hotword, rest = self.split_hotword(self._default_process(text))
+            any_hotword = any_hotword or hotword
+            if require_hotword and not hotword:
+                continue
+            rest, number = extract_number(rest)
+            if rest:
+                candidates.append((text, rest, number))
+        if not candidates:
+            return CommandMatch(None, None, alternatives[0] if alternatives else None, 0.0, any_hotword)
+
+        scores = self._process.cdist([rest for _, rest, _ in candidates], self._choices,
+                                     scorer=self._fuzz.token_sort_ratio, processor=None)
+        # Bei gleicher Punktzahl gewinnt die frühere (wahrscheinlichere) Variante
+        best = int(np.argmax(scores))
+        row, column = divmod(best, len(self._choices))
+        score = float(scores[row, column])
+        text, _, number = candidates[row]
+        command = self.commands[column] if score > self.cutoff else None
+
+        # Befehle mit freiem Text ("bilder aus italien"): nur die ersten Wörter müssen passen
+        for text, rest, number in candidates:
+            words = rest.split()
+            for prefix in self.text_commands:
+                length = len(prefix.split())
+                prefix_score = self._fuzz.ratio(" ".join(words[:length]), prefix)
+                if prefix_score > self.cutoff and prefix_score >= score:
+                    argument = " ".join(words[length:]) or None
+                    return CommandMatch(prefix, number, text, prefix_score, any_hotword, argument)
+        return CommandMatch(command, number, text, score, any_hotword)
+
+command_matcher = CommandMatcher()
+
+# Verbessert Erkennung mittels bekannter Befehle. Befehl erkannt bei > 70% übereinstimmung
+def find_best_match(command):
+    return command_matcher.match([command]).command
+
+# Vermeidung von Umlauten -> Können nicht dargestellt werden.
+def ascii_fallback(text):
+    text = text.replace("ä", "ae").replace("Ä", "Ae")
+    text = text.replace("ö", "oe").replace("Ö", "Oe")
+    text = text.replace("ü", "ue").replace("Ü", "Ue")
+    text = text.replace("ß", "ss")
+    return text
+
+# Sprach-Erkennung (VAD): Trennt den Audiostrom anhand der Lautstärke in einzelne Äusserungen.
+# Das Grundrauschen kommt von der Aufnahme (noise_floor_source) oder wird selbst aus den Pausen geschätzt.
+class VoiceActivityDetector:
+    def __init__(self, rate, frame_ms=20, noise_floor_source=None):
+        self.rate = rate
+        self.frame_size = int(rate * frame_ms / 1000)
+        self.noise_floor = None
+        self.noise_floor_source = noise_floor_source
+        self._rest = np.empty(0, dtype=np.int16)
+        self._position = 0          # Absolute Sample-Position des nächsten Frames
+        self._preroll = deque(maxlen=max(1, int(VAD_PREROLL * 1000 / frame_ms)))
+        self._frames = []
+        self._start = 0
+        self._preroll_frames = 0
+        self._silent_frames = 0
+        self._silence_limit = max(1, int(VAD_SILENCE * 1000 / frame_ms))
+        self._max_frames = int(VAD_MAX_SEGMENT * 1000 / frame_ms)
+        self._min_samples = int(VAD_MIN_SPEECH * rate)
+
+    def threshold(self):
+        noise_floor = self.noise_floor_source() if self.noise_floor_source else self.noise_floor
+        if noise_floor is None:
+            return VAD_MIN_RMS
+        return max(VAD_MIN_RMS, noise_floor * VAD_ENERGY_FACTOR)
+
+    # Nimmt neue Samples entgegen, gibt abgeschlossene Äusserungen als Liste von (Startposition, Samples) zurück
+    def feed(self, samples):
+        data = np.concatenate((self._rest, samples)) if len(self._rest) else samples
+        usable = len(data) - len(data) % self.frame_size
+        self._rest = data[usable:].copy()
+        finished = []
+        for offset in range(0, usable, self.frame_size):
+            frame = data[offset:offset + self.frame_size]
+            rms = float(np.sqrt(np.mean(frame.astype(np.float32) ** 2)))
+            position = self._position
+            self._position += self.frame_size
+
+            if rms > self.threshold():
+                if not self._frames:
+                    self._start = position - len(self._preroll) * self.frame_size
+                    self._preroll_frames = len(self._preroll)
+                    self._frames = list(self._preroll)
+                    self._preroll.clear()
+                self._frames.append(frame)
+                self._silent_frames = 0
+            elif self._frames:
+                self._frames.append(frame)
+                self._silent_frames += 1
+            else:
+                if self.noise_floor_source is None:
+                    self.noise_floor = rms if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * rms
+                self._preroll.append(frame)
+
+            if self._frames and (self._silent_frames >= self._silence_limit or len(self._frames) >= self._max_frames):
+                segment = np.concatenate(self._frames)
+                speech_frames = len(self._frames) - self._silent_frames - self._preroll_frames
+                if speech_frames * self.frame_size >= self._min_samples:
+                    finished.append((self._start, segment))
+                self._frames = []
+                self._silent_frames = 0
+        return finished
+
+# Mel-Filterbank für log_mel_features (wird pro Abtastrate nur einmal berechnet)
+@functools.lru_cache(maxsize=4)
+def mel_filterbank(rate, nfft, n_mels):
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(80.0), hz_to_mel(min(7600.0, rate / 2)), n_mels + 2)
+    bins = np.floor((nfft + 1) * mel_to_hz(mel_points) / rate).astype(int)
+    bank = np.zeros((n_mels, nfft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        for k in range(left, center):
+            bank[m - 1, k] = (k - left) / max(1, center - left)
+        for k in range(center, right):
+            bank[m - 1, k] = (right - k) / max(1, right - center)
+    return bank
+
+# Log-Mel-Merkmale (25 ms Fenster, 10 ms Schritt), mittelwertbereinigt -> unabhängig von der Lautstärke
+def log_mel_features(samples, rate, n_mels=26):
+    x = samples.astype(np.float32) / 32768.0
+    frame_len = int(0.025 * rate)
+    hop = int(0.010 * rate)
+    if len(x) < frame_len:
+        return np.zeros((0, n_mels), dtype=np.float32)
+    n_frames = 1 + (len(x) - frame_len) // hop
+    indices = np.arange(frame_len)[None, :] + hop * np.arange(n_frames)[:, None]
+    frames = x[indices] * np.hamming(frame_len).astype(np.float32)
+    nfft = 1 << (frame_len - 1).bit_length()
+    power = np.abs(np.fft.rfft(frames, nfft)) ** 2
+    mel = np.log(power @ mel_filterbank(rate, nfft, n_mels).T + 1e-10)
+    return mel - mel.mean(axis=0)
+
+# Lokale Erkennung des Erkennungsworts: Vergleicht den Anfang einer Äusserung per DTW (Dynamic Time Warping)
+# mit Vorlagen (eigene WAV-Aufnahmen von "Hey Berry" im hotword_folder). Kein Netzwerk nötig.
+class TemplateHotwordSpotter:
+    def __init__(self, templates=None, threshold=HOTWORD_THRESHOLD):
+        self.templates = templates or []    # Liste von (Abtastrate, Samples)
+        self.threshold = threshold
+        self._features = {}                 # Abtastrate -> Merkmale der Vorlagen
+
+    @classmethod
+    def from_folder(cls, folder, threshold=HOTWORD_THRESHOLD):
+        templates = []
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                if name.lower().endswith(".wav"):
+                    try:
+                        rate, samples = read_wav(os.path.join(folder, name))
+                        templates.append((rate, samples))
+                    except (OSError, ValueError, wave.Error) as e:
+                        print(f"Hotword-Vorlage {name} konnte nicht gelesen werden: {e}")
+        return cls(templates, threshold)
+
+    def _template_features(self, rate):
+        if rate not in self._features:
+            self._features[rate] = [log_mel_features(resample(samples, template_rate, rate), rate)
+                                    for template_rate, samples in self.templates]
+        return self._features[rate]
+
+    # Gibt (erkannt, Abstand, Ende des Erkennungsworts in Samples) zurück
+    def detect(self, samples, rate):
+        segment = log_mel_features(samples, rate)
+        best_distance, best_end = float("inf"), 0
+        for template in self._template_features(rate):
+            if len(template) == 0 or len(segment) == 0:
+                continue
+            distance, end_frame = subsequence_dtw(template, segment)
+            if distance < best_distance:
+                best_distance, best_end = distance, end_frame
+        end_sample = min(len(samples), int((best_end + 1) * 0.010 * rate))
+        return best_distance <= self.threshold, best_distance, end_sample
+
+# DTW mit festem Anfang und freiem Ende: Wie gut passt die Vorlage auf den Anfang der Äusserung?
+# Gibt (normierter Abstand, letzter passender Frame der Äusserung) zurück.
+def subsequence_dtw(template, segment):
+    a = template / (np.linalg.norm(template, axis=1, keepdims=True) + 1e-9)
+    b = segment / (np.linalg.norm(segment, axis=1, keepdims=True) + 1e-9)
+    m = len(a)
+    n = min(len(b), 2 * m)
+    cost = (1.0 - a @ b[:n].T).tolist()
+    inf = float("inf")
+    previous = [0.0] + [inf] * n
+    for i in range(m):
+        row_cost = cost[i]
+        current = [inf] * (n + 1)
+        for j in range(1, n + 1):
+            best = previous[j - 1]
+            if previous[j] < best:
+                best = previous[j]
+            if current[j - 1] < best:
+                best = current[j - 1]
+            current[j] = row_cost[j - 1] + best
+        previous = current
+    best_distance, best_end = inf, n - 1
+    for j in range(max(1, m // 2), n + 1):
+        distance = previous[j] / (m + j)
+        if distance < best_distance:
+            best_distance, best_end = distance, j - 1
+    return best_distance, best_end
+
+# Liest eine 16-Bit-WAV-Datei als Mono-Samples
+def read_wav(path):
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError("nur 16-Bit-WAV wird unterstützt")
+        rate = w.getframerate()
+        channels = w.getnchannels()
+        samples = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return rate, samples
+
+# Einfache lineare Umrechnung der Abtastrate (reicht für Merkmale/Vorlagen)
+def resample(samples, rate, target_rate):
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    count = int(len(samples) * target_rate / rate)
+    positions = np.linspace(0, len(samples) - 1, count)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+
+# Erkenner für den eigentlichen Befehl. Jeder Backend hat recognize_alternatives(samples, rate) -> Liste
+# der Varianten (beste zuerst, evtl. leer) und recognize(samples, rate) -> beste Variante oder None.
+class RecognizerBackend(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def recognize_alternatives(self, samples, rate):
+        ...
+
+    def recognize(self, samples, rate):
+        alternatives = self.recognize_alternatives(samples, rate)
+        return alternatives[0] if alternatives else None
+
+class GoogleBackend(RecognizerBackend):
+    name = "google"
+
+    def __init__(self, language="de-DE"):
+        import speech_recognition as sr
+        self._sr = sr
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize_alternatives(self, samples, rate):
+        audio = self._sr.AudioData(samples.tobytes(), rate, 2)
+        try:
+            result = self.recognizer.recognize_google(audio, language=self.language, show_all=True)
+        except self._sr.UnknownValueError:
+            return []
+        if not result:
+            return []
+        alternatives = [a["transcript"].lower() for a in result.get("alternative", []) if a.get("transcript")]
+        return alternatives[:RECOGNIZER_ALTERNATIVES]
+
+# Offline-Erkenner (optional): pip install vosk, Modell nach VOSK_MODEL_PATH entpacken
+class VoskBackend(RecognizerBackend):
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        import vosk
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def recognize_alternatives(self, samples, rate):
+        recognizer = self._vosk.KaldiRecognizer(self.model, rate)
+        recognizer.SetMaxAlternatives(RECOGNIZER_ALTERNATIVES)
+        recognizer.AcceptWaveform(samples.tobytes())
+        result = json.loads(recognizer.FinalResult())
+        texts = [a.get("text", "") for a in result.get("alternatives", [])] or [result.get("text", "")]
+        return [t.lower() for t in texts if t]
+
+# Ersatz-Erkenner für Tests und Messungen: liefert vorgegebene Texte der Reihe nach, ohne Netzwerk.
+# Ein Eintrag ist ein Text oder eine Liste von Varianten.
+class ScriptedBackend(RecognizerBackend):
+    name = "scripted"
+
+    def __init__(self, transcripts):
+        self._transcripts = deque(transcripts)
+
+    def recognize_alternatives(self, samples, rate):
+        if not self._transcripts:
+            return []
+        entry = self._transcripts.popleft()
+        if entry is None:
+            return []
+        return [entry] if isinstance(entry, str) else list(entry)
+
+def create_recognizer_backend():
+    if RECOGNIZER_BACKEND == "vosk":
+        try:
+            return VoskBackend()
+        except Exception as e:
+            print(f"Vosk nicht verfügbar ({e}), verwende Google.")
+    return GoogleBackend()
+
+# Ringpuffer fester Grösse für Audio-Samples. Positionen sind absolut (Anzahl Samples seit Start),
+# damit mehrere Leser unabhängig voneinander lesen können.
+class AudioRingBuffer:
+    def __init__(self, rate, seconds=AUDIO_BUFFER_SECONDS):
+        self.rate = rate
+        self.capacity = int(rate * seconds)
+        self.written = 0
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self._condition = Condition()
+
+    def write(self, samples):
+        with self._condition:
+            if len(samples) > self.capacity:
+                self.written += len(samples) - self.capacity
+                samples = samples[-self.capacity:]
+            start = self.written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+            self._condition.notify_all()
+
+    # Liest ab position alles Neue (wartet höchstens timeout). Gibt (neue Position, Samples) zurück.
+    # Ist position schon überschrieben, wird ab dem ältesten noch vorhandenen Sample gelesen.
+    def read(self, position, timeout=0.1):
+        with self._condition:
+            if self.written <= position:
+                self._condition.wait(timeout)
+            oldest = max(0, self.written - self.capacity)
+            if position < oldest:
+                print(f"Audio-Puffer übergelaufen, {(oldest - position) / self.rate:.1f} s verworfen.")
+                position = oldest
+            count = self.written - position
+            start = position % self.capacity
+            first = min(count, self.capacity - start)
+            samples = np.concatenate((self._data[start:start + first], self._data[:count - first]))
+        return position + count, samples
+
+# Sucht das Mikrofon anhand des Namens, sonst MIC_DEVICE_INDEX (None = Standardgerät)
+def find_microphone_index(name=MIC_DEVICE_NAME, index=MIC_DEVICE_INDEX):
+    import speech_recognition as sr
+    if name:
+        for i, mic_name in enumerate(sr.Microphone.list_microphone_names()):
+            if name.lower() in mic_name.lower():
+                return i
+        print(f"Mikrofon '{name}' nicht gefunden, verwende Index {index}.")
+    return index
+
+# Aufnahme-Thread: Hält das Mikrofon während der ganzen Laufzeit offen, schreibt in den Ringpuffer
+# und schätzt laufend das Grundrauschen (20%-Quantil der Lautstärke der letzten NOISE_FLOOR_WINDOW Sekunden).
+class AudioCapture:
+    def __init__(self, device_name=MIC_DEVICE_NAME, device_index=MIC_DEVICE_INDEX):
+        self.device_name = device_name
+        self.device_index = device_index
+        self.buffer = None
+        self.noise_floor = None
+        self.ready = Event()
+        self._levels = deque()
+        self._thread = None
+
+    @property
+    def rate(self):
+        return self.buffer.rate
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        import speech_recognition as sr
+        silence_alsa_errors()
+        while state.snapshot().running:
+            try:
+                index = find_microphone_index(self.device_name, self.device_index)
+                with sr.Microphone(device_index=index) as source:
+                    if self.buffer is None or self.buffer.rate != source.SAMPLE_RATE:
+                        self.buffer = AudioRingBuffer(source.SAMPLE_RATE)
+                        self._levels = deque(maxlen=max(1, int(NOISE_FLOOR_WINDOW * source.SAMPLE_RATE / source.CHUNK)))
+                    print(f"Mikrofon geöffnet (Index {index}, {source.SAMPLE_RATE} Hz).")
+                    self.ready.set()
+                    while state.snapshot().running:
+                        data = source.stream.read(source.CHUNK)
+                        with metrics.span("audio_capture"):
+                            samples = np.frombuffer(data, dtype=np.int16)
+                            self._update_noise_floor(samples)
+                            self.buffer.write(samples)
+            except Exception as e:
+                print(f"Fehler bei der Audioaufnahme: {e}")
+                time.sleep(2.0)
+
+    def _update_noise_floor(self, samples):
+        if len(samples) == 0:
+            return
+        self._levels.append(float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))))
+        self.noise_floor = float(np.percentile(self._levels, 20))
+
+    # Neue Leseposition am aktuellen Ende des Puffers
+    def source(self):
+        return CaptureSource(self)
+
+# Audioquelle: Liest aus dem Ringpuffer von AudioCapture. Die Position bleibt erhalten, auch während
+# der Befehl erkannt wird - es geht also kein Audio zwischen Erkennungswort und Befehl verloren.
+class CaptureSource:
+    def __init__(self, capture):
+        self.capture = capture
+        self.rate = capture.rate
+        self.position = capture.buffer.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def noise_floor(self):
+        return self.capture.noise_floor
+
+    def read(self):
+        self.position, samples = self.capture.buffer.read(self.position)
+        return samples
+
+# Audioquelle: WAV-Datei in kleinen Stücken (für Tests und Messungen). read() gibt am Ende None zurück.
+class WavFileSource:
+    def __init__(self, path, chunk_ms=20):
+        self.rate, self.samples = read_wav(path)
+        self.chunk = int(self.rate * chunk_ms / 1000)
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def read(self):
+        if self.position >= len(self.samples):
+            return None
+        chunk = self.samples[self.position:self.position + self.chunk]
+        self.position += len(chunk)
+        return chunk
+
+# Verbindet Audioquelle, VAD, lokale Hotword-Erkennung und Befehls-Erkenner
+class VoiceListener:
+    def __init__(self, source, spotter, backend, matcher=None):
+        self.source = source
+        self.spotter = spotter
+        self.backend = backend
+        self.matcher = matcher or command_matcher
+        self.rate = source.rate
+        self.vad = VoiceActivityDetector(self.rate, noise_floor_source=getattr(source, "noise_floor", None))
+        self._segments = deque()
+
+    # Nächste Äusserung (Startposition, Samples) oder None bei Timeout / Ende der Quelle
+    def next_segment(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._segments:
+            if deadline is not None and time.time() > deadline:
+                return None
+            if not state.snapshot().running:
+                return None
+            chunk = self.source.read()
+            if chunk is None:
+                return None
+            self._segments.extend(self.vad.feed(chunk))
+        return self._segments.popleft()
+
+    # Prüft eine Äusserung auf das Erkennungswort. Gibt (erkannt, CommandMatch oder None) zurück.
+    # Mit Vorlagen wird lokal geprüft; folgt der Befehl ohne Pause, wird der Rest der Äusserung als
+    # nächste Äusserung behandelt. Ohne Vorlagen geht die Äusserung an den Erkenner - enthält sie
+    # "hey berry <befehl>", ist der Befehl gleich mit erkannt.
+    def hear(self, segment):
+        start, samples = segment
+        if self.spotter.templates:
+            with metrics.span("hotword"):
+                hit, distance, end_sample = self.spotter.detect(samples, self.rate)
+            if VOICE_DEBUG:
+                print(f"Debug: Hotword-Abstand {distance:.3f}")
+            if hit and len(samples) - end_sample >= VAD_MIN_SPEECH * self.rate:
+                self._segments.appendleft((start + end_sample, samples[end_sample:]))
+            return hit, None
+        with metrics.span("recognition"):
+            alternatives = self.backend.recognize_alternatives(samples, self.rate)
+        if VOICE_DEBUG:
+            print(f"Debug: Erkanntes Audio: {alternatives}")
+        match = self.matcher.match(alternatives, require_hotword=True)
+        return match.hotword, match if match.command else None
+
+    def is_hotword(self, segment):
+        return self.hear(segment)[0]
+
+    # Befehl ohne Erkennungswort (nach "hey berry"). Gibt CommandMatch zurück, None wenn nichts verstanden wurde.
+    def transcribe(self, segment):
+        with metrics.span("recognition"):
+            alternatives = self.backend.recognize_alternatives(segment[1], self.rate)
+        if not alternatives:
+            return None
+        return self.matcher.match(alternatives)
+
+# Misst die lokale Hotword-Erkennung an einer WAV-Datei: Treffer, Verarbeitungszeit pro Äusserung,
+# Latenz ab Ende der Äusserung (inkl. VAD-Wartezeit) und CPU-Zeit im Verhältnis zur Audiodauer.
+def evaluate_hotword_wav(path, spotter, backend=None):
+    source = WavFileSource(path)
+    listener = VoiceListener(source, spotter, backend or ScriptedBackend([]))
+    detections = []
+    cpu_start = time.process_time()
+    while True:
+        segment = listener.next_segment()
+        if segment is None:
+            break
+        start = time.perf_counter()
+        hit = listener.is_hotword(segment)
+        processing = time.perf_counter() - start
+        detections.append({
+            "start_s": segment[0] / source.rate,
+            "end_s": (segment[0] + len(segment[1])) / source.rate,
+            "hit": hit,
+            "processing_ms": processing * 1000,
+            "latency_ms": (VAD_SILENCE + processing) * 1000,
+        })
+    cpu = time.process_time() - cpu_start
+    audio_seconds = len(source.samples) / source.rate
+    return {"detections": detections, "cpu_s": cpu, "audio_s": audio_seconds,
+            "cpu_ratio": cpu / audio_seconds if audio_seconds else 0.0}
+
+# Listener Funktion: Wartet auf das Erkennungswort "Hey Berry".
+# Gibt (erkannt, CommandMatch oder None) zurück - der Befehl ist dabei, wenn er in der gleichen Äusserung kam.
+def listen_for_command(listener):
+    segment = listener.next_segment(timeout=5)
+    if segment is None:
+        return False, None
+    heard, match = listener.hear(segment)
+    if heard:
+        print("Erkennungswort erkannt!")
+        state.update(hotword_feedback_until=time.time() + 1.0)  # 1 Sekunde blauer Rand
+        if match:
+            print(f"Befehl erkannt: {match.command} (Original: '{match.text}')")
+    return heard, match
+
+# Listener Funktion: Wartet auf einen Befehl, nachdem das Erkennungswort erkannt wurde
+def listen_for_following_command(listener):
+    """
+    Gibt ein CommandMatch zurück (command=None, falls kein passender Befehl)
+    oder None, falls nichts verstanden wurde.
+    """
+    print("Sprich jetzt deinen Befehl...")
+    segment = listener.next_segment(timeout=5)
+    if segment is None:
+        print("Kein Befehl erkannt (Timeout).")
+        return None
+    match = listener.transcribe(segment)
+    if match is None:
+        print("Ich konnte den Befehl nicht verstehen.")
+        return None
+    if match.command:
+        print(f"Befehl erkannt: {match.command} (Original: '{match.text}')")
+    else:
+        print(f"Unbekannter Befehl: '{match.text}'")
+    return match
+
+# Erkannter Befehl wird ausgeführt. Alles in einer kurzen Transaktion, Favoriten werden im Hintergrund gespeichert.
+# number: bereits erkannte Zahl (z.B. "gehe zu bild zwölf"), sonst wird sie aus original_text gelesen.
+def execute_command(command, original_text="", number=None, argument=None):
+    global query_results
+    print(f"DEBUG: execute_command aufgerufen mit command='{command}'")
+
+    # Katalog-Abfrage vor der Transaktion, damit der Lock nicht während der Datenbankabfrage gehalten wird
+    found = None
+    if command in TEXT_ARGUMENT_COMMANDS:
+        year, month, place = parse_photo_query(argument, number)
+        month_name = next((name for name, value in MONTHS.items() if value == month), None)
+        label = " ".join(str(part) for part in (place, month_name, year) if part)
+        if label:
+            found = [path for path in catalog.query(year, month, place) if path in images]
+
+    with metrics.span("command"), state.transaction() as s:
+        if command in ["stopp", "pause"]:
+            s.paused = True
+            print("Diashow gestoppt/pausiert.")
+        elif command in ["weiter", "play"]:
+            s.paused = False
+            print("Diashow fortgesetzt.")
+        elif command == "schneller":
+            if s.current_speed > 1:
+                s.current_speed -= 1
+            print("Geschwindigkeit erhöht (Intervall verkürzt).")
+        elif command == "langsamer":
+            s.current_speed += 1
+            print("Geschwindigkeit verringert (Intervall erhöht).")
+        elif command == "vorwärts":
+            step(s, 1)
+            print("Ein Bild vorwärts.")
+        elif command == "zurück":
+            step(s, -1)
+            print("Ein Bild zurück.")
+        elif command == "speichern als favorit":
+            if s.current_image:
+                favorites_add(s, s.current_image)
+                print(f"Bild {s.current_image} als Favorit gespeichert.")
+        elif command == "spiele favoriten ab":
+            if favorites:
+                switch_mode(s, True)
+                print("Wechsle in Favoriten-Slideshow.")
+            else:
+                print("Keine Favoriten vorhanden!")
+        elif command == "alle bilder anzeigen":
+            switch_mode(s, False)
+            if s.query is not None:
+                s.query = None
+                jump_to(s, images.index(s.current_image) if s.current_image in images else 0)
+            print("Wechsle zur normalen Slideshow (alle Bilder).")
+        elif command in TEXT_ARGUMENT_COMMANDS:
+            if found is None:
+                print("Kein Jahr, Monat oder Ort erkannt.")
+                s.command_fail_until = time.time() + 1.0
+            elif not found:
+                print(f"Keine Bilder gefunden für: {label}")
+                s.command_fail_until = time.time() + 1.0
+            else:
+                query_results = Playlist(found)
+                if s.favorites_mode:
+                    switch_mode(s, False)
+                s.query = label
+                s.library_version += 1
+                jump_to(s, 0)
+                print(f"Zeige {len(found)} Bilder: {label}")
+        elif command == "bewegte bilder":
+            s.ken_burns = True
+            print("Bilder werden langsam gezoomt und geschwenkt.")
+        elif command == "ruhige bilder":
+            s.ken_burns = False
+            print("Bilder werden ruhig angezeigt.")
+        elif command == "zufällige reihenfolge":
+            s.shuffle = True
+            print("Zufällige Reihenfolge.")
+        elif command == "normale reihenfolge":
+            s.shuffle = False
+            print("Normale Reihenfolge.")
+        elif command == "bild löschen":
+            if s.current_image:
+                if s.favorites_mode:
+                    if favorites_discard(s, s.current_image):
+                        print(f"Bild {s.current_image} aus Favoriten gelöscht.")
+                    else:
+                        print("Bild nicht in Favoriten enthalten.")
+                else:
+                    if s.current_image in images:
+                        images.remove(s.current_image)
+                        query_results.remove(s.current_image)
+                        library.hide(s.current_image)
+                        frame_cache.invalidate(s.current_image)
+                        s.library_version += 1
+                        print(f"Bild {s.current_image} gelöscht.")
+
+                keep_position(s)
+        elif command == "von vorne":
+            jump_to(s, 0)
+            print("Diashow startet von vorne.")
+        elif command == "gehe zu bild":
+            bild_nummer = number if number is not None else extract_number(original_text or "")[1]
+            if bild_nummer is not None:
+                clist = active_playlist(s)
+                if clist:
+                    if 1 <= bild_nummer <= len(clist):
+                        jump_to(s, bild_nummer - 1)
+                        print(f"Springe zu Bild {bild_nummer}.")
+                    else:
+                        print("Nummer außerhalb der Liste.")
+                else:
+                    print("Keine Bilder vorhanden.")
+            else:
+                print("Keine gültige Bildnummer erkannt.")
+        elif command == "ausschalten":
+            s.running = False
+            print("Gerät wird heruntergefahren.")
+
+# Vorgerenderte Overlays: Die Menüleiste wird pro Zustand (pause/play, Favorit ja/nein, Modus,
+# hervorgehobener Button) nur einmal gezeichnet, die Info-Legende nur einmal überhaupt.
+# Beim Anzeigen wird nur noch der betroffene Bereich im Bild überschrieben bzw. abgedunkelt.
+class OverlayCompositor:
+    INFO_RECT = (50, 50, SCREEN_WIDTH - 50, SCREEN_HEIGHT - 50)
+    INFO_ALPHA = 0.7
+
+    INFO_LINES = [
+        "Moegliche Sprachbefehle:",
+        "- stopp / pause",
+        "- weiter / play",
+        "- langsamer / schneller",
+        "- vorwaerts / zurueck",
+        "- speichern als favorit",
+        "- alle bilder anzeigen",
+        "- spiele favoriten ab",
+        "- bild loeschen",
+        "- gehe zu bild [nummer]",
+        "- zeige bilder von / bilder aus [ort, monat, jahr]",
+        "- zufaellige / normale reihenfolge",
+        "- bewegte / ruhige bilder",
+        "- ausschalten"
+    ]
+
+    def __init__(self):
+        self._menu_sprites = {}
+        self._info_text = None
+
+    def _render_menu(self, paused, is_favorite, favorites_mode, highlighted):
+        top = SCREEN_HEIGHT - MENU_HEIGHT
+        sprite = np.empty((MENU_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+        sprite[:] = (50, 50, 50)
+        icons = {
+            "langsamer": icon_atlas.get("langsamer"),
+            "zurück": icon_atlas.get("left"),
+            "pause_play": icon_atlas.get("play" if paused else "pause"),
+            "vorwärts": icon_atlas.get("right"),
+            "schneller": icon_atlas.get("schneller"),
+            "favorit": icon_atlas.get("star_true" if is_favorite else "star"),
+            "modus": icon_atlas.get("modus_fav" if favorites_mode else "modus_all"),
+            "info": icon_atlas.get("info"),
+        }
+        for btn_id, icon in icons.items():
+            if icon is not None:
+                x1, y1, x2, y2 = button_layout[btn_id]
+                sprite[y1 - top:y2 - top, x1:x2] = icon
+
+        # Highlight-Rahmen
+        if highlighted in button_layout:
+            x1, y1, x2, y2 = button_layout[highlighted]
+            cv2.rectangle(sprite, (x1, y1 - top), (x2, y2 - top), (0, 255, 255), 3)
+        return sprite
+
+    def draw_menu(self, frame, paused, is_favorite, favorites_mode, highlighted):
+        key = (paused, is_favorite, favorites_mode, highlighted)
+        sprite = self._menu_sprites.get(key)
+        if sprite is None:
+            sprite = self._render_menu(paused, is_favorite, favorites_mode, highlighted)
+            self._menu_sprites[key] = sprite
+        frame[SCREEN_HEIGHT - MENU_HEIGHT:SCREEN_HEIGHT, 0:SCREEN_WIDTH] = sprite
+
+    # Weisse Schrift auf Schwarz ab der linken oberen Ecke des Info-Rechtecks. Der Zeilenabstand
+    # (höchstens 40 Pixel) wird so gewählt, dass alle Zeilen ins Rechteck passen.
+    def _render_info_text(self):
+        x1, y1, x2, y2 = self.INFO_RECT
+        text = np.zeros((SCREEN_HEIGHT - y1, x2 - x1 + 1, 3), dtype=np.uint8)
+        x_text = 30
+        y_text = 35
+        line_height = min(40, (y2 - y1 - y_text) // max(1, len(self.INFO_LINES) - 1))
+        for line in self.INFO_LINES:
+            cv2.putText(text, ascii_fallback(line), (x_text, y_text),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+            y_text += line_height
+        return text
+
+    # Dunkelt das Info-Rechteck direkt im Bild ab und legt die Schrift darüber
+    def draw_info(self, frame):
+        if self._info_text is None:
+            self._info_text = self._render_info_text()
+        x1, y1, x2, y2 = self.INFO_RECT
+        region = frame[y1:y2 + 1, x1:x2 + 1]
+        cv2.convertScaleAbs(region, dst=region, alpha=1.0 - self.INFO_ALPHA)
+        text_region = frame[y1:SCREEN_HEIGHT, x1:x2 + 1]
+        cv2.max(text_region, self._info_text, dst=text_region)
+
+compositor = OverlayCompositor()
+
+# Overlay, bei klick auf Button "info" -> Alle Sprachbefehle werden aufgelistet
+def draw_info_overlay(frame):
+    compositor.draw_info(frame)
+    return frame
+
+# Zeichne Menu bei klick auf Bildschrim
+def draw_menu(frame, snap):
+    compositor.draw_menu(frame, snap.paused, snap.current_image in favorites,
+                         snap.favorites_mode, snap.highlighted_button)
+
+# Prüft, ob der Klick auf den Display im Bereich eines Buttons liegt. True = liegt im Bereich, False=Ausserhalb des Bereichs
+def point_in_rect(x, y, rect):
+    x1, y1, x2, y2 = rect
+    return (x1 <= x <= x2) and (y1 <= y <= y2)
+
+# Führt den Befehl des angeklickten Buttons aus
+def handle_button_click(btn_key):
+    print(btn_key + " wurde geklickt")
+
+    if btn_key == "langsamer":
+        execute_command("langsamer")
+    elif btn_key == "schneller":
+        execute_command("schneller")
+    elif btn_key == "zurück":
+        execute_command("zurück")
+    elif btn_key == "vorwärts":
+        execute_command("vorwärts")
+    elif btn_key == "pause_play":
+        if state.snapshot().paused:
+            execute_command("play")
+        else:
+            execute_command("pause")
+    elif btn_key == "favorit":
+        with state.transaction() as s:
+            if s.current_image:
+                if s.current_image in favorites:
+                    print("Bild aus Favoriten entfernen")
+                    favorites_discard(s, s.current_image)
+                    if s.favorites_mode:
+                        keep_position(s)
+                else:
+                    print("Bild zu Favoriten hinzufuegen")
+                    favorites_add(s, s.current_image)
+    elif btn_key == "modus":
+        with state.transaction() as s:
+            if s.favorites_mode:
+                switch_mode(s, False)
+                print("Wechsle zur normalen Slideshow.")
+            else:
+                if favorites:
+                    switch_mode(s, True)
+                    print("Wechsle in Favoriten-Slideshow.")
+                else:
+                    print("Keine Favoriten vorhanden!")
+    elif btn_key == "info":
+        state.update(info_visible=True, info_hide_time=time.time() + 10)
+        print("Zeige Info-Overlay (Legende)")
+
+    state.update(highlighted_button=btn_key, menu_highlight_end=time.time() + BUTTON_HIDE_DELAY)
+    print("End handle_button_click")
+
+# Funktion wird bei einer Berührung auf das Touch-Display aufgerufen
+def mouse_callback(event, x, y, flags, param):
+    if event == cv2.EVENT_LBUTTONDOWN:
+        x_corr = SCREEN_WIDTH - 1 - x
+        y_corr = SCREEN_HEIGHT - 1 - y
+
+        clicked_button = None
+        with state.transaction() as s:
+            s.menu_last_interaction = time.time()
+
+            # Falls Info-Overlay an => bei Klick ausblenden
+            if s.info_visible:
+                s.info_visible = False
+                return
+
+            if not s.menu_visible:
+                s.menu_visible = True
+                s.highlighted_button = None
+                s.menu_highlight_end = 0
+                return
+
+            # Prüfen, ob ein Button geklickt wurde
+            for key, rect in button_layout.items():
+                if point_in_rect(x_corr, y_corr, rect):
+                    clicked_button = key
+                    break
+
+            if not clicked_button:
+                # Außerhalb geklickt => Menü ausblenden
+                s.menu_visible = False
+                s.highlighted_button = None
+                s.menu_highlight_end = 0
+
+        # Ausserhalb der Transaktion, da die Buttons selbst den Zustand ändern
+        if clicked_button:
+            handle_button_click(clicked_button)
+
+# Spielt ein Video/GIF ab: Ein eigener Thread dekodiert mit cv2.VideoCapture, skaliert jedes Bild sofort auf
+# Displaygrösse und legt es in eine kurze Warteschlange. Es gibt nur VIDEO_QUEUE_FRAMES + 1 Puffer (aus dem
+# frame_pool, nach dem Schliessen wieder zurückgegeben), der Speicherbedarf hängt also nicht von der Länge ab.
+# Die Uhr läuft ab dem ersten Bild, Pause hält sie an.
+# Kommt die Dekodierung nicht nach, werden Bilder übersprungen (nur grab(), ohne Umwandeln und Skalieren).
+# Am Ende beginnt das Video von vorne; die Diashow wechselt, sobald es einmal ganz gelaufen ist.
+class VideoStream:
+    def __init__(self, path, pool=None, queue_frames=VIDEO_QUEUE_FRAMES):
+        self.path = path
+        self._pool = pool or frame_pool
+        self.size = (self._pool.shape[1], self._pool.shape[0])
+        self.fps = VIDEO_DEFAULT_FPS
+        self.clip_end = None   # Länge eines Durchlaufs in Sekunden (bekannt, sobald das Ende erreicht wurde)
+        self.shown = 0
+        self.dropped = 0
+        self._free = [self._pool.acquire() for _ in range(queue_frames + 1)]
+        self._frames = deque()   # (Zeitpunkt im Video, Puffer)
+        self._current = None
+        self._start = None
+        self._paused_at = None
+        self._cond = Condition()
+        self._stop = False
+        self._thread = Thread(target=self._decode, daemon=True)
+        self._thread.start()
+
+    # Position im Video in Sekunden (über alle Durchläufe)
+    def _position(self, now):
+        if self._start is None:
+            return 0.0
+        return (self._paused_at if self._paused_at is not None else now) - self._start
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.path)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if 1.0 <= fps <= 120.0:
+            self.fps = fps
+        interval = 1.0 / self.fps
+        loop_offset = 0.0
+        index = 0
+        scratch = None
+        try:
+            while True:
+                pts = loop_offset + index * interval
+                with self._cond:
+                    while not self._stop and not self._free:
+                        self._cond.wait()
+                    if self._stop:
+                        return
+                    late = self._position(time.time()) - pts > interval
+                    buffer = None if late else self._free.pop()
+                if late:
+                    ok = capture.grab()
+                    if ok:
+                        with self._cond:
+                            self.dropped += 1
+                else:
+                    start = time.perf_counter()
+                    ok, img = capture.read(scratch)
+                    if ok:
+                        scratch = img
+                        resize_and_center_image(img, self.size[0], self.size[1], out=buffer)
+                        metrics.observe("video_frame", time.perf_counter() - start)
+                    with self._cond:
+                        if ok:
+                            self._frames.append((pts, buffer))
+                        else:
+                            self._free.append(buffer)
+                if ok:
+                    index += 1
+                    continue
+                # Ende erreicht (oder nicht lesbar): von vorne beginnen
+                with self._cond:
+                    if self.clip_end is None:
+                        self.clip_end = loop_offset + index * interval
+                if index == 0:
+                    return
+                loop_offset += index * interval
+                index = 0
+                capture.release()
+                capture = cv2.VideoCapture(self.path)
+        finally:
+            capture.release()
+            # Erst hier zurückgeben: bis jetzt konnte dieser Thread noch in einen Puffer schreiben
+            with self._cond:
+                self._stop = True
+                buffers = self._free + [buffer for _, buffer in self._frames]
+                if self._current is not None:
+                    buffers.append(self._current)
+                self._free, self._current = [], None
+                self._frames.clear()
+            for buffer in buffers:
+                self._pool.release(buffer)
+
+    # Neuestes fälliges Bild (ältere fällige werden übersprungen) oder None, wenn kein neues fällig ist.
+    # Der Puffer gehört weiter dem VideoStream und muss sofort kopiert werden.
+    def frame(self, now):
+        with self._cond:
+            if self._stop:
+                return None
+            if self._start is None:
+                if not self._frames:
+                    return None
+                self._start = now - self._frames[0][0]
+                if self._paused_at is not None:
+                    self._paused_at = now
+            position = self._position(now)
+            latest = None
+            while self._frames and self._frames[0][0] <= position:
+                if latest is not None:
+                    self._free.append(latest)
+                    self.dropped += 1
+                latest = self._frames.popleft()[1]
+            if latest is None:
+                return None
+            if self._current is not None:
+                self._free.append(self._current)
+            self._current = latest
+            self.shown += 1
+            self._cond.notify()
+            return latest
+
+    # Zeitpunkt, zu dem das nächste Bild fällig ist
+    def next_due(self, now):
+        with self._cond:
+            if self._paused_at is not None:
+                return float("inf")
+            if self._start is None or not self._frames:
+                return now + 1.0 / self.fps   # Noch nichts dekodiert: bald wieder nachsehen
+            return self._start + self._frames[0][0]
+
+    # Zeitpunkt, zu dem der erste Durchlauf fertig ist (unendlich, solange das unbekannt ist oder pausiert)
+    def played_until(self, now):
+        with self._cond:
+            if self.clip_end == 0.0:
+                return now   # Nicht lesbar
+            if self.clip_end is None or self._start is None or self._paused_at is not None:
+                return float("inf")
+            return self._start + self.clip_end
+
+    def pause(self, now):
+        with self._cond:
+            if self._paused_at is None:
+                self._paused_at = now
+
+    def resume(self, now):
+        with self._cond:
+            if self._paused_at is not None:
+                if self._start is not None:
+                    self._start += now - self._paused_at
+                self._paused_at = None
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {"shown": self.shown, "dropped": self.dropped}
+
+# Überblendung zwischen zwei Bildern. Alle Puffer werden einmal angelegt; pro Zwischenbild wird nur
+# mit cv2.addWeighted in den Ausgabepuffer gemischt. Die Schritte liegen auf einem festen Raster
+# (TRANSITION_FPS) ab Beginn der Überblendung - kommt die Diashow nicht nach, werden Schritte
+# ausgelassen, die Überblendung dauert aber nie länger als vorgesehen.
+class TransitionEngine:
+    def __init__(self, pool=None, fps=TRANSITION_FPS):
+        pool = pool or frame_pool
+        self._outgoing = pool.acquire()
+        self._incoming = pool.acquire()
+        self.output = pool.acquire()
+        self._incoming.fill(0)
+        self.step_interval = 1.0 / fps
+        self._key = None
+        self._start = 0.0
+        self._duration = 0.0
+        self._last_step = -1
+        self.steps = 0
+        self.dropped = 0
+
+    def active(self, now):
+        return now < self._start + self._duration
+
+    def _alpha(self, now):
+        return min(1.0, max(0.0, (now - self._start) / self._duration))
+
+    # Neues Bild (key = Pfad, frame = fertiges Bild oder None für Schwarz). Beim ersten Bild und
+    # mit duration 0 wird hart geschnitten. Läuft noch eine Überblendung, wird vom aktuellen Zwischenstand aus überblendet.
+    def show(self, key, frame, duration, now):
+        if key == self._key:
+            return
+        if self.active(now):
+            alpha = self._alpha(now)
+            cv2.addWeighted(self._outgoing, 1.0 - alpha, self._incoming, alpha, 0, dst=self._outgoing)
+        else:
+            self._outgoing, self._incoming = self._incoming, self._outgoing
+        if frame is None:
+            self._incoming.fill(0)
+        else:
+            np.copyto(self._incoming, frame)
+        first = self._key is None
+        self._key = key
+        self._start = now
+        self._duration = 0.0 if first else max(0.0, duration)
+        self._last_step = -1
+
+    # Neues Bild für denselben Schlüssel (laufendes Video), eine laufende Überblendung geht weiter
+    def update(self, frame):
+        np.copyto(self._incoming, frame)
+
+    # Schreibt das Bild für den Zeitpunkt now in output (ohne Overlays) und gibt output zurück
+    def compose(self, now):
+        if self.active(now):
+            step = int((now - self._start) / self.step_interval)
+            if self._last_step >= 0 and step > self._last_step + 1:
+                self.dropped += step - self._last_step - 1
+            self._last_step = step
+            self.steps += 1
+            alpha = self._alpha(now)
+            cv2.addWeighted(self._outgoing, 1.0 - alpha, self._incoming, alpha, 0, dst=self.output)
+        else:
+            np.copyto(self.output, self._incoming)
+        return self.output
+
+    # Zeitpunkt des nächsten Zwischenbilds (bzw. des Endes der Überblendung)
+    def next_step(self, now):
+        if not self.active(now):
+            return float("inf")
+        step = int((now - self._start) / self.step_interval) + 1
+        return min(self._start + step * self.step_interval, self._start + self._duration)
+
+    def stats(self):
+        return {"steps": self.steps, "dropped": self.dropped}
+
+# Vorlage für den Ken-Burns-Effekt: Das Bild füllt das Display ganz aus (Ränder werden abgeschnitten) und ist
+# KEN_BURNS_SOURCE_SCALE-mal so gross wie das Display, damit es auch gezoomt scharf bleibt. JPEGs werden dafür
+# nur so gross wie nötig dekodiert. Einmal pro Bild, im Hintergrund.
+def load_ken_burns_source(path, screen_width, screen_height, scale=KEN_BURNS_SOURCE_SCALE):
+    target_w, target_h = int(screen_width * scale), int(screen_height * scale)
+    factor = 1
+    size = read_image_size(path) if path.lower().endswith((".jpg", ".jpeg")) else None
+    if size and size[0] > 0 and size[1] > 0:
+        # Wie choose_decode_factor, aber zum Ausfüllen (nicht Einpassen), beide Ausrichtungen
+        cover = max(target_w / size[0], target_h / size[1], target_w / size[1], target_h / size[0])
+        factor = next((f for f in (8, 4, 2) if f * cover <= 1.0), 1)
+    img = cv2.imread(path, REDUCED_DECODE_FLAGS[factor])
+    if img is None and factor != 1:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    image_h, image_w = img.shape[:2]
+    fill = max(target_w / image_w, target_h / image_h)
+    width, height = max(target_w, round(image_w * fill)), max(target_h, round(image_h * fill))
+    source = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    # Sehr lange Bilder (Panoramen) auf das Doppelte der Displayproportion begrenzen
+    max_w, max_h = target_w * 2, target_h * 2
+    x0, y0 = max(0, (width - max_w) // 2), max(0, (height - max_h) // 2)
+    return source[y0:y0 + max_h, x0:x0 + max_w]
+
+# Bewegung für ein Bild: Zoom und Bildmitte (als Anteil des möglichen Bereichs) am Anfang und am Ende.
+# Aus dem Pfad abgeleitet, damit dasselbe Bild immer gleich läuft.
+def ken_burns_motion(path, max_zoom=KEN_BURNS_ZOOM):
+    rng = random.Random(hashlib.sha1(path.encode("utf-8")).digest())
+    zooms = (1.0, max_zoom) if rng.random() < 0.5 else (max_zoom, 1.0)
+    return [(zooms[0], rng.random(), rng.random()), (zooms[1], rng.random(), rng.random())]
+
+# Zeichnet Ken-Burns-Bilder: Pro Bild wird einmal eine Vorlage vorbereitet (Thread im Hintergrund), danach ist jedes
+# Bild nur ein Ausschnitt (ohne Kopie) + ein cv2.warpAffine in einen festen Puffer. Wird die Zeit pro Bild zu knapp,
+# sinkt die Bildrate (bis KEN_BURNS_MIN_FPS), bei genug Reserve steigt sie wieder bis KEN_BURNS_FPS.
+class KenBurnsEngine:
+    PREPARE_AHEAD = 2   # Aktuelles und nächstes Bild
+
+    def __init__(self, pool=None, fps=KEN_BURNS_FPS, min_fps=KEN_BURNS_MIN_FPS):
+        pool = pool or frame_pool
+        self.output = pool.acquire()
+        self.size = (pool.shape[1], pool.shape[0])
+        self.target_fps = fps
+        self.min_fps = min_fps
+        self.fps = fps
+        self.frame_time = None   # Gleitender Mittelwert der ganzen Ausgabe (Zeichnen bis Anzeige), Sekunden
+        self.rendered = 0
+        self.slowdowns = 0
+        self._sources = OrderedDict()   # Pfad -> Future mit der Vorlage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kenburns")
+        self._path = None
+        self._waiting = False
+        self._motion = None
+        self._start = 0.0
+        self._paused_at = None
+        self._last_render = 0.0
+
+    # Vorlagen für diese Pfade vorbereiten, alle anderen verwerfen
+    def retarget(self, paths):
+        wanted = [path for path in paths if path and not is_video(path)][:self.PREPARE_AHEAD]
+        for path in list(self._sources):
+            if path not in wanted:
+                self._sources.pop(path).cancel()
+        for path in wanted:
+            if path not in self._sources:
+                self._sources[path] = self._executor.submit(load_ken_burns_source, path, *self.size)
+
+    def _source(self, path):
+        future = self._sources.get(path)
+        if future is None or not future.done() or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Ken-Burns-Vorlage für {path} fehlgeschlagen: {e}")
+            self._sources[path] = None   # Nicht erneut versuchen, solange das Bild vorbereitet bleibt
+            return None
+
+    # Bild zum Zeitpunkt now (Bewegung über duration Sekunden) oder None, solange die Vorlage fehlt
+    def frame(self, path, duration, paused, now):
+        source = self._source(path)
+        self._waiting = source is None and self._sources.get(path) is not None
+        if source is None:
+            return None
+        if path != self._path:
+            self._path = path
+            self._motion = ken_burns_motion(path)
+            self._start = now
+            self._paused_at = None
+        if paused and self._paused_at is None:
+            self._paused_at = now
+        elif not paused and self._paused_at is not None:
+            self._start += now - self._paused_at
+            self._paused_at = None
+        elapsed = (self._paused_at if self._paused_at is not None else now) - self._start
+        progress = min(1.0, max(0.0, elapsed / duration)) if duration > 0 else 1.0
+        self._render(source, progress)
+        self._last_render = now
+        self.rendered += 1
+        return self.output
+
+    def _render(self, source, progress):
+        out_w, out_h = self.size
+        source_h, source_w = source.shape[:2]
+        eased = progress * progress * (3.0 - 2.0 * progress)   # Sanft anfahren und abbremsen
+        (zoom0, fx0, fy0), (zoom1, fx1, fy1) = self._motion
+        zoom = zoom0 + (zoom1 - zoom0) * eased
+        fx = fx0 + (fx1 - fx0) * eased
+        fy = fy0 + (fy1 - fy0) * eased
+
+        # Sichtbarer Ausschnitt der Vorlage (Displayproportion), liegt immer ganz innerhalb der Vorlage
+        window = min(source_w / out_w, source_h / out_h) / zoom
+        view_w, view_h = out_w * window, out_h * window
+        x = fx * (source_w - view_w)
+        y = fy * (source_h - view_h)
+
+        # Nur den benötigten Bereich übergeben (Sicht auf die Vorlage, keine Kopie)
+        x0, y0 = int(x), int(y)
+        x1, y1 = min(source_w, int(np.ceil(x + view_w)) + 1), min(source_h, int(np.ceil(y + view_h)) + 1)
+        matrix = np.array([[window, 0.0, x - x0], [0.0, window, y - y0]], dtype=np.float32)
+        cv2.warpAffine(source[y0:y1, x0:x1], matrix, (out_w, out_h), dst=self.output,
+                       flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+
+    # Dauer der ganzen Ausgabe eines Bildes (Zeichnen, Overlays, Anzeige) -> Bildrate anpassen
+    def frame_done(self, seconds):
+        self.frame_time = seconds if self.frame_time is None else 0.8 * self.frame_time + 0.2 * seconds
+        interval = 1.0 / self.fps
+        if self.frame_time > 0.9 * interval and self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * 0.8)
+            self.slowdowns += 1
+        elif self.frame_time < 0.5 * interval and self.fps < self.target_fps:
+            self.fps = min(self.target_fps, self.fps * 1.1)
+
+    # Zeitpunkt des nächsten Bildes (unendlich bei Pause oder ohne Ken-Burns-Bild)
+    def next_frame(self, now):
+        if self._waiting:
+            return now + 0.05   # Vorlage wird noch vorbereitet
+        if self._path is None or self._paused_at is not None:
+            return float("inf")
+        return self._last_render + 1.0 / self.fps
+
+    def stop(self):
+        self._path = None
+        self._waiting = False
+
+    def shutdown(self):
+        for future in self._sources.values():
+            if future is not None:
+                future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {"rendered": self.rendered, "fps": round(self.fps, 1), "slowdowns": self.slowdowns,
+                "frame_ms": round((self.frame_time or 0.0) * 1000, 2)}
+
+# Merkt sich, ob sich seit dem letzten Zeichnen etwas geändert hat (neues Bild, Menü, Overlay, Rahmen).
+# Alle Stellen, die den angezeigten Zustand ändern, rufen mark_dirty() auf.
+class RenderScheduler:
+    def __init__(self):
+        self._dirty = Event()
+        self._dirty.set()
+
+    def mark_dirty(self):
+        self._dirty.set()
+
+    # True, falls neu gezeichnet werden muss. Setzt das Flag zurück.
+    def consume(self):
+        if self._dirty.is_set():
+            self._dirty.clear()
+            return True
+        return False
+
+render_scheduler = RenderScheduler()
+
+# Nächster Zeitpunkt, an dem sich die Anzeige von selbst ändert
+# playing_until: Ende des ersten Durchlaufs eines laufenden Videos (vorher wird nicht weitergeschaltet)
+def next_render_deadline(snap, now, playing_until=0.0):
+    deadlines = []
+    current_list = active_playlist(snap)
+    if not snap.paused and current_list:
+        deadlines.append(max(snap.last_image_update_time + snap.current_speed, playing_until))
+    if snap.menu_visible:
+        if snap.menu_highlight_end > 0:
+            deadlines.append(snap.menu_highlight_end)
+        else:
+            deadlines.append(snap.menu_last_interaction + MENU_HIDE_DELAY)
+    if snap.info_visible:
+        deadlines.append(snap.info_hide_time)
+    for until in (snap.command_fail_until, snap.command_success_until, snap.hotword_feedback_until):
+        if until > now:
+            deadlines.append(until)
+    return min(deadlines) if deadlines else float("inf")
+
+# Anzeige über ein OpenCV-Vollbildfenster. Touch-Events kommen als Mausklicks während wait().
+# Andere Anzeigen (z.B. ohne Bildschirm für Messungen) bieten dieselben Methoden an.
+class OpenCVDisplay:
+    def __init__(self, window_name="Digitaler Bilderrahmen"):
+        self.window_name = window_name
+
+    def open(self, on_click):
+        os.system('unclutter -idle 0.1 -root &')
+        cv2.namedWindow(self.window_name, cv2.WND_PROP_FULLSCREEN)
+        cv2.setWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+        cv2.setMouseCallback(self.window_name, on_click)
+
+    def show(self, frame):
+        cv2.imshow(self.window_name, frame)
+
+    # Wartet bis zu delay_ms und verarbeitet dabei Events. Gibt die gedrückte Taste oder -1 zurück.
+    def wait(self, delay_ms):
+        return cv2.waitKey(delay_ms)
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+# Linux-Eingabeereignisse (linux/input-event-codes.h)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+BTN_TOUCH = 0x14a
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+INPUT_EVENT = struct.Struct("llHHi")   # struct input_event: timeval, type, code, value
+
+# Sucht in /proc/bus/input/devices das erste Gerät mit absoluten Achsen und BTN_TOUCH
+def find_touch_device():
+    try:
+        with open("/proc/bus/input/devices", "r") as f:
+            blocks = f.read().split("\n\n")
+    except OSError:
+        return None
+    long_bits = struct.calcsize("l") * 8
+    for block in blocks:
+        handler = re.search(r"^H: Handlers=.*?\b(event\d+)", block, re.M)
+        keys = re.search(r"^B: KEY=(.*)$", block, re.M)
+        if not handler or not keys or not re.search(r"^B: ABS=", block, re.M):
+            continue
+        # Bitmaske als Hex-Wörter, das höchstwertige zuerst
+        words = [int(word, 16) for word in reversed(keys.group(1).split())]
+        index, bit = divmod(BTN_TOUCH, long_bits)
+        if index < len(words) and words[index] >> bit & 1:
+            return os.path.join("/dev/input", handler.group(1))
+    return None
+
+# Liest Touch-Ereignisse (evdev) in einem eigenen Thread. Jede neue Berührung wird als (u, v) im Bereich 0..1
+# abgelegt und erst in dispatch() (also im Diashow-Thread, wie bei cv2.waitKey) weitergegeben.
+class TouchInput:
+    def __init__(self, device):
+        self.device = device
+        self.ranges = {ABS_X: (0, 4095), ABS_Y: (0, 4095)}   # Falls das Gerät keine Achsenbereiche liefert
+        self._touches = deque()
+        self._ready = Event()
+        self._stop = Event()
+        self._fd = None
+
+    def start(self):
+        self._fd = os.open(self.device, os.O_RDONLY)
+        for axis in (ABS_X, ABS_Y):
+            axis_range = self._axis_range(axis)
+            if axis_range is not None:
+                self.ranges[axis] = axis_range
+        Thread(target=self._reader, daemon=True).start()
+
+    # EVIOCGABS(axis): struct input_absinfo (value, minimum, maximum, fuzz, flat, resolution)
+    def _axis_range(self, axis):
+        import fcntl
+        info = bytearray(24)
+        request = (2 << 30) | (len(info) << 16) | (ord("E") << 8) | (0x40 + axis)
+        try:
+            fcntl.ioctl(self._fd, request, info)
+        except OSError:
+            return None   # Kein Eingabegerät (z.B. normale Datei zum Testen)
+        _, minimum, maximum = struct.unpack("6i", info)[:3]
+        return (minimum, maximum) if maximum > minimum else None
+
+    # Das Gerät wird erst hier geschlossen, damit select/read nie auf einem geschlossenen Deskriptor laufen
+    def _reader(self):
+        try:
+            self._read_events()
+        finally:
+            os.close(self._fd)
+
+    def _read_events(self):
+        x = y = None
+        pressed = False
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, INPUT_EVENT.size * 64)
+            except OSError as e:
+                print(f"Touch-Gerät {self.device} nicht mehr lesbar: {e}")
+                break
+            if not data:
+                time.sleep(0.05)   # Normale Datei: Ende erreicht, auf angehängte Ereignisse warten
+                continue
+            data = data[:len(data) - len(data) % INPUT_EVENT.size]
+            for _, _, ev_type, code, value in INPUT_EVENT.iter_unpack(data):
+                if ev_type == EV_ABS and code in (ABS_X, ABS_MT_POSITION_X):
+                    x = value
+                elif ev_type == EV_ABS and code in (ABS_Y, ABS_MT_POSITION_Y):
+                    y = value
+                elif ev_type == EV_KEY and code == BTN_TOUCH and value == 1:
+                    pressed = True
+                elif ev_type == EV_SYN and pressed and x is not None and y is not None:
+                    # Position erst beim SYN übernehmen, da X/Y nach BTN_TOUCH im selben Paket kommen können
+                    pressed = False
+                    (x_min, x_max), (y_min, y_max) = self.ranges[ABS_X], self.ranges[ABS_Y]
+                    self._touches.append(((x - x_min) / (x_max - x_min), (y - y_min) / (y_max - y_min)))
+                    self._ready.set()
+
+    # Wartet bis zu timeout Sekunden auf Berührungen und gibt alle seither eingegangenen zurück
+    def poll(self, timeout):
+        self._ready.wait(timeout)
+        self._ready.clear()
+        touches = []
+        while self._touches:
+            touches.append(self._touches.popleft())
+        return touches
+
+    def close(self):
+        self._stop.set()
+
+# Schreibt die fertigen Bilder direkt in den Framebuffer (per mmap, ohne X und HighGUI). Gedreht wird in einen
+# wiederverwendeten Puffer, die Umwandlung ins Pixelformat (RGB565, 24 oder 32 Bit) schreibt direkt in den Framebuffer.
+# Für Tests kann statt /dev/fb0 eine normale Datei verwendet werden (Grösse und Format dann als Parameter).
+class FramebufferDisplay:
+    def __init__(self, device=FRAMEBUFFER_DEVICE, rotation=FRAMEBUFFER_ROTATION, touch_device=TOUCH_DEVICE,
+                 width=None, height=None, bits_per_pixel=None, stride=None):
+        if rotation not in (0, 90, 180, 270):
+            raise ValueError(f"Ungültige Drehung: {rotation}")
+        self.device = device
+        self.rotation = rotation
+        self.touch_device = touch_device
+        self.width = width
+        self.height = height
+        self.bits_per_pixel = bits_per_pixel
+        self.stride = stride
+        self.touch = None
+        self._on_click = None
+        self._fb = None
+
+    # Sichtbare Grösse, Bits pro Pixel und Zeilenlänge aus /sys/class/graphics/fbN
+    def _geometry(self):
+        sysfs = os.path.join("/sys/class/graphics", os.path.basename(self.device))
+
+        def read(name):
+            try:
+                with open(os.path.join(sysfs, name), "r") as f:
+                    return f.read().strip()
+            except OSError:
+                return None
+
+        width, height = self.width, self.height
+        if width is None or height is None:
+            mode = re.search(r"(\d+)x(\d+)", read("modes") or read("virtual_size") or "")
+            if mode:
+                width, height = int(mode.group(1)), int(mode.group(2))
+            elif self.rotation in (90, 270):
+                width, height = SCREEN_HEIGHT, SCREEN_WIDTH
+            else:
+                width, height = SCREEN_WIDTH, SCREEN_HEIGHT
+        bits_per_pixel = self.bits_per_pixel or int(read("bits_per_pixel") or 32)
+        stride = self.stride or int(read("stride") or width * bits_per_pixel // 8)
+        return width, height, bits_per_pixel, stride
+
+    def open(self, on_click):
+        self._on_click = on_click
+        width, height, bits_per_pixel, stride = self._geometry()
+        if bits_per_pixel not in (16, 24, 32):
+            raise ValueError(f"Framebuffer-Format mit {bits_per_pixel} Bit pro Pixel wird nicht unterstützt")
+        if os.path.isfile(self.device) and os.path.getsize(self.device) < stride * height:
+            with open(self.device, "ab") as f:
+                f.truncate(stride * height)
+        self._fb = np.memmap(self.device, dtype=np.uint8, mode="r+", shape=(height, stride))
+        self._fb[:] = 0
+
+        # Gedrehtes Bild zentriert im Framebuffer (abgeschnitten, falls der Framebuffer kleiner ist)
+        self._rotate = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180,
+                        270: cv2.ROTATE_90_COUNTERCLOCKWISE}.get(self.rotation)
+        frame_h, frame_w = (SCREEN_WIDTH, SCREEN_HEIGHT) if self.rotation in (90, 270) else (SCREEN_HEIGHT, SCREEN_WIDTH)
+        self._size = (min(frame_w, width), min(frame_h, height))
+        self._offset = ((width - self._size[0]) // 2 if width > frame_w else 0,
+                        (height - self._size[1]) // 2 if height > frame_h else 0)
+        self._crop = ((frame_w - self._size[0]) // 2, (frame_h - self._size[1]) // 2)
+        self._fb_size = (width, height)
+        self._frame_size = (frame_w, frame_h)
+        pixel_bytes = bits_per_pixel // 8
+        (x0, y0), (w, h) = self._offset, self._size
+        self._target = self._fb[y0:y0 + h, x0 * pixel_bytes:(x0 + w) * pixel_bytes].reshape(h, w, pixel_bytes)
+        self._conversion = {2: cv2.COLOR_BGR2BGR565, 4: cv2.COLOR_BGR2BGRA}.get(pixel_bytes)
+        self._rotated = np.empty((frame_h, frame_w, 3), dtype=np.uint8) if self._rotate is not None else None
+
+        device = self.touch_device or find_touch_device()
+        if device is None:
+            print("Kein Touch-Gerät gefunden, Bedienung nur per Sprache.")
+        else:
+            self.touch = TouchInput(device)
+            try:
+                self.touch.start()
+            except OSError as e:
+                print(f"Touch-Gerät {device} konnte nicht geöffnet werden: {e}")
+                self.touch = None
+
+    def show(self, frame):
+        (cx, cy), (w, h) = self._crop, self._size
+        if self._rotate is not None:
+            frame = cv2.rotate(frame, self._rotate, dst=self._rotated)
+        frame = frame[cy:cy + h, cx:cx + w]
+        if self._conversion is not None:
+            cv2.cvtColor(frame, self._conversion, dst=self._target)   # schreibt direkt in den Framebuffer
+        else:
+            self._target[:] = frame
+
+    # Berührung im Framebuffer (u, v im Bereich 0..1) -> Koordinaten im Bild, wie sie cv2 liefern würde.
+    # Die 180°-Korrektur des Displays macht weiterhin mouse_callback.
+    def _touch_to_frame(self, u, v):
+        (fb_w, fb_h), (frame_w, frame_h) = self._fb_size, self._frame_size
+        (x0, y0), (cx, cy) = self._offset, self._crop
+        px = round(u * (fb_w - 1)) - x0 + cx   # Position im gedrehten Bild
+        py = round(v * (fb_h - 1)) - y0 + cy
+        if not (0 <= px < frame_w and 0 <= py < frame_h):
+            return None
+        if self.rotation == 90:
+            return py, SCREEN_HEIGHT - 1 - px
+        if self.rotation == 180:
+            return SCREEN_WIDTH - 1 - px, SCREEN_HEIGHT - 1 - py
+        if self.rotation == 270:
+            return SCREEN_WIDTH - 1 - py, px
+        return px, py
+
+    def wait(self, delay_ms):
+        if self.touch is None:
+            time.sleep(delay_ms / 1000.0)
+            return -1
+        for u, v in self.touch.poll(delay_ms / 1000.0):
+            point = self._touch_to_frame(u, v)
+            if point is not None:
+                self._on_click(cv2.EVENT_LBUTTONDOWN, point[0], point[1], 0, None)
+        return -1
+
+    def close(self):
+        if self.touch is not None:
+            self.touch.close()
+        if self._fb is not None:
+            self._fb.flush()
+            self._target = self._fb = self._rotated = None
+
+def create_display():
+    if DISPLAY_BACKEND == "framebuffer":
+        if os.path.exists(FRAMEBUFFER_DEVICE):
+            return FramebufferDisplay()
+        print(f"{FRAMEBUFFER_DEVICE} nicht gefunden, verwende das OpenCV-Fenster.")
+    return OpenCVDisplay()
+
+display = create_display()
+
+# Thread für die Diashow
+def slideshow_thread():
+    with startup_phase("Anzeige"):
+        display.open(mouse_callback)
+
+    transitions = TransitionEngine()
+    ken_burns = KenBurnsEngine()
+    video = None   # VideoStream, falls der aktuelle Eintrag ein Video/GIF ist
+    video_totals = {"clips": 0, "shown": 0, "dropped": 0}
+    next_deadline = 0.0
+    try:
+        while True:
+            # Kurze Transaktion: Bildwechsel und Timeouts, danach wird nur noch der Snapshot gelesen
+            with state.transaction() as s:
+                if not s.running:
+                    break
+
+                now = time.time()
+                current_list = active_playlist(s)
+
+                # Videos laufen mindestens einmal ganz durch, kurze Clips (GIFs) wiederholen sich bis zum Wechsel
+                clip_playing = video is not None and video.path == s.current_image and video.played_until(now) > now
+                if not s.paused and (now - s.last_image_update_time >= s.current_speed) and not clip_playing:
+                    if current_list:
+                        step(s, 1)
+                        s.last_image_update_time = now
+                    else:
+                        s.current_image = None
+
+                # Menü ausblenden nach Highlight/Timeout?
+                if s.menu_highlight_end > 0 and now >= s.menu_highlight_end:
+                    s.menu_visible = False
+                    s.highlighted_button = None
+                    s.menu_highlight_end = 0
+                elif s.menu_highlight_end == 0 and s.menu_visible:
+                    if now - s.menu_last_interaction >= MENU_HIDE_DELAY:
+                        s.menu_visible = False
+                        s.highlighted_button = None
+
+                # Info-Overlay abgelaufen?
+                if s.info_visible and now >= s.info_hide_time:
+                    s.info_visible = False
+
+                if s.shuffle and current_list:
+                    upcoming = [s.current_image] + shuffle_order.upcoming(current_list, s.current_image, PREFETCH_AHEAD)
+                else:
+                    upcoming = neighbour_paths(current_list, s.current_index)
+
+            # Neu zeichnen nur bei Zustandsänderung oder wenn ein Zeitpunkt (Bildwechsel, Timeout) erreicht ist
+            if render_scheduler.consume() or now >= next_deadline:
+                snap = state.snapshot()
+                frame_pool.begin_frame()
+
+                # Bild laden/zentrieren - ohne Lock, damit Touch und Sprache nicht blockiert werden
+                prefetcher.retarget(upcoming)
+                ken_burns.retarget(upcoming[:2] if snap.ken_burns else [])
+                render_start = time.perf_counter()
+                now = time.time()
+                cached = None
+                if snap.current_image:
+                    cached = prefetcher.get(snap.current_image)
+                    if cached is None:
+                        print(f"Fehler: Bild {snap.current_image} konnte nicht geladen werden.")
+
+                # Video zum aktuellen Eintrag starten bzw. beenden, Pause gilt auch für das Video
+                if video is not None and video.path != snap.current_image:
+                    video.close()
+                    for key, value in video.stats().items():
+                        video_totals[key] += value
+                    video = None
+                if video is None and is_video(snap.current_image):
+                    video = VideoStream(snap.current_image)
+                    video_totals["clips"] += 1
+                if video is not None:
+                    if snap.paused:
+                        video.pause(now)
+                    else:
+                        video.resume(now)
+
+                moving = None
+                if snap.ken_burns and video is None and snap.current_image:
+                    with metrics.span("kenburns"):
+                        moving = ken_burns.frame(snap.current_image, snap.current_speed + snap.transition_duration,
+                                                 snap.paused, now)
+                else:
+                    ken_burns.stop()
+
+                with metrics.span("compose"):
+                    transitions.show(snap.current_image, moving if moving is not None else cached,
+                                     snap.transition_duration, now)
+                    if cached is not None:
+                        frame_pool.release(cached)   # show() hat das Bild kopiert
+                    if video is not None:
+                        live = video.frame(now)
+                        if live is not None:
+                            transitions.update(live)
+                    elif moving is not None:
+                        transitions.update(moving)
+
+                    # Menü und Rahmen werden direkt in den Ausgabepuffer gezeichnet (keine Kopie pro Bild)
+                    frame = transitions.compose(now)
+
+                    # Menü einzeichnen?
+                    if snap.menu_visible:
+                        draw_menu(frame, snap)
+
+                    # Info-Overlay?
+                    if snap.info_visible:
+                        frame = draw_info_overlay(frame)
+
+                    # Rahmen-Logik
+                    if now < snap.command_fail_until:
+                        # Roter Rand = Befehl nicht erkannt
+                        cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (0,0,255), 10)
+                    elif now < snap.command_success_until:
+                        # Grüner Rand = Befehlt erkannt
+                        cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (0,255,0), 10)
+                    elif now < snap.hotword_feedback_until:
+                        # Blauer Rand = Erkennungswort erkannt -> Jetzt Befehl sprechen
+                        cv2.rectangle(frame, (0,0), (SCREEN_WIDTH-1, SCREEN_HEIGHT-1), (255,0,0), 10)
+
+                if video is not None:
+                    next_deadline = min(next_render_deadline(snap, now, video.played_until(now)),
+                                        transitions.next_step(now), video.next_due(now))
+                else:
+                    next_deadline = min(next_render_deadline(snap, now), transitions.next_step(now),
+                                        ken_burns.next_frame(now))
+
+                with metrics.span("imshow"):
+                    display.show(frame)
+                if moving is not None:
+                    ken_burns.frame_done(time.perf_counter() - render_start)
+                frame_pool.end_frame()
+                if not first_frame_shown.is_set():
+                    first_frame_shown.set()
+                    print(f"Erstes Bild nach {(time.perf_counter() - STARTUP_TIME) * 1000:.0f} ms angezeigt.")
+
+            # Bis zum nächsten bekannten Zeitpunkt warten, Touch-Events aber spätestens alle RENDER_POLL_INTERVAL abholen
+            wait = min(next_deadline - time.time(), RENDER_POLL_INTERVAL)
+            with metrics.span("waitkey"):
+                key = display.wait(max(1, int(wait * 1000)))
+            if key == ord('q'):
+                state.update(running=False)
+
+    finally:
+        if video is not None:
+            video.close()
+            for key, value in video.stats().items():
+                video_totals[key] += value
+        display.close()
+        prefetcher.shutdown()
+        ken_burns.shutdown()
+        if video_totals["clips"]:
+            print(f"Videos: {video_totals}")
+        if ken_burns.rendered:
+            print(f"Ken Burns: {ken_burns.stats()}")
+        print(f"Bild-Cache: {frame_cache.stats()}")
+        print(f"Überblendung: {transitions.stats()}")
+        print(f"Bildpuffer: {frame_pool.stats()}")
+        print(f"Lock '{state.lock.name}': {state.lock.stats()}")
+        if metrics.enabled:
+            print(f"Messwerte: {metrics.summary()}")
+
+#Thread für die Spracherkennung/Sprachsteuerung
+def voice_control_thread():
+    # Erst das erste Bild anzeigen, dann die Spracherkennung vorbereiten
+    first_frame_shown.wait(10.0)
+    with startup_phase("Spracherkennung"):
+        backend = create_recognizer_backend()
+        spotter = TemplateHotwordSpotter.from_folder(hotword_folder)
+        command_matcher.prepare()
+    if spotter.templates:
+        print(f"{len(spotter.templates)} Hotword-Vorlagen geladen, Erkennungswort wird lokal erkannt.")
+    else:
+        print(f"Keine Hotword-Vorlagen in {hotword_folder}, Erkennungswort wird per {backend.name} geprüft.")
+
+    with startup_phase("Mikrofon"):
+        capture = AudioCapture()
+        capture.start()
+        while state.snapshot().running and not capture.ready.wait(1.0):
+            pass
+
+    listener = None
+    while state.snapshot().running:
+        try:
+            # Neu aufsetzen, falls die Aufnahme mit einer anderen Abtastrate neu geöffnet wurde
+            if listener is None or listener.rate != capture.rate:
+                listener = VoiceListener(capture.source(), spotter, backend)
+                print("Warte auf das Erkennungswort...")
+            heard, match = listen_for_command(listener)
+            if heard:
+                if match is None:
+                    print("Erkennungswort erkannt, warte auf Folgekommando...")
+                    match = listen_for_following_command(listener)
+
+                if match and match.command:
+                    state.update(command_success_until=time.time() + 1.0)
+                    execute_command(match.command, match.text, match.number, match.argument)
+                else:
+                    state.update(command_fail_until=time.time() + 1.0)
+
+        except Exception as e:
+            print(f"Fehler im Sprachsteuerungsthread: {e}")
+            time.sleep(1.0)
+
+# Dateiendung anhand der ersten Bytes (nur JPEG und PNG), sonst None
+def upload_extension(data):
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    return None
+
+# Läuft in einem eigenen Prozess: prüft und speichert ein hochgeladenes Foto und legt die skalierte
+# Version im Bild-Cache ab. Gibt (Pfad, neu) zurück, ValueError bei ungültigen Bildern (auch bei cv2-Fehlern).
+def ingest_upload(data, folder, cache_folder, screen_width, screen_height):
+    ext = upload_extension(data)
+    if ext is None:
+        raise ValueError("Nur JPEG und PNG werden unterstützt")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, hashlib.sha1(data).hexdigest()[:20] + ext)
+    if os.path.exists(path):
+        return path, False
+
+    # Temporäre Datei mit Punkt am Anfang, damit der Bildordner-Durchlauf sie ignoriert
+    tmp = os.path.join(folder, "." + os.path.basename(path) + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    try:
+        size = read_image_size(tmp)
+        if size is None or size[0] < 16 or size[1] < 16:
+            raise ValueError("Bildgrösse nicht lesbar oder zu klein")
+        if size[0] * size[1] > UPLOAD_MAX_PIXELS:
+            raise ValueError(f"Bild zu gross ({size[0]}x{size[1]})")
+        try:
+            img = load_display_image(tmp, screen_width, screen_height)
+            frame = resize_and_center_image(img, screen_width, screen_height) if img is not None else None
+        except cv2.error as e:
+            raise ValueError(f"Bild konnte nicht dekodiert werden: {e}") from e
+        if frame is None:
+            raise ValueError("Bild konnte nicht dekodiert werden")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    RenditionCache(cache_folder).store(path, screen_width, screen_height, frame)
+    return path, True
+
+# Neues Bild (hochgeladen oder von einem anderen Rahmen übernommen) in Bibliothek und Diashow aufnehmen
+def add_uploaded_image(path):
+    library.add_file(path)
+    if SYNC_ENABLED:
+        sync.add_file(path)
+    with state.transaction() as s:
+        if images.append(path):
+            s.library_version += 1
+            if s.current_image is None and not s.favorites_mode:
+                jump_to(s, 0)
+
+# Aktueller Zustand als JSON-fähiges Dictionary (für HTTP und WebSocket)
+def state_payload():
+    snap = state.snapshot()
+    data = asdict(snap)
+    data["count"] = len(active_playlist(snap))
+    data["images"] = len(images)
+    data["favorites"] = len(favorites)
+    data["is_favorite"] = snap.current_image in favorites
+    return data
+
+# Gibt (Befehl, Originaltext, Zahl, Text-Argument) für eine Anfrage {"command": ..., "number": ..., "argument": ...}
+# oder {"text": ...} zurück
+def parse_api_command(request_data):
+    command = request_data.get("command")
+    text = request_data.get("text") or command or ""
+    number = request_data.get("number")
+    argument = request_data.get("argument")
+    if command not in known_commands:
+        match = command_matcher.match([text])
+        command = match.command
+        number = number if number is not None else match.number
+        argument = argument or match.argument
+    return command, text, number, argument
+
+# Lokaler Server (asyncio/aiohttp) in einem eigenen Thread:
+#   GET  /api/state      aktueller Zustand
+#   GET  /api/commands   bekannte Befehle
+#   POST /api/command    {"command": "vorwärts"}, {"command": "bilder aus", "argument": "italien"}
+#                        oder {"text": "gehe zu bild zwölf"}
+#   POST /api/upload     Foto (Rohdaten oder multipart/form-data), nur mit Token
+#   GET  /ws             WebSocket: Zustand bei jeder Änderung, Befehle wie bei /api/command
+# Uploads werden in einem Prozess-Pool mit niedriger Priorität verarbeitet, nie im Diashow-Thread.
+class ControlServer:
+    def __init__(self, host=API_HOST, port=API_PORT, token=API_TOKEN):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.upload_folder = os.path.normpath(os.path.join(image_folder, UPLOAD_FOLDER))
+        self._clients = set()
+        self._loop = None
+        self._changed = None
+        self._upload_slots = None
+        self._pool = None
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except ImportError:
+            print("aiohttp nicht installiert, Netzwerk-Steuerung deaktiviert (pip install aiohttp).")
+        except OSError as e:
+            print(f"Netzwerk-Steuerung konnte nicht gestartet werden: {e}")
+
+    async def _serve(self):
+        from aiohttp import web
+        self._web = web
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._upload_slots = asyncio.Semaphore(UPLOAD_QUEUE)
+
+        app = web.Application(client_max_size=UPLOAD_MAX_BYTES)
+        app.add_routes([
+            web.get("/api/state", self._handle_state),
+            web.get("/api/commands", self._handle_commands),
+            web.post("/api/command", self._handle_command),
+            web.get("/ws", self._handle_websocket),
+        ])
+        # Ohne Token könnte jeder im Netz Dateien auf die SD-Karte schreiben
+        if self.token:
+            app.router.add_post("/api/upload", self._handle_upload)
+        else:
+            print("Hochladen deaktiviert: API_TOKEN ist nicht gesetzt.")
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        print(f"Netzwerk-Steuerung unter http://{self.host}:{self.port}/")
+
+        state.subscribe(self._on_state_change)
+        broadcaster = asyncio.create_task(self._broadcast())
+        try:
+            while state.snapshot().running:
+                await asyncio.sleep(1.0)
+        finally:
+            state.unsubscribe(self._on_state_change)
+            broadcaster.cancel()
+            for ws in list(self._clients):
+                await ws.close()
+            await runner.cleanup()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # Aus beliebigem Thread: nur ein Flag setzen, gesendet wird im Event-Loop
+    def _on_state_change(self, snapshot):
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            pass
+
+    # Sendet den Zustand an alle WebSocket-Clients, höchstens 10x pro Sekunde
+    async def _broadcast(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            payload = json.dumps(state_payload())
+            for ws in list(self._clients):
+                try:
+                    await ws.send_str(payload)
+                except (ConnectionError, RuntimeError):
+                    self._clients.discard(ws)
+            await asyncio.sleep(0.1)
+
+    def _authorized(self, request):
+        return self.token is None or hmac.compare_digest(request.headers.get("Authorization", ""),
+                                                         f"Bearer {self.token}")
+
+    def _error(self, status, message, **headers):
+        return self._web.json_response({"error": message}, status=status, headers=headers or None)
+
+    async def _handle_state(self, request):
+        if not self._authorized(request):
+            return self._error(401, "Nicht berechtigt")
+        return self._web.json_response(state_payload())
+
+    async def _handle_commands(self, request):
+        if not self._authorized(request):
+            return self._error(401, "Nicht berechtigt")
+        return self._web.json_response({"commands": known_commands})
+
+    # Führt einen Befehl aus (im Thread-Pool, da execute_command kurz den state.lock hält)
+    async def _run_command(self, request_data):
+        command, text, number, argument = parse_api_command(request_data)
+        if command is None:
+            return None
+        await self._loop.run_in_executor(None, execute_command, command, text, number, argument)
+        return command
+
+    async def _handle_command(self, request):
+        if not self._authorized(request):
+            return self._error(401, "Nicht berechtigt")
+        try:
+            request_data = await request.json()
+        except ValueError:
+            return self._error(400, "Ungültiges JSON")
+        if not isinstance(request_data, dict) or await self._run_command(request_data) is None:
+            return self._error(400, "Unbekannter Befehl")
+        return self._web.json_response(state_payload())
+
+    def _upload_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=os.nice, initargs=(10,))
+        return self._pool
+
+    # Liest das Foto (Rohdaten oder erster Teil eines Formulars) stückweise. None, falls es grösser als
+    # UPLOAD_MAX_BYTES ist - client_max_size gilt nicht für Formularteile.
+    async def _read_upload(self, request):
+        if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+            return None
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            part = await reader.next()
+            read_chunk = getattr(part, "read_chunk", None)   # Verschachtelte Formulare werden nicht unterstützt
+            if read_chunk is None:
+                return b""
+        else:
+            read_chunk = request.content.read
+        chunks, size = [], 0
+        while True:
+            chunk = await read_chunk(256 * 1024)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                return None
+            chunks.append(chunk)
+
+    async def _handle_upload(self, request):
+        if not self._authorized(request):
+            return self._error(401, "Nicht berechtigt")
+        # Voll -> sofort ablehnen statt Anfragen (und Speicher) aufzustauen
+        if self._upload_slots.locked():
+            return self._error(503, "Zu viele Uploads, bitte später erneut versuchen", **{"Retry-After": "5"})
+        async with self._upload_slots:
+            data = await self._read_upload(request)
+            if data is None:
+                return self._error(413, f"Foto grösser als {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+            if upload_extension(data) is None:
+                return self._error(415, "Nur JPEG und PNG werden unterstützt")
+            pool = self._upload_pool()
+            try:
+                path, new = await self._loop.run_in_executor(
+                    pool, ingest_upload, data, self.upload_folder,
+                    rendition_cache.folder, SCREEN_WIDTH, SCREEN_HEIGHT)
+            except ValueError as e:
+                return self._error(422, str(e))
+            except BrokenProcessPool:
+                # Prozess beim Dekodieren abgestürzt (z.B. kein Speicher mehr): Pool für den nächsten Upload neu starten
+                if self._pool is pool:
+                    self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                return self._error(422, "Bild konnte nicht verarbeitet werden")
+            await self._loop.run_in_executor(None, add_uploaded_image, path)
+        print(f"Foto hochgeladen: {path}")
+        return self._web.json_response({"path": path, "new": new, "images": len(images)},
+                                       status=201 if new else 200)
+
+    async def _handle_websocket(self, request):
+        if not self._authorized(request):
+            return self._error(401, "Nicht berechtigt")
+        ws = self._web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._clients.add(ws)
+        try:
+            await ws.send_str(json.dumps(state_payload()))
+            async for message in ws:
+                if message.type != self._web.WSMsgType.TEXT:
+                    continue
+                try:
+                    request_data = json.loads(message.data)
+                except ValueError:
+                    await ws.send_str(json.dumps({"error": "Ungültiges JSON"}))
+                    continue
+                if not isinstance(request_data, dict) or await self._run_command(request_data) is None:
+                    await ws.send_str(json.dumps({"error": "Unbekannter Befehl"}))
+        finally:
+            self._clients.discard(ws)
+        return ws
+
+# SHA-1 des Dateiinhalts, blockweise (auch für grosse Videos)
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Relativer Pfad aus dem Manifest eines anderen Rahmens -> Pfad im eigenen Bildordner (None = nicht erlaubt)
+def sync_target_path(root, relpath):
+    if not isinstance(relpath, str) or not relpath.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+        return None
+    parts = relpath.replace("\\", "/").split("/")
+    if any(part in ("", ".", "..") or part.startswith(".") or ":" in part for part in parts):
+        return None
+    return os.path.join(root, *parts)
+
+# Für den Abgleich: Favoriten als Pfade lesen, einen Favoriten setzen, ein Bild anzeigen
+def favorite_paths():
+    with state.lock:
+        return list(favorites)
+
+def set_favorite(path, added):
+    with state.transaction() as s:
+        if added:
+            favorites_add(s, path)
+        elif favorites_discard(s, path) and s.favorites_mode:
+            keep_position(s)
+
+def show_image(path):
+    with state.transaction() as s:
+        clist = active_playlist(s)
+        if path in clist:
+            s.current_index = clist.index(path)
+            s.current_image = path
+            s.last_image_update_time = time.time()
+
+def sync_peer_url(host, port):
+    return f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
+
+# Findet andere Rahmen über UDP-Broadcast ({"node": ..., "port": ...} alle paar Sekunden)
+class SyncDiscovery(asyncio.DatagramProtocol):
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            port = int(message["port"])
+            node = str(message["node"])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.node.add_peer(sync_peer_url(addr[0], port), node)
+
+# Abgleich mehrerer Bilderrahmen im Heimnetz. Bilder werden über ihren Inhalt (SHA-1) erkannt: übertragen wird nur,
+# was einem Rahmen fehlt, egal unter welchem Namen oder in welchem Ordner es dort schon liegt.
+# Jeder Rahmen bietet auf SYNC_PORT an (eigener aiohttp-Server in einem eigenen Thread):
+#   GET  /sync/manifest       Hashes mit Grösse und Pfad, Favoriten (ETag, gzip)
+#   GET  /sync/blob/<sha1>    Datei, mit Range -> abgebrochene Downloads werden fortgesetzt
+#   POST /sync/event          Sofortmeldung: geänderte Favoriten, aktuelles Bild, neuer Stand der Bilder
+# Favoriten werden pro Hash mit (Zeit, Rahmen-ID) gespeichert, die jüngste Änderung gewinnt (auch Entfernen).
+# Übernommene Änderungen werden an die eigenen Rahmen weitergemeldet, so erreichen sie auch Rahmen, die sich
+# (noch) nicht direkt kennen.
+# Ohne gemeinsames Token startet der Abgleich nicht. Andere Rahmen werden nur aus peers oder (per Broadcast und
+# Meldungen) aus allowed_networks übernommen, nie aus den Angaben anderer Rahmen.
+# Hier gelöschte (oder mit "bild löschen" entfernte) Bilder werden nicht erneut geladen, auf den anderen Rahmen
+# aber auch nicht gelöscht. Mit attached=False läuft ein Knoten ohne Diashow
+# (z.B. mehrere Knoten auf localhost zum Testen), Favoriten dann über set_favorite().
+class SyncNode:
+    BATCH = 500   # Nach so vielen neu berechneten Hashes wird gespeichert
+
+    def __init__(self, root, state_path, port=SYNC_PORT, peers=SYNC_PEERS, host=SYNC_HOST,
+                 allowed_networks=SYNC_ALLOWED_NETWORKS, discovery_port=SYNC_DISCOVERY_PORT,
+                 share_position=SYNC_POSITION, token=API_TOKEN, attached=True):
+        self.root = os.path.normpath(root)
+        self.state_path = state_path
+        self.host = host
+        self.port = port
+        self.peers = {peer.rstrip("/"): None for peer in peers}   # Basis-URL -> Rahmen-ID (None = noch unbekannt)
+        self.configured_hosts = {urllib.parse.urlsplit(peer).hostname for peer in peers}
+        self.allowed_networks = [ipaddress.ip_network(network, strict=False) for network in allowed_networks]
+        self.discovery_port = discovery_port
+        self.share_position = share_position
+        self.token = token
+        self.attached = attached
+        self.node = None
+        self.files = {}          # Relativer Pfad ("/" als Trenner) -> [Grösse, mtime_ns, sha1]
+        self.favorites = {}      # sha1 -> [Zeit, Favorit, Rahmen-ID]
+        self.position = None     # [Zeit, sha1, Rahmen-ID] des zuletzt gemeldeten Bildes
+        self.removed = set()     # Hashes hier entfernter Bilder, werden nicht mehr geladen
+        self.stats = {"downloaded": 0, "bytes": 0, "resumed": 0, "failed": 0, "events_sent": 0, "events_received": 0}
+        self._instance = os.urandom(4).hex()   # Neuer ETag nach jedem Neustart
+        self._files_version = 0
+        self._favorites_version = 0
+        self._by_hash = {}       # sha1 -> relativer Pfad
+        self._manifest = None    # (ETag, JSON-Bytes)
+        self._lock = Lock()
+        self._stopped = Event()
+        self._loop = None
+        self._web = None
+        self._client = None
+        self._session = None
+        self._changed = None
+        self._transfers = None
+        self._peer_locks = {}
+        self._peer_etags = {}    # Peer -> ETag des zuletzt vollständig übernommenen Manifests
+        self._peer_blobs = {}    # Peer -> Stand seiner Bilder (blobs_version)
+        self._inflight = set()
+        self._snapshot = None
+        self._library_version = None
+        self._last_image = None
+        self._pushed_blobs = None
+        self._pending_favorites = {}   # Änderungen, die noch gemeldet werden müssen
+        self._pending_position = None
+
+    def load(self):
+        try:
+            with open(self.state_path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            data = {}
+        with self._lock:
+            self.node = data.get("node") or os.urandom(8).hex()
+            self.files = data.get("files", {}) if data.get("root") == self.root else {}
+            self.favorites = data.get("favorites", {})
+            self.removed = set(data.get("removed", []))
+            self._reindex()
+            self._favorites_version += 1
+
+    def save(self):
+        with self._lock:
+            data = {"node": self.node, "root": self.root, "files": self.files, "favorites": self.favorites,
+                    "removed": sorted(self.removed)}
+        tmp = self.state_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"Abgleich-Daten konnten nicht gespeichert werden: {e}")
+
+    # Aufruf mit gehaltenem _lock
+    def _reindex(self):
+        self._by_hash = {}
+        for relpath, entry in self.files.items():
+            self._by_hash.setdefault(entry[2], relpath)
+        self._files_version += 1
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def path_for(self, sha1):
+        with self._lock:
+            relpath = self._by_hash.get(sha1)
+        return os.path.join(self.root, *relpath.split("/")) if relpath else None
+
+    def hash_for(self, path):
+        with self._lock:
+            entry = self.files.get(self._relpath(path))
+        return entry[2] if entry else None
+
+    # Hashes für neue und geänderte Dateien berechnen (aus dem Bildordner-Durchlauf). Gibt die Anzahl zurück.
+    def update(self, paths, mtimes=None):
+        mtimes = mtimes or {}
+        with self._lock:
+            known = dict(self.files)
+        files = {}
+        fresh = {}
+        for path in paths:
+            relpath = self._relpath(path)
+            if relpath.startswith(".."):
+                continue
+            entry = known.get(relpath)
+            if entry is not None and mtimes.get(path) == entry[1]:
+                files[relpath] = entry
+                continue
+            try:
+                st = os.stat(path)
+                if entry is not None and entry[:2] == [st.st_size, st.st_mtime_ns]:
+                    files[relpath] = entry
+                    continue
+                files[relpath] = fresh[relpath] = [st.st_size, st.st_mtime_ns, file_sha1(path)]
+            except OSError:
+                continue
+            if len(fresh) % self.BATCH == 0:
+                with self._lock:
+                    self.files.update(fresh)
+                    self._reindex()
+                self.save()
+        removed = known.keys() - files.keys()
+        if fresh or removed:
+            present = {entry[2] for entry in files.values()}
+            with self._lock:
+                self.files = files
+                self.removed.update(known[relpath][2] for relpath in removed)
+                self.removed -= present
+                self._reindex()
+            self.save()
+            self._notify()
+        return len(fresh)
+
+    # Einzelne neue Datei aufnehmen (Upload oder Download), sha1 falls schon bekannt
+    def add_file(self, path, sha1=None):
+        relpath = self._relpath(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self.files.get(relpath)
+        if entry is not None and entry[:2] == [st.st_size, st.st_mtime_ns]:
+            return
+        entry = [st.st_size, st.st_mtime_ns, sha1 or file_sha1(path)]
+        with self._lock:
+            self.files[relpath] = entry
+            self.removed.discard(entry[2])
+            self._by_hash.setdefault(entry[2], relpath)
+            self._files_version += 1
+        self._notify()
+
+    # Favorit über den Hash setzen (ohne Diashow, z.B. zum Testen)
+    def set_favorite(self, sha1, added):
+        with self._lock:
+            self.favorites[sha1] = self._pending_favorites[sha1] = [time.time(), bool(added), self.node]
+            self._favorites_version += 1
+        self._notify()
+
+    # Favoriten eines anderen Rahmens übernehmen (jüngere Änderung gewinnt). Gibt {sha1: Favorit} der Änderungen zurück.
+    def merge_favorites(self, remote):
+        changed = {}
+        with self._lock:
+            for sha1, entry in remote.items():
+                try:
+                    stamp, added, node = float(entry[0]), bool(entry[1]), str(entry[2])
+                except (TypeError, ValueError, IndexError):
+                    continue
+                local = self.favorites.get(sha1)
+                if local is None or (stamp, node) > (local[0], local[2]):
+                    self.favorites[sha1] = self._pending_favorites[sha1] = [stamp, added, node]
+                    changed[sha1] = added
+            if changed:
+                self._favorites_version += 1
+        if changed:
+            self._notify()
+        if changed and self.attached:
+            for sha1, added in changed.items():
+                path = self.path_for(sha1)
+                if path is not None:   # Sonst nach dem Download
+                    set_favorite(path, added)
+        return changed
+
+    # Aktuelles Bild eines anderen Rahmens anzeigen, falls neuer als das zuletzt gemeldete
+    def merge_position(self, remote):
+        if not self.share_position or not remote:
+            return
+        try:
+            stamp, sha1, node = float(remote[0]), str(remote[1]), str(remote[2])
+        except (TypeError, ValueError, IndexError):
+            return
+        with self._lock:
+            if self.position is not None and (stamp, node) <= (self.position[0], self.position[2]):
+                return
+            self.position = self._pending_position = [stamp, sha1, node]
+        self._notify()
+        path = self.path_for(sha1)
+        if path is not None and self.attached:
+            show_image(path)
+
+    # Eigene Änderungen seit der letzten Meldung (Favoriten, aktuelles Bild, Stand der Bilder), None = nichts Neues
+    def _local_changes(self):
+        snapshot = self._snapshot
+        position = None
+        if self.attached and snapshot is not None:
+            if snapshot.library_version != self._library_version:
+                self._library_version = snapshot.library_version
+                self._diff_favorites(favorite_paths())
+            if self.share_position and snapshot.current_image != self._last_image:
+                self._last_image = snapshot.current_image
+                sha1 = self.hash_for(snapshot.current_image) if snapshot.current_image else None
+                with self._lock:
+                    if sha1 is not None and (self.position is None or self.position[1] != sha1):
+                        self.position = position = [time.time(), sha1, self.node]
+        with self._lock:
+            changed, self._pending_favorites = self._pending_favorites, {}
+            position, self._pending_position = position or self._pending_position, None
+            blobs = self._blobs_version()
+        if not changed and position is None and blobs == self._pushed_blobs:
+            return None
+        self._pushed_blobs = blobs
+        return {"node": self.node, "port": self.port, "blobs_version": blobs,
+                "favorites": changed, "position": position}
+
+    # Vergleicht die Favoriten der Diashow mit den gemeinsamen Favoriten und merkt sich die Unterschiede
+    def _diff_favorites(self, paths):
+        now = time.time()
+        with self._lock:
+            hashes = set()
+            for path in paths:
+                entry = self.files.get(self._relpath(path))
+                if entry is not None:
+                    hashes.add(entry[2])
+            for sha1 in hashes:
+                entry = self.favorites.get(sha1)
+                if entry is None or not entry[1]:
+                    self.favorites[sha1] = self._pending_favorites[sha1] = [now, True, self.node]
+            # Entfernt: nur Bilder, die hier vorhanden sind (andere kommen erst noch per Download)
+            for sha1, entry in list(self.favorites.items()):
+                if entry[1] and sha1 not in hashes and sha1 in self._by_hash:
+                    self.favorites[sha1] = self._pending_favorites[sha1] = [now, False, self.node]
+            if self._pending_favorites:
+                self._favorites_version += 1
+
+    def _blobs_version(self):
+        return f"{self._instance}-{self._files_version}"
+
+    # Manifest als (ETag, JSON-Bytes), wird nur bei Änderungen neu erstellt
+    def manifest(self):
+        with self._lock:
+            etag = f'"{self._instance}-{self._files_version}-{self._favorites_version}"'
+            if self._manifest is None or self._manifest[0] != etag:
+                data = {"node": self.node, "port": self.port, "blobs_version": self._blobs_version(),
+                        "blobs": {sha1: [self.files[relpath][0], relpath] for sha1, relpath in self._by_hash.items()},
+                        "favorites": self.favorites}
+                self._manifest = (etag, json.dumps(data).encode("utf-8"))
+            return self._manifest
+
+    # Aus beliebigem Thread: Änderung melden, verschickt wird im Event-Loop
+    def _notify(self):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            pass
+
+    def _on_state_change(self, snapshot):
+        self._snapshot = snapshot
+        self._notify()
+
+    # Nur eingetragene Rahmen oder Adressen aus allowed_networks
+    def host_allowed(self, host):
+        if host in self.configured_hosts:
+            return True
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.allowed_networks)
+
+    def add_peer(self, url, node=None):
+        url = url.rstrip("/")
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not self.host_allowed(parts.hostname):
+            return
+        if node == self.node or (node is not None and node in self.peers.values() and self.peers.get(url) != node):
+            return
+        new = url not in self.peers
+        if new or node is not None:
+            self.peers[url] = node
+        if new and self._loop is not None:
+            print(f"Abgleich: Rahmen {url} gefunden.")
+            self._pushed_blobs = None   # Beim neuen Rahmen melden, damit er uns auch kennt
+            self._notify()
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._sync_peer(url)))
+
+    def run(self):
+        if not self.token:
+            print("Abgleich deaktiviert: API_TOKEN muss gesetzt sein (auf allen Rahmen gleich).")
+            return
+        try:
+            asyncio.run(self._serve())
+        except ImportError:
+            print("aiohttp nicht installiert, Abgleich deaktiviert (pip install aiohttp).")
+        except OSError as e:
+            print(f"Abgleich konnte nicht gestartet werden: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _running(self):
+        return not self._stopped.is_set() and (not self.attached or state.snapshot().running)
+
+    async def _serve(self):
+        import aiohttp
+        from aiohttp import web
+        self._web = web
+        self._client = aiohttp
+        if self.node is None:
+            self.load()
+        self._changed = asyncio.Event()
+        self._transfers = asyncio.Semaphore(SYNC_TRANSFERS)
+
+        app = web.Application()
+        app.add_routes([
+            web.get("/sync/manifest", self._handle_manifest),
+            web.get("/sync/blob/{sha1}", self._handle_blob),
+            web.post("/sync/event", self._handle_event),
+        ])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        self._session = aiohttp.ClientSession(headers=self._headers(),
+                                              timeout=aiohttp.ClientTimeout(total=None, connect=5, sock_read=30))
+        self._loop = asyncio.get_running_loop()
+        print(f"Abgleich unter http://{self.host}:{self.port}/sync/, Rahmen-ID {self.node}")
+
+        if self.attached:
+            self._snapshot = state.snapshot()
+            state.subscribe(self._on_state_change)
+        tasks = [asyncio.create_task(self._events()), asyncio.create_task(self._poll())]
+        if self.discovery_port:
+            tasks.append(asyncio.create_task(self._discovery()))
+        self._changed.set()
+        try:
+            while self._running():
+                await asyncio.sleep(0.2)
+        finally:
+            if self.attached:
+                state.unsubscribe(self._on_state_change)
+            for task in tasks:
+                task.cancel()
+            await self._session.close()
+            await runner.cleanup()
+            self.save()
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def _authorized(self, request):
+        return bool(self.token) and hmac.compare_digest(request.headers.get("Authorization", ""),
+                                                        f"Bearer {self.token}")
+
+    async def _handle_manifest(self, request):
+        if not self._authorized(request):
+            return self._web.json_response({"error": "Nicht berechtigt"}, status=401)
+        etag, body = await self._loop.run_in_executor(None, self.manifest)
+        if request.headers.get("If-None-Match") == etag:
+            return self._web.Response(status=304, headers={"ETag": etag})
+        response = self._web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+        response.enable_compression()
+        return response
+
+    # Datei zum Hash, Range-Anfragen übernimmt aiohttp
+    async def _handle_blob(self, request):
+        if not self._authorized(request):
+            return self._web.json_response({"error": "Nicht berechtigt"}, status=401)
+        path = self.path_for(request.match_info["sha1"])
+        if path is None or not os.path.isfile(path):
+            return self._web.json_response({"error": "Unbekannt"}, status=404)
+        return self._web.FileResponse(path)
+
+    async def _handle_event(self, request):
+        if not self._authorized(request):
+            return self._web.json_response({"error": "Nicht berechtigt"}, status=401)
+        try:
+            event = await request.json()
+            node, port = str(event["node"]), int(event["port"])
+        except (ValueError, KeyError, TypeError):
+            return self._web.json_response({"error": "Ungültige Meldung"}, status=400)
+        if node == self.node:
+            return self._web.json_response({"node": self.node})
+        self.stats["events_received"] += 1
+        peer = sync_peer_url(request.remote or "", port)
+        self.add_peer(peer, node)
+        if isinstance(event.get("favorites"), dict) and event["favorites"]:
+            await self._loop.run_in_executor(None, self.merge_favorites, event["favorites"])
+        if event.get("position"):
+            await self._loop.run_in_executor(None, self.merge_position, event["position"])
+        if peer in self.peers and event.get("blobs_version") != self._peer_blobs.get(peer):
+            asyncio.ensure_future(self._sync_peer(peer))
+        return self._web.json_response({"node": self.node})
+
+    # Meldet eigene Änderungen sofort an alle bekannten Rahmen
+    async def _events(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            event = await self._loop.run_in_executor(None, self._local_changes)
+            if event is None or not self.peers:
+                continue
+            body = json.dumps(event)
+            await asyncio.gather(*(self._send_event(peer, body) for peer in list(self.peers)))
+            self.stats["events_sent"] += 1
+
+    async def _send_event(self, peer, body):
+        try:
+            async with self._session.post(peer + "/sync/event", data=body,
+                                          headers={"Content-Type": "application/json"},
+                                          timeout=self._client.ClientTimeout(total=5)) as response:
+                await response.read()
+        except (self._client.ClientError, asyncio.TimeoutError):
+            pass
+
+    async def _poll(self):
+        while True:
+            await asyncio.gather(*(self._sync_peer(peer) for peer in list(self.peers)))
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    async def _discovery(self):
+        transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: SyncDiscovery(self), local_addr=("0.0.0.0", self.discovery_port),
+            reuse_port=True, allow_broadcast=True)
+        beacon = json.dumps({"node": self.node, "port": self.port}).encode("utf-8")
+        try:
+            while True:
+                try:
+                    transport.sendto(beacon, ("255.255.255.255", self.discovery_port))
+                except OSError as e:
+                    print(f"Abgleich: Broadcast nicht möglich ({e}), nur SYNC_PEERS werden abgeglichen.")
+                    return
+                await asyncio.sleep(10)
+        finally:
+            transport.close()
+
+    # Manifest eines Rahmens holen, Favoriten übernehmen und fehlende Bilder laden
+    async def _sync_peer(self, peer):
+        lock = self._peer_locks.setdefault(peer, asyncio.Lock())
+        async with lock:
+            headers = {}
+            if peer in self._peer_etags:
+                headers["If-None-Match"] = self._peer_etags[peer]
+            try:
+                async with self._session.get(peer + "/sync/manifest", headers=headers) as response:
+                    if response.status == 304:
+                        return
+                    if response.status != 200:
+                        print(f"Abgleich: {peer} antwortet mit {response.status}.")
+                        return
+                    etag = response.headers.get("ETag")
+                    data = await response.json()
+            except (self._client.ClientError, asyncio.TimeoutError, ValueError):
+                return
+            if data.get("node") == self.node:
+                self.peers.pop(peer, None)
+                return
+            self.peers[peer] = data.get("node")
+            await self._loop.run_in_executor(None, self.merge_favorites, data.get("favorites") or {})
+
+            with self._lock:
+                missing = [(sha1, entry) for sha1, entry in (data.get("blobs") or {}).items()
+                           if sha1 not in self._by_hash and sha1 not in self._inflight and sha1 not in self.removed]
+                self._inflight.update(sha1 for sha1, _ in missing)
+            try:
+                results = await asyncio.gather(*(self._download(peer, sha1, entry) for sha1, entry in missing))
+            finally:
+                self._inflight.difference_update(sha1 for sha1, _ in missing)
+            if all(results):
+                self._peer_etags[peer] = etag
+                self._peer_blobs[peer] = data.get("blobs_version")
+            if missing:
+                print(f"Abgleich mit {peer}: {sum(results)} von {len(missing)} Bildern übernommen.")
+
+    # Vorbereitung im Thread-Pool: Ordner anlegen, Stand eines abgebrochenen Downloads und freien Platz prüfen.
+    # Gibt (bisher geladene Bytes, .part vorhanden, genug Platz) zurück.
+    def _prepare_part(self, part, size):
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        exists = os.path.exists(part)
+        offset = os.path.getsize(part) if exists else 0
+        if offset > size:
+            offset = 0
+        return offset, exists, shutil.disk_usage(self.root).free - (size - offset) >= SYNC_MIN_FREE_BYTES
+
+    # Lädt eine Datei in .sync/<sha1>.part (setzt einen abgebrochenen Download fort), prüft den Hash
+    # und verschiebt sie an denselben Pfad wie beim anderen Rahmen. Alle Dateizugriffe laufen im Thread-Pool
+    # (geschrieben wird in Blöcken von SYNC_WRITE_BYTES), damit die SD-Karte den Event-Loop nicht aufhält.
+    async def _download(self, peer, sha1, entry):
+        try:
+            size, relpath = int(entry[0]), entry[1]
+        except (TypeError, ValueError, IndexError):
+            return False
+        target = sync_target_path(self.root, relpath)
+        if target is None or not re.fullmatch(r"[0-9a-f]{40}", sha1) or not 0 <= size <= SYNC_MAX_FILE_BYTES:
+            return True   # Nicht übernehmen, aber auch nicht erneut versuchen
+        part = os.path.join(self.root, ".sync", sha1 + ".part")
+        run = self._loop.run_in_executor
+        async with self._transfers:
+            try:
+                offset, exists, enough_space = await run(None, self._prepare_part, part, size)
+                if not enough_space:
+                    print(f"Abgleich: zu wenig Speicherplatz für {relpath}.")
+                    return False
+                if offset < size or not exists:
+                    headers = {"Range": f"bytes={offset}-"} if offset else {}
+                    async with self._session.get(f"{peer}/sync/blob/{sha1}", headers=headers) as response:
+                        if response.status == 206 and offset:
+                            self.stats["resumed"] += 1
+                            mode = "ab"
+                        elif response.status == 200:
+                            mode = "wb"
+                        else:
+                            raise OSError(f"Status {response.status}")
+                        written = offset if mode == "ab" else 0
+                        f = await run(None, open, part, mode)
+                        pending, pending_bytes = [], 0
+                        try:
+                            async for chunk in response.content.iter_chunked(256 * 1024):
+                                written += len(chunk)
+                                if written > size:
+                                    pending = []
+                                    raise ValueError(f"mehr als die angegebenen {size} Bytes")
+                                pending.append(chunk)
+                                pending_bytes += len(chunk)
+                                self.stats["bytes"] += len(chunk)
+                                if pending_bytes >= SYNC_WRITE_BYTES:
+                                    await run(None, f.write, b"".join(pending))
+                                    pending, pending_bytes = [], 0
+                        finally:
+                            # Auch bei einem Abbruch das bereits Empfangene schreiben (wird später fortgesetzt)
+                            try:
+                                if pending:
+                                    await run(None, f.write, b"".join(pending))
+                            finally:
+                                await run(None, f.close)
+            except ValueError as e:
+                print(f"Abgleich: {relpath} von {peer} verworfen ({e}).")
+                await run(None, os.remove, part)
+                self.stats["failed"] += 1
+                return False
+            except (self._client.ClientError, asyncio.TimeoutError, OSError) as e:
+                print(f"Abgleich: {relpath} von {peer} unterbrochen ({e or type(e).__name__}), wird später fortgesetzt.")
+                self.stats["failed"] += 1
+                return False
+        if await run(None, os.path.getsize, part) < size:
+            return False   # Verbindung vorzeitig beendet, beim nächsten Abgleich fortsetzen
+        return await run(None, self._store, part, target, sha1)
+
+    # Heruntergeladene Datei prüfen und aufnehmen (im Thread-Pool, Hash und Dateisystem blockieren)
+    def _store(self, part, target, sha1):
+        # Erst nach geprüftem Hash in den Bildordner (unvollständige oder falsche Dateien bleiben in .sync)
+        if file_sha1(part) != sha1:
+            print(f"Abgleich: {os.path.basename(target)} fehlerhaft übertragen, wird neu geladen.")
+            os.remove(part)
+            self.stats["failed"] += 1
+            return False
+        if os.path.exists(target):
+            if os.path.getsize(target) == os.path.getsize(part) and file_sha1(target) == sha1:
+                os.remove(part)
+            else:
+                base, ext = os.path.splitext(target)
+                target = f"{base}-{sha1[:8]}{ext}"
+        if os.path.exists(part):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(part, target)
+        self.add_file(target, sha1)
+        self.stats["downloaded"] += 1
+        if self.attached:
+            add_uploaded_image(target)
+            with self._lock:
+                favorite = self.favorites.get(sha1, [0, False])[1]
+                position = self.position is not None and self.position[1] == sha1
+            if favorite:
+                set_favorite(target, True)
+            if position and self.share_position:
+                show_image(target)
+        return True
+
+sync = SyncNode(image_folder, sync_state_file)
+
+# Alle Bilder und Favoriten als Tupel. Kopiert wird ohne Lock und nur, wenn sich library_version geändert hat;
+# ändert sich die Bibliothek während des Kopierens, wird beim nächsten Aufruf neu kopiert.
+_library_paths = (None, ())
+
+def library_paths():
+    global _library_paths
+    version = state.snapshot().library_version
+    if _library_paths[0] != version:
+        _library_paths = (version, tuple(dict.fromkeys([*images, *favorites])))
+    return _library_paths[1]
+
+# Die nächsten RENDITION_AHEAD Bilder der aktuellen Abspielliste (in zufälliger Reihenfolge die gezogenen)
+def rendition_targets(ahead=RENDITION_AHEAD):
+    with state.transaction() as s:
+        clist = active_playlist(s)
+        if not clist:
+            return []
+        if s.shuffle:
+            return [s.current_image] + shuffle_order.upcoming(clist, s.current_image, ahead)
+        return neighbour_paths(clist, s.current_index, ahead=ahead, behind=0)
+
+# Thread, der im Leerlauf die kommenden Bilder für den SD-Karten-Cache vorberechnet und verwaiste Dateien löscht
+def rendition_builder_thread():
+    while state.snapshot().running:
+        removed = rendition_cache.cleanup(library_paths(), SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        built = 0
+        for path in rendition_targets():
+            if not state.snapshot().running:
+                return
+            # Vorrang für die Diashow: warten, bis das Vorausladen fertig ist
+            while state.snapshot().running and prefetcher.busy():
+                time.sleep(0.2)
+            if rendition_cache.contains(path, SCREEN_WIDTH, SCREEN_HEIGHT):
+                continue
+            img = load_display_image(path, SCREEN_WIDTH, SCREEN_HEIGHT)
+            if img is not None:
+                frame = resize_and_center_image(img, SCREEN_WIDTH, SCREEN_HEIGHT, out=frame_pool.acquire())
+                rendition_cache.store(path, SCREEN_WIDTH, SCREEN_HEIGHT, frame)
+                frame_pool.release(frame)
+                built += 1
+            time.sleep(RENDITION_IDLE_DELAY)
+
+        if built or removed:
+            print(f"Bild-Cache auf SD-Karte: {built} neu berechnet, {removed} verwaiste Dateien gelöscht.")
+
+        next_run = time.time() + RENDITION_RESCAN_INTERVAL
+        while state.snapshot().running and time.time() < next_run:
+            time.sleep(1.0)
+
+# Gibt die Messwerte unter /metrics auf localhost aus (nur lokal erreichbar)
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Thread, der die Messwerte regelmässig in METRICS_FILE schreibt und ggf. per HTTP anbietet
+def metrics_exporter_thread():
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), MetricsRequestHandler)
+            Thread(target=server.serve_forever, daemon=True).start()
+            print(f"Messwerte unter http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"Messwerte-Server konnte nicht gestartet werden: {e}")
+    while state.snapshot().running:
+        if METRICS_FILE:
+            metrics.write_file(METRICS_FILE)
+        next_run = time.time() + METRICS_INTERVAL
+        while state.snapshot().running and time.time() < next_run:
+            time.sleep(1.0)
+    if METRICS_FILE:
+        metrics.write_file(METRICS_FILE)
 
 def main():
-    global running
-    load_images()
-    load_favorites()
+    with startup_phase("Bibliothek"):
+        load_images()
+    with startup_phase("Favoriten"):
+        load_favorites()
+    if SYNC_ENABLED:
+        sync.load()
     print("Digitaler Bilderrahmen gestartet!")
 
     slideshow = Thread(target=slideshow_thread)
     voice_control = Thread(target=voice_control_thread)
+    rendition_builder = Thread(target=rendition_builder_thread, daemon=True)
+    library_scanner = Thread(target=library_scanner_thread, daemon=True)
 
     slideshow.start()
     voice_control.start()
+    rendition_builder.start()
+    library_scanner.start()
+    if metrics.enabled and (METRICS_FILE or METRICS_PORT):
+        Thread(target=metrics_exporter_thread, daemon=True).start()
+    if API_ENABLED:
+        Thread(target=ControlServer().run, daemon=True).start()
+    if SYNC_ENABLED:
+        Thread(target=sync.run, daemon=True).start()
 
     slideshow.join()
     voice_control.join()
+    favorites.close()
+    library.save_index()
+    if SYNC_ENABLED:
+        sync.save()
 
 if __name__ == "__main__":
     main()
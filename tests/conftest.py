@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bilderrahmen.py liegt im Hauptordner des Repositorys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+import pytest
+
+from bilderrahmen import CommandMatcher, extract_number, parse_german_number
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("42", 42),
+    ("eins", 1),
+    ("zwei", 2),
+    ("zwölf", 12),
+    ("siebzehn", 17),
+    ("zwanzig", 20),
+    ("sechzig", 60),
+    ("einundzwanzig", 21),
+    ("dreiundvierzig", 43),
+    ("neunundneunzig", 99),
+    ("hundert", 100),
+    ("einhundert", 100),
+    ("zweihundert", 200),
+    ("hundertundeins", 101),
+    ("tausend", 1000),
+    ("zweitausenddreihundertvierundfünfzig", 2354),
+    ("Zwölf", 12),
+    # "ein"/"eine" allein ist ein Artikel ("ein bild vor"), nur als Teil einer Zahl 1
+    ("ein", None),
+    ("eine", None),
+    ("undzwanzig", None),
+    ("zwölf3", None),
+    ("bild", None),
+    ("", None),
+])
+def test_parse_german_number(word, expected):
+    assert parse_german_number(word) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("gehe zu bild zwölf", ("gehe zu bild", 12)),
+    ("gehe zu bild zwei hundert", ("gehe zu bild", 200)),
+    ("gehe zu bild 12 bitte", ("gehe zu bild bitte", 12)),
+    ("zeige bild nummer einundzwanzig", ("zeige bild nummer", 21)),
+    ("gehe zu bild ein", ("gehe zu bild ein", None)),
+    ("ein bild vor", ("ein bild vor", None)),
+    ("keine zahl", ("keine zahl", None)),
+])
+def test_extract_number(text, expected):
+    assert extract_number(text) == expected
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    pytest.importorskip("rapidfuzz")
+    matcher = CommandMatcher()
+    matcher.prepare()
+    return matcher
+
+
+@pytest.mark.parametrize("alternatives, command, number, hotword, argument", [
+    (["vorwärts"], "vorwärts", None, False, None),
+    (["hey berry vorwärts"], "vorwärts", None, True, None),
+    (["hey barry gehe zu bild zwölf"], "gehe zu bild", 12, True, None),
+    (["hey berry gehe zu bild zwei hundert"], "gehe zu bild", 200, True, None),
+    (["hey berry speichern als favoriten"], "speichern als favorit", None, True, None),
+    (["hey baby zeige bilder von 2019"], "zeige bilder von", 2019, True, None),
+    (["hey berry bilder aus italien"], "bilder aus", None, True, "italien"),
+    (["hey berry bewegte bilder"], "bewegte bilder", None, True, None),
+    (["hey berry"], None, None, True, None),
+    (["hey berry blah blubb"], None, None, True, None),
+    ([], None, None, False, None),
+])
+def test_match(matcher, alternatives, command, number, hotword, argument):
+    match = matcher.match(alternatives)
+    assert (match.command, match.number, match.hotword, match.argument) == (command, number, hotword, argument)
+
+
+def test_match_requires_hotword(matcher):
+    assert matcher.match(["vorwärts"], require_hotword=True).command is None
+    # Eine spätere Variante mit Erkennungswort zählt
+    match = matcher.match(["vorwärts", "hey berry zurück"], require_hotword=True)
+    assert (match.command, match.text) == ("zurück", "hey berry zurück")
+
+
+def test_match_prefers_earlier_alternative_on_tie(matcher):
+    assert matcher.match(["hey berry pause", "hey berry weiter"]).command == "pause"
+
+
+@pytest.mark.parametrize("text, rest", [
+    ("hey berry vorwärts", "vorwärts"),
+    ("also hey barry gehe zu bild", "gehe zu bild"),
+    ("vorwärts", "vorwärts"),
+])
+def test_split_hotword(matcher, text, rest):
+    assert matcher.split_hotword(text)[1] == rest
@@ -0,0 +1,88 @@
+import json
+from threading import Lock
+
+from bilderrahmen import FavoritesStore
+
+
+def make_store(tmp_path):
+    lock = Lock()
+    return FavoritesStore(str(tmp_path / "favorites.json"), str(tmp_path / "favorites.journal"), lock), lock
+
+
+def reopen(tmp_path):
+    store, _ = make_store(tmp_path)
+    store.load()
+    return store
+
+
+def test_load_without_files_is_empty(tmp_path):
+    assert list(reopen(tmp_path)) == []
+
+
+def test_replay_after_crash_ignores_truncated_last_line(tmp_path):
+    (tmp_path / "favorites.json").write_text(json.dumps(["a.jpg", "b.jpg"]))
+    # Stromausfall beim Schreiben der letzten Zeile
+    (tmp_path / "favorites.journal").write_text('["+", "c.jpg"]\n["-", "a.jpg"]\n["+", "d.j')
+    store = reopen(tmp_path)
+    assert list(store) == ["b.jpg", "c.jpg"]
+    # Nach dem Abspielen wird zusammengefasst: Journal leer, favorites.json vollständig
+    assert (tmp_path / "favorites.journal").read_text() == ""
+    assert json.loads((tmp_path / "favorites.json").read_text()) == ["b.jpg", "c.jpg"]
+
+
+def test_unflushed_changes_survive_via_journal(tmp_path):
+    store, lock = make_store(tmp_path)
+    store.load()
+    with lock:
+        store.add("a.jpg")
+        store.add("b.jpg")
+        store.discard("a.jpg")
+    store.flush()
+    # Kein close() -> favorites.json wurde nicht neu geschrieben, nur das Journal
+    assert not (tmp_path / "favorites.json").exists()
+    assert list(reopen(tmp_path)) == ["b.jpg"]
+
+
+def test_compaction_keeps_the_same_favorites(tmp_path):
+    store, lock = make_store(tmp_path)
+    store.load()
+    with lock:
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            store.add(name)
+        store.discard("b.jpg")
+    store.flush()
+    before = list(reopen(tmp_path))
+    store.compact()
+    assert (tmp_path / "favorites.journal").read_text() == ""
+    assert not (tmp_path / "favorites.json.tmp").exists()
+    assert list(reopen(tmp_path)) == before == ["a.jpg", "c.jpg"]
+
+
+def test_repeated_add_and_remove_of_same_image(tmp_path):
+    store, lock = make_store(tmp_path)
+    store.load()
+    with lock:
+        assert store.add("a.jpg")
+        assert not store.add("a.jpg")
+        assert store.discard("a.jpg")
+        assert not store.discard("a.jpg")
+        assert store.add("a.jpg")
+        assert store.discard("a.jpg")
+        assert store.add("a.jpg")
+    store.flush()
+    assert len(reopen(tmp_path)) == 1
+    store.close()
+    store = reopen(tmp_path)
+    assert list(store) == ["a.jpg"]
+    assert "a.jpg" in store
+
+
+def test_close_writes_everything(tmp_path):
+    store, lock = make_store(tmp_path)
+    store.load()
+    with lock:
+        store.add("a.jpg")
+        store.add("b.jpg")
+    store.close()
+    assert json.loads((tmp_path / "favorites.json").read_text()) == ["a.jpg", "b.jpg"]
+    assert (tmp_path / "favorites.journal").read_text() == ""
@@ -0,0 +1,117 @@
+import gc
+
+import numpy as np
+
+from bilderrahmen import FrameBufferPool, FrameCache, TransitionEngine
+
+
+def make_pool(max_free=4):
+    return FrameBufferPool(screen_width=8, screen_height=4, max_free=max_free)
+
+
+def test_released_buffer_is_reused():
+    pool = make_pool()
+    buffer = pool.acquire()
+    pool.release(buffer)
+    assert pool.acquire() is buffer
+    assert pool.stats()["reuses"] == 1
+
+
+def test_buffer_is_recycled_only_after_last_reference():
+    pool = make_pool()
+    buffer = pool.acquire()
+    pool.retain(buffer)
+    pool.release(buffer)
+    assert pool.acquire() is not buffer
+    pool.release(buffer)
+    assert pool.acquire() is buffer
+
+
+def test_double_release_does_not_hand_out_buffer_twice():
+    pool = make_pool()
+    buffer = pool.acquire()
+    pool.release(buffer)
+    pool.release(buffer)
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second
+
+
+def test_foreign_arrays_are_ignored():
+    pool = make_pool()
+    foreign = np.zeros(pool.shape, dtype=np.uint8)
+    pool.retain(foreign)
+    pool.release(foreign)
+    assert pool.stats()["free"] == 0
+
+
+def test_abandoned_buffer_is_forgotten():
+    pool = make_pool()
+    buffer = pool.acquire()
+    del buffer
+    gc.collect()
+    assert pool.stats()["in_use"] == 0
+    # Ein neues Array (evtl. mit derselben id()) gehört nicht zum Vorrat
+    foreign = np.zeros(pool.shape, dtype=np.uint8)
+    pool.release(foreign)
+    assert pool.stats()["free"] == 0
+
+
+def test_cache_keeps_buffer_until_evicted():
+    pool = make_pool()
+    cache = FrameCache(max_bytes=2 * 8 * 4 * 3, pool=pool)
+    frame = pool.acquire()
+    cache.put("a", frame)
+    pool.release(frame)          # Aufrufer ist fertig, der Cache hält das Bild noch
+    assert pool.acquire() is not frame
+    cache.put("b", pool.acquire())
+    cache.put("c", pool.acquire())   # verdrängt "a"
+    assert pool.acquire() is frame
+
+
+def test_frame_from_get_survives_eviction_until_released():
+    pool = make_pool()
+    cache = FrameCache(max_bytes=8 * 4 * 3, pool=pool)
+    frame = pool.acquire()
+    cache.put("a", frame)
+    pool.release(frame)
+    borrowed = cache.get("a")
+    cache.put("b", pool.acquire())   # verdrängt "a", während es noch verwendet wird
+    assert pool.acquire() is not borrowed
+    pool.release(borrowed)
+    assert pool.acquire() is borrowed
+
+
+def test_putting_same_buffer_again_keeps_it_cached():
+    pool = make_pool()
+    cache = FrameCache(max_bytes=8 * 4 * 3, pool=pool)
+    frame = pool.acquire()
+    cache.put("a", frame)
+    cache.put("a", frame)
+    pool.release(frame)
+    assert pool.acquire() is not frame
+    assert cache.get("a") is frame
+
+
+def test_no_allocations_per_frame_after_warm_up():
+    pool = make_pool()
+    cache = FrameCache(max_bytes=2 * 8 * 4 * 3, pool=pool)
+    transitions = TransitionEngine(pool=pool, fps=10)
+    counts = []
+    # Wie in slideshow_thread: neue Bilder kommen in den Cache (und verdrängen alte), werden überblendet
+    # und die Referenz des Aufrufers geht danach zurück
+    for i in range(40):
+        pool.begin_frame()
+        key = i // 4
+        frame = cache.get(key)
+        if frame is None:
+            frame = pool.acquire()
+            frame.fill(key)
+            cache.put(key, frame)
+        transitions.show(key, frame, 0.2, i * 0.05)
+        pool.release(frame)
+        transitions.compose(i * 0.05)
+        counts.append(pool.end_frame())
+    # Aufwärmen: ein Puffer pro Bild, bis der Cache voll ist und das erste Bild verdrängt (drei Bilder)
+    assert sum(counts[:12]) == 3
+    assert counts[12:] == [0] * 28
+    assert pool.stats()["max_per_frame"] == 1
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+
+import bilderrahmen as br
+
+
+# Testbild: Zufallspixel plus ein paar bekannte Farben in den Ecken (BGR wie bei OpenCV)
+def make_frame():
+    frame = np.random.default_rng(5).integers(0, 256, (br.SCREEN_HEIGHT, br.SCREEN_WIDTH, 3), dtype=np.uint8)
+    frame[0, 0] = (10, 20, 250)       # oben links, fast rot
+    frame[0, -1] = (255, 128, 0)      # oben rechts
+    frame[-1, 0] = (0, 255, 0)        # unten links, grün
+    return frame
+
+
+# Zeigt ein Bild auf einem Framebuffer in einer Datei an und gibt den Dateiinhalt zurück
+def render(tmp_path, frame, bits, rotation=0, **kwargs):
+    path = str(tmp_path / f"frame{bits}_{rotation}.raw")
+    open(path, "wb").close()
+    fb = br.FramebufferDisplay(device=path, rotation=rotation, touch_device=os.devnull,
+                               bits_per_pixel=bits, **kwargs)
+    fb.open(lambda *args: None)
+    fb.show(frame)
+    fb.close()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def rgb565(frame):
+    b, g, r = (frame[..., i].astype(np.uint16) for i in range(3))
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+
+def test_rgb565_conversion(tmp_path):
+    frame = make_frame()
+    data = render(tmp_path, frame, 16)
+    assert len(data) == br.SCREEN_WIDTH * br.SCREEN_HEIGHT * 2
+    pixels = np.frombuffer(data, dtype="<u2").reshape(br.SCREEN_HEIGHT, br.SCREEN_WIDTH)
+    assert np.array_equal(pixels, rgb565(frame))
+    assert pixels[0, 0] == (250 >> 3) << 11 | (20 >> 2) << 5 | (10 >> 3)
+    assert pixels[-1, 0] == 0b11111100000
+
+
+def test_xrgb_conversion(tmp_path):
+    frame = make_frame()
+    data = render(tmp_path, frame, 32)
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(br.SCREEN_HEIGHT, br.SCREEN_WIDTH, 4)
+    # Little-Endian XRGB8888: Bytes B, G, R, X
+    assert np.array_equal(pixels[..., :3], frame)
+    assert tuple(pixels[0, 0]) == (10, 20, 250, 255)
+
+
+def test_24_bit_is_copied_unchanged(tmp_path):
+    frame = make_frame()
+    data = render(tmp_path, frame, 24)
+    assert np.array_equal(np.frombuffer(data, dtype=np.uint8).reshape(frame.shape), frame)
+
+
+@pytest.mark.parametrize("rotation", [90, 180, 270])
+def test_rotation(tmp_path, rotation):
+    frame = make_frame()
+    data = render(tmp_path, frame, 32, rotation)
+    expected = np.rot90(frame, k=-rotation // 90)   # Im Uhrzeigersinn
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(expected.shape[0], expected.shape[1], 4)
+    assert np.array_equal(pixels[..., :3], expected)
+
+
+def test_smaller_frame_is_centered_in_larger_framebuffer(tmp_path):
+    frame = make_frame()
+    width, height = br.SCREEN_WIDTH + 224, br.SCREEN_HEIGHT + 120
+    data = render(tmp_path, frame, 16, width=width, height=height)
+    pixels = np.frombuffer(data, dtype="<u2").reshape(height, width)
+    assert np.array_equal(pixels[60:60 + br.SCREEN_HEIGHT, 112:112 + br.SCREEN_WIDTH], rgb565(frame))
+    # Rand bleibt schwarz
+    assert not pixels[:60].any() and not pixels[:, :112].any()
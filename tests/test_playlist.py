@@ -0,0 +1,162 @@
+import random
+
+import pytest
+
+from bilderrahmen import Playlist, ShuffleOrder
+
+
+def paths(n):
+    return [f"/bilder/{i:04d}.jpg" for i in range(n)]
+
+
+def assert_same(playlist, expected):
+    assert len(playlist) == len(expected)
+    assert list(playlist) == expected
+    for position, path in enumerate(expected):
+        assert playlist[position] == path
+        assert playlist.index(path) == position
+        assert path in playlist
+
+
+def test_initial_items_are_deduplicated_in_order():
+    playlist = Playlist(["b", "a", "b", "c"])
+    assert_same(playlist, ["b", "a", "c"])
+
+
+def test_append_and_remove_report_changes():
+    playlist = Playlist(["a"])
+    assert playlist.append("b")
+    assert not playlist.append("b")
+    assert playlist.remove("a")
+    assert not playlist.remove("a")
+    assert_same(playlist, ["b"])
+
+
+def test_positions_after_removals_use_remaining_order():
+    items = paths(10)
+    playlist = Playlist(items)
+    for path in (items[0], items[4], items[7]):
+        playlist.remove(path)
+    expected = [p for i, p in enumerate(items) if i not in (0, 4, 7)]
+    assert_same(playlist, expected)
+    assert playlist[-1] == items[9]
+    assert playlist[-len(expected)] == items[1]
+
+
+def test_append_after_removal_keeps_counts_consistent():
+    items = paths(8)
+    playlist = Playlist(items)
+    playlist.remove(items[2])          # Baum wird aufgebaut
+    playlist.append("/bilder/neu.jpg")   # Neuer Knoten im bestehenden Baum
+    playlist.remove(items[5])
+    expected = [p for p in items if p not in (items[2], items[5])] + ["/bilder/neu.jpg"]
+    assert_same(playlist, expected)
+
+
+def test_compaction_when_more_than_half_is_empty():
+    items = paths(10)
+    playlist = Playlist(items)
+    for path in items[:6]:
+        playlist.remove(path)
+    assert playlist._holes == 0
+    assert len(playlist._slots) == 4
+    assert_same(playlist, items[6:])
+
+
+def test_removed_path_can_be_added_again_at_the_end():
+    items = paths(4)
+    playlist = Playlist(items)
+    playlist.remove(items[1])
+    playlist.append(items[1])
+    assert_same(playlist, [items[0], items[2], items[3], items[1]])
+
+
+@pytest.mark.parametrize("position", [4, -5])
+def test_index_out_of_range(position):
+    playlist = Playlist(paths(4))
+    with pytest.raises(IndexError):
+        playlist[position]
+
+
+def test_index_of_missing_path_raises_value_error():
+    with pytest.raises(ValueError):
+        Playlist(paths(3)).index("/bilder/fehlt.jpg")
+
+
+def test_random_operations_match_a_list():
+    rng = random.Random(7)
+    pool = paths(200)
+    playlist = Playlist(pool[:50])
+    expected = pool[:50]
+    for _ in range(2000):
+        path = rng.choice(pool)
+        if rng.random() < 0.5:
+            if path not in expected:
+                expected.append(path)
+            playlist.append(path)
+        else:
+            if path in expected:
+                expected.remove(path)
+            playlist.remove(path)
+        if expected:
+            position = rng.randrange(len(expected))
+            assert playlist[position] == expected[position]
+            assert playlist.index(expected[position]) == position
+    assert_same(playlist, expected)
+
+
+def play(order, playlist, steps):
+    current = playlist[0]
+    shown = [current]
+    for _ in range(steps):
+        current = order.next(playlist, current)
+        shown.append(current)
+    return shown
+
+
+def test_shuffle_is_reproducible_with_seed():
+    playlist = Playlist(paths(30))
+    first = play(ShuffleOrder(seed=42, window=10), playlist, 100)
+    second = play(ShuffleOrder(seed=42, window=10), playlist, 100)
+    assert first == second
+    assert play(ShuffleOrder(seed=43, window=10), playlist, 100) != first
+
+
+def test_shuffle_does_not_repeat_within_window():
+    playlist = Playlist(paths(30))
+    window = 10
+    shown = play(ShuffleOrder(seed=1, window=window), playlist, 300)
+    for i in range(1, len(shown)):
+        assert shown[i] not in shown[max(0, i - window):i]
+
+
+def test_shuffle_upcoming_is_what_next_returns():
+    playlist = Playlist(paths(20))
+    order = ShuffleOrder(seed=5, window=5)
+    current = playlist[0]
+    upcoming = order.upcoming(playlist, current, 3)
+    for expected in upcoming:
+        current = order.next(playlist, current)
+        assert current == expected
+
+
+def test_shuffle_back_returns_history():
+    playlist = Playlist(paths(20))
+    order = ShuffleOrder(seed=3, window=5)
+    shown = play(order, playlist, 5)
+    current = shown[-1]
+    for expected in reversed(shown[:-1]):
+        current = order.back(playlist, current)
+        assert current == expected
+    assert order.back(playlist, current) is None
+    # Danach geht es in derselben Reihenfolge wieder vorwärts
+    assert order.next(playlist, current) == shown[1]
+
+
+def test_shuffle_skips_removed_images():
+    items = paths(10)
+    playlist = Playlist(items)
+    order = ShuffleOrder(seed=9, window=3)
+    upcoming = order.upcoming(playlist, items[0], 3)
+    playlist.remove(upcoming[0])
+    assert upcoming[0] not in order.upcoming(playlist, items[0], 3)
@@ -0,0 +1,73 @@
+import wave
+
+import numpy as np
+import pytest
+
+import bilderrahmen as br
+
+
+# Zwei Äusserungen (Chirp mit Rauschen) zwischen leisen Pausen als 16-Bit-WAV
+def write_utterances(path, count, rate=16000, seed=3):
+    rng = np.random.default_rng(seed)
+    parts = []
+    for _ in range(count):
+        parts.append(rng.normal(0, 30, int(0.6 * rate)))
+        t = np.arange(int(0.8 * rate)) / rate
+        parts.append(6000 * np.sin(2 * np.pi * (200 + 300 * t) * t) + rng.normal(0, 300, len(t)))
+        parts.append(rng.normal(0, 30, int(0.8 * rate)))
+    samples = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def running_state():
+    before = br.state.snapshot()
+    br.state.update(running=True, paused=False)
+    yield br.state
+    br.state.update(running=before.running, paused=before.paused)
+
+
+def make_listener(tmp_path, transcripts, count):
+    source = br.WavFileSource(write_utterances(tmp_path / "commands.wav", count))
+    return br.VoiceListener(source, br.TemplateHotwordSpotter(), br.ScriptedBackend(transcripts))
+
+
+def test_wav_replay_dispatches_commands(tmp_path, running_state):
+    listener = make_listener(tmp_path, ["hey berry stopp", "hey berry weiter"], 2)
+
+    heard, match = br.listen_for_command(listener)
+    assert heard and match.command == "stopp"
+    br.execute_command(match.command, match.text, match.number, match.argument)
+    assert running_state.snapshot().paused
+
+    heard, match = br.listen_for_command(listener)
+    assert heard and match.command == "weiter"
+    br.execute_command(match.command, match.text, match.number, match.argument)
+    assert not running_state.snapshot().paused
+
+    # Ende der Datei: keine weitere Äusserung
+    assert br.listen_for_command(listener) == (False, None)
+
+
+def test_hotword_alone_waits_for_following_command(tmp_path, running_state):
+    listener = make_listener(tmp_path, ["hey berry", "vorwärts"], 2)
+    heard, match = br.listen_for_command(listener)
+    assert heard and match is None
+    match = br.listen_for_following_command(listener)
+    assert match.command == "vorwärts"
+
+
+def test_utterance_without_hotword_is_ignored(tmp_path, running_state):
+    listener = make_listener(tmp_path, [["stopp", "stop"]], 1)
+    assert br.listen_for_command(listener) == (False, None)
+    assert not running_state.snapshot().paused
+
+
+def test_recognizer_backend_is_abstract():
+    with pytest.raises(TypeError):
+        br.RecognizerBackend()